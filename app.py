@@ -27,24 +27,32 @@ else:
     logger.error('Unknown county: %s', county, extra={'context': {'error': 'invalid_county'}})
     raise ValueError(f"Unknown county: {county}")
 
-logger.info('Running main module for county: %s', county, extra={'context': {'step': 'run_module'}})
-module.main()
-
 logger.info('Checking vision and pinecone enablement.', extra={'context': {'step': 'check_flags'}})
 vision_enabled = os.getenv('IS_VISION_ENABLED') == 'True'
 pinecone_enabled = os.getenv('IS_PINECONE_ENABLED') == 'True'
 
-if vision_enabled:
-    logger.info('Starting vision extraction.', extra={'context': {'step': 'vision_extraction'}})
-    import vision_extractor
-    vision_extractor.main()
-    logger.info('Vision extraction completed.', extra={'context': {'step': 'vision_complete'}})
-
-if pinecone_enabled:
-    logger.info('Starting Pinecone upload.', extra={'context': {'step': 'pinecone_upload'}})
-    import pinecone_uploader
-    pinecone_uploader.main()
-    logger.info('Pinecone upload completed.', extra={'context': {'step': 'pinecone_complete'}})
+# PIPELINE_MODE=streaming overlaps the stages: each PDF goes to vision extraction as soon
+# as it is downloaded, and on to Pinecone as soon as its text is ready
+if os.getenv('PIPELINE_MODE', 'sequential') == 'streaming':
+    logger.info('Running streaming pipeline for county: %s', county, extra={'context': {'step': 'run_pipeline'}})
+    import pipeline
+    pipeline.run(county, module.main, vision_enabled, pinecone_enabled)
+    logger.info('Streaming pipeline completed.', extra={'context': {'step': 'pipeline_complete'}})
+else:
+    logger.info('Running main module for county: %s', county, extra={'context': {'step': 'run_module'}})
+    module.main()
+
+    if vision_enabled:
+        logger.info('Starting vision extraction.', extra={'context': {'step': 'vision_extraction'}})
+        import vision_extractor
+        vision_extractor.main()
+        logger.info('Vision extraction completed.', extra={'context': {'step': 'vision_complete'}})
+
+    if pinecone_enabled:
+        logger.info('Starting Pinecone upload.', extra={'context': {'step': 'pinecone_upload'}})
+        import pinecone_uploader
+        pinecone_uploader.main()
+        logger.info('Pinecone upload completed.', extra={'context': {'step': 'pinecone_complete'}})
 
 logger.info('Process completed successfully.', extra={'context': {'step': 'end'}})
 # // This will write to logs/app_{current_date}.log.json with timestamp included
\ No newline at end of file
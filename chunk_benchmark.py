@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.chunker import TokenChunker
+
+# Usage: python chunk_benchmark.py [corpus_dir] [repeats]
+# Times the old per-page RecursiveCharacterTextSplitter chunking against TokenChunker
+# on every combined {instrument_id}.txt under corpus_dir.
+
+
+def load_corpus(root):
+    texts = []
+    for dirpath, _, filenames in os.walk(root):
+        instrument_id = os.path.basename(dirpath)
+        if f"{instrument_id}.txt" in filenames:
+            with open(os.path.join(dirpath, f"{instrument_id}.txt"), 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    return texts
+
+
+def legacy_chunks(text):
+    # What pinecone_uploader did before: a new splitter for every page
+    pages = text.split('--- Page ')
+    page_texts = [pages[0]] + [f'--- Page {p}' for p in pages[1:]] if pages[0] else [f'--- Page {p}' for p in pages[1:]]
+    chunks = []
+    for page_text in page_texts:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150, length_function=len)
+        chunks.extend(splitter.split_text(page_text))
+    return chunks
+
+
+def bench(name, chunk, texts, repeats):
+    best = None
+    count = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        count = sum(len(chunk(text)) for text in texts)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    megabytes = sum(len(text.encode('utf-8')) for text in texts) / 1024 / 1024
+    print(f"{name:<12} {count:>8} chunks  {best * 1000:>9.1f} ms  {megabytes / best if best else 0:>8.2f} MB/s")
+    return best
+
+
+def main(root, repeats):
+    texts = load_corpus(root)
+    if not texts:
+        print(f"No combined text files found under {root}")
+        return
+    print(f"Corpus: {len(texts)} documents, {sum(len(text) for text in texts):,} characters, best of {repeats} runs")
+    chunker = TokenChunker()
+    legacy = bench('recursive', legacy_chunks, texts, repeats)
+    tokens = bench('token', chunker.chunk, texts, repeats)
+    print(f"Speedup: {legacy / tokens:.1f}x")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join('data', 'extracted_text'),
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -27,7 +27,8 @@ def combine_json_to_excel(root_dir, output_file):
             json_found_in_dir = False
             # Look for a JSON file inside the subdirectory
             for filename in os.listdir(item_path):
-                if filename.endswith('.json'):
+                # Skip the vision extractor's page checkpoint; it sits next to the record
+                if filename.endswith('.json') and not filename.endswith('.checkpoint.json'):
                     json_found_in_dir = True
                     total_json_files_found += 1
                     file_path = os.path.join(item_path, filename)
@@ -0,0 +1,163 @@
+import os
+import json
+import importlib
+import threading
+from dotenv import load_dotenv
+from openai import OpenAI, APIConnectionError, InternalServerError
+
+from utils.logging_utils import setup_logger
+from utils.api_scheduler import ApiScheduler
+from utils.field_rules import RECORD_FIELDS, clean_party, extract_rule_fields, parse_amount, parse_date
+
+logger = setup_logger()
+
+# --- Configuration ---
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Fields the rules can't find are filled in by this model; a small one is plenty for lookup
+FIELD_EXTRACTION_MODEL = os.getenv("FIELD_EXTRACTION_MODEL", "gpt-4o-mini")
+FIELD_EXTRACTION_ENABLED = os.getenv("FIELD_EXTRACTION_ENABLED", "True") == "True"
+# Set to True to have the LLM fill fields the rules missed (one paid call per such instrument)
+FIELD_EXTRACTION_LLM = os.getenv("FIELD_EXTRACTION_LLM", "False") == "True"
+# Field lookups share one scheduler, budgeted separately from vision OCR since the model differs
+FIELD_EXTRACTION_MAX_CONCURRENCY = int(os.getenv("FIELD_EXTRACTION_MAX_CONCURRENCY", "4"))
+FIELD_EXTRACTION_REQUESTS_PER_MINUTE = int(os.getenv("FIELD_EXTRACTION_REQUESTS_PER_MINUTE", "500"))
+FIELD_EXTRACTION_TOKENS_PER_MINUTE = int(os.getenv("FIELD_EXTRACTION_TOKENS_PER_MINUTE", "200000"))
+# The parties, amount and identifiers sit on the first pages; only this much text is sent
+FIELD_EXTRACTION_MAX_CHARS = int(os.getenv("FIELD_EXTRACTION_MAX_CHARS", "12000"))
+
+COUNTY = os.getenv("COUNTY")
+if COUNTY:
+    config = importlib.import_module(f'{COUNTY}.config').load_config()
+    DOCUMENT_TYPE = config.get('DOCUMENT_TYPE')
+    EXTRACTED_TEXT_DIRECTORY = f"{config.get('EXTRACTED_TEXT_DIRECTORY', 'data/extracted_text')}/{config.get('COUNTY_COLLECTION', 'County')}/{config.get('COUNTY_NAMESPACE')}/{DOCUMENT_TYPE}"
+else:
+    DOCUMENT_TYPE = os.getenv("DOCUMENT_TYPE")
+    EXTRACTED_TEXT_DIRECTORY = os.getenv("EXTRACTED_TEXT_DIRECTORY", "data/extracted_text")
+
+FIELD_DESCRIPTIONS = {
+    'debtor': 'borrower, mortgagor or property owner the instrument is against (all names, as written)',
+    'creditor': 'lender, mortgagee, lienor or claimant (as written)',
+    'amount': 'principal or lien amount in US dollars, as a number',
+    'parcel_id': 'parcel ID / folio number of the property',
+    'loan_number': 'loan number',
+    'recording_date': 'date the instrument was recorded by the clerk, as MM/DD/YYYY',
+}
+# --- End Configuration ---
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared OpenAI client for field lookups, or None without an API key."""
+    global _client
+    with _client_lock:
+        if _client is None and OPENAI_API_KEY:
+            # Retries are left to the scheduler so it can see 429s and adapt concurrency
+            _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return _client
+
+
+scheduler = ApiScheduler(
+    'fields',
+    max_concurrency=FIELD_EXTRACTION_MAX_CONCURRENCY,
+    requests_per_minute=FIELD_EXTRACTION_REQUESTS_PER_MINUTE,
+    tokens_per_minute=FIELD_EXTRACTION_TOKENS_PER_MINUTE,
+    retryable=(APIConnectionError, InternalServerError),
+)
+
+
+def record_path(output_dir, instrument_id):
+    return os.path.join(output_dir, f"{instrument_id}.json")
+
+
+def get_field_prompt(missing):
+    fields = '\n'.join(f'- "{field}": {FIELD_DESCRIPTIONS[field]}' for field in missing)
+    return f"""
+    You extract fields from the OCR text of a recorded county document (mortgage or lien).
+    Return a JSON object with exactly these keys:
+    {fields}
+    Use null for any field that the text does not state. Do not guess.
+    """
+
+
+def llm_fields(text, missing):
+    """Asks the model for just the `missing` fields; returns {field: normalized value or None}."""
+    response = get_client().chat.completions.create(
+        model=FIELD_EXTRACTION_MODEL,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": get_field_prompt(missing)},
+            {"role": "user", "content": text[:FIELD_EXTRACTION_MAX_CHARS]},
+        ],
+    )
+    answer = json.loads(response.choices[0].message.content or '{}')
+    # Same types as the rules produce, so the record doesn't depend on who found a field
+    normalize = {'amount': parse_amount, 'recording_date': parse_date, 'debtor': clean_party, 'creditor': clean_party}
+    values = {}
+    for field in missing:
+        value = answer.get(field)
+        if field in normalize:
+            value = normalize[field](value)
+        elif value is not None:
+            value = str(value).strip() or None
+        values[field] = value
+    return values
+
+
+def extract_record(output_dir, instrument_id, text, document_type=None):
+    """
+    Builds the typed record for one instrument from its OCR text and writes it to
+    {instrument_id}.json in output_dir, where combine_liens picks it up. Rules run
+    first; the LLM is only asked for fields they left empty. Never raises: a failed
+    LLM call still leaves the rule-based record on disk. Returns the record.
+    """
+    record = {'instrument_id': instrument_id, 'document_type': document_type or DOCUMENT_TYPE}
+    fields = extract_rule_fields(text)
+    missing = [field for field in RECORD_FIELDS if fields[field] is None]
+    llm_filled = []
+    if missing and FIELD_EXTRACTION_LLM and get_client() is not None:
+        try:
+            # Through the scheduler, so lookups respect the rate budgets and back off on 429s
+            estimated_tokens = (len(get_field_prompt(missing)) + min(len(text), FIELD_EXTRACTION_MAX_CHARS)) // 4
+            lookup = scheduler.submit(llm_fields, text, missing, estimated_tokens=estimated_tokens)
+            for field, value in lookup.result().items():
+                if value is not None:
+                    fields[field] = value
+                    llm_filled.append(field)
+        except Exception as e:
+            logger.error('LLM field extraction failed; keeping rule-based fields.', extra={'context': {'instrument_id': instrument_id, 'missing': missing, 'error': str(e)}})
+    record.update(fields)
+    record['llm_fields'] = ', '.join(llm_filled)
+
+    json_filepath = record_path(output_dir, instrument_id)
+    with open(json_filepath, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+    logger.info('Saved extracted fields.', extra={'context': {
+        'instrument_id': instrument_id, 'json_filepath': json_filepath, 'rule_fields': len(RECORD_FIELDS) - len(missing),
+        'llm_fields': llm_filled, 'still_missing': [field for field in RECORD_FIELDS if fields[field] is None],
+    }})
+    print(f"🧾 Saved extracted fields for {instrument_id} to {json_filepath}")
+    return record
+
+
+def main():
+    """Backfills {instrument_id}.json for every extracted instrument that doesn't have one yet."""
+    logger.info('Starting field extraction backfill.', extra={'context': {'root': EXTRACTED_TEXT_DIRECTORY}})
+    written = 0
+    for instrument_id in sorted(os.listdir(EXTRACTED_TEXT_DIRECTORY)):
+        output_dir = os.path.join(EXTRACTED_TEXT_DIRECTORY, instrument_id)
+        txt_filepath = os.path.join(output_dir, f"{instrument_id}.txt")
+        if not os.path.isfile(txt_filepath) or os.path.exists(record_path(output_dir, instrument_id)):
+            continue
+        with open(txt_filepath, 'r', encoding='utf-8') as f:
+            extract_record(output_dir, instrument_id, f.read())
+        written += 1
+    logger.info('Field extraction backfill completed.', extra={'context': {'records_written': written}})
+    print(f"✅ Wrote {written} field records.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import random
+import time
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+# Firestore rejects WriteBatch commits with more than 500 operations
+MAX_BATCH_SIZE = 500
+
+
+class FirestoreBatchWriter:
+    """
+    Commits lists of Firestore set() writes as WriteBatch commits of up to 500
+    writes each. Nothing is buffered: commit() is synchronous and reports which
+    writes could not be committed, so the caller decides what to retry. Failed
+    commits are retried with exponential backoff first.
+    """
+
+    def __init__(self, db, max_batch_size=MAX_BATCH_SIZE, max_retries=5, backoff_seconds=0.5):
+        self.db = db
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+
+    def commit(self, writes):
+        """
+        Commits (doc_ref, data, merge) writes synchronously in chunks of max_batch_size.
+        Returns the set of indexes into writes whose chunk could not be committed.
+        """
+        failed = set()
+        for start in range(0, len(writes), self.max_batch_size):
+            chunk = writes[start:start + self.max_batch_size]
+            if not self._commit_with_retry(chunk):
+                failed.update(range(start, start + len(chunk)))
+        return failed
+
+    def _commit_with_retry(self, chunk):
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = self.db.batch()
+                for doc_ref, data, merge in chunk:
+                    batch.set(doc_ref, data, merge=merge)
+                batch.commit()
+                logger.info('Committed Firestore batch.', extra={'context': {'writes': len(chunk), 'attempt': attempt + 1}})
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error('Firestore batch commit failed.', extra={'context': {'writes': len(chunk), 'attempts': attempt + 1, 'error': str(e)}})
+                    return False
+                delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random())
+                logger.warning('Firestore batch commit failed, retrying.', extra={'context': {'writes': len(chunk), 'attempt': attempt + 1, 'retry_in_seconds': round(delay, 2), 'error': str(e)}})
+                time.sleep(delay)
+        return False
@@ -15,7 +15,16 @@ def load_config():
         'END_DATE': "07/17/2025", 
         'COUNTY_COLLECTION': "County", 
         'COUNTY_NAMESPACE': "hillsclerk", 
-        'PDF_DIRECTORY': "data" 
+        'PDF_DIRECTORY': "data",
+        # PDF download engine: 'sequential' (one page, one instrument at a time),
+        # 'concurrent' (pool of browser pages resolving URLs + pool of byte fetchers) or
+        # 'http' (cookies bootstrapped once, URLs resolved with plain HTTP, browser as fallback)
+        'PDF_DOWNLOAD_MODE': os.getenv("PDF_DOWNLOAD_MODE", "sequential"),
+        'PDF_RESOLVER_WORKERS': int(os.getenv("PDF_RESOLVER_WORKERS", "4")),
+        'PDF_FETCH_WORKERS': int(os.getenv("PDF_FETCH_WORKERS", "8")),
+        # Split the search window into shards of this many days (0 = one search for the whole range)
+        'SEARCH_SHARD_DAYS': int(os.getenv("SEARCH_SHARD_DAYS", "0")),
+        'SEARCH_WORKERS': int(os.getenv("SEARCH_WORKERS", "2"))
     }
     logger.info("Base configuration set", extra={'context': {'config_keys': list(config.keys())}})
     # Compute dynamic CSV path
@@ -9,12 +9,14 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from firebase_utils.firebase_config import init_firebase
 from utils.logging_utils import setup_logger  # Add this import for logging
+from utils.wait_strategy import wait_for_selector
+from utils.job_store import get_job_store, start_firestore_mirror
 
 logger = setup_logger()  # Initialize logger early
 
 def scrape_details(page, instrument_id, base_url_instrument):
     page.goto(base_url_instrument.format(instrument_id))
-    page.wait_for_selector("#dataPanel", timeout=30000)
+    wait_for_selector(page, "#dataPanel", 'document_page')
 
     rows = page.query_selector_all("#dataPanel .row")
     data = {"instrument": instrument_id, "direct_link": base_url_instrument.format(instrument_id)}
@@ -60,6 +62,9 @@ def main():
     print(f"Reading data from {csv_file_path}...")
     df = pd.read_csv(csv_file_path)
     db = init_firebase()
+    jobs = get_job_store()
+    # Firestore is updated asynchronously from the local job store
+    mirror = start_firestore_mirror(db, config['COUNTY_COLLECTION'])
 
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=config['HEADLESS_MODE'])
@@ -84,13 +89,8 @@ def main():
                     'created_at': datetime.datetime.now()
                 }
                 
-                logger.info('Updating Firebase.', extra={'context': {'step': 'update_firebase', 'instrument_id': instrument_id}})
-                # Update to Firebase (using nested path if configured)
-                doc_ref = db.collection(config['COUNTY_COLLECTION']) \
-                    .document(config['COUNTY_NAMESPACE']) \
-                    .collection(config['DOCUMENT_TYPE']) \
-                    .document(instrument_id)
-                doc_ref.set(update_data, merge=True)
+                logger.info('Updating job store.', extra={'context': {'step': 'update_job_store', 'instrument_id': instrument_id}})
+                jobs.update(config['COUNTY_NAMESPACE'], config['DOCUMENT_TYPE'], instrument_id, update_data)
                 print(f"✅ Updated: {instrument_id}")
             except Exception as e:
                 logger.error('Error scraping instrument.', extra={'context': {'error': str(e), 'instrument_id': instrument_id}})
@@ -98,6 +98,7 @@ def main():
 
         browser.close()
 
+    mirror.stop()
     logger.info('Process completed successfully.', extra={'context': {'step': 'end'}})
 
 if __name__ == "__main__":
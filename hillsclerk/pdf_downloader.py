@@ -1,16 +1,24 @@
 import os
+import re
+import html
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
 from urllib.parse import urljoin, urlparse, parse_qs, unquote
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
 import sys
 
 # Adjust sys.path to include the parent directory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from firebase_utils.firebase_config import init_firebase
 from .config import load_config
+from utils.http_session import get_session_manager, stream_download
+from utils.wait_strategy import wait_for_selector, wait_for_network_idle, log_wait_summary
+from utils.job_store import get_job_store, start_firestore_mirror
 from utils.logging_utils import setup_logger  # Add this import for logging
 
 logger = setup_logger()  # Initialize logger early
@@ -36,6 +44,12 @@ os.makedirs(PDF_DIRECTORY, exist_ok=True)
 # Ensure directory exists
 os.makedirs(PDF_DIRECTORY, exist_ok=True)
 
+# Keep-alive pools and cookies shared by every download in this process
+http_sessions = get_session_manager(pool_maxsize=max(config['PDF_FETCH_WORKERS'], 10))
+# Matches the docDisplay iframe tag in the server-rendered instrument page
+DOC_DISPLAY_IFRAME_PATTERN = re.compile(r'<iframe\b[^>]*\bid\s*=\s*["\']docDisplay["\'][^>]*>', re.IGNORECASE)
+IFRAME_SRC_PATTERN = re.compile(r'\bsrc\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+
 #
 # Replace your original download_pdf function with this one.
 #
@@ -56,19 +70,8 @@ def download_pdf(page, instrument_id):
     # 1. Get the direct PDF URL from the iframe
     try:
         logger.info('Waiting for iframe selector.', extra={'context': {'step': 'wait_iframe', 'instrument_id': instrument_id}})
-        iframe_handle = page.wait_for_selector("iframe#docDisplay", state="visible", timeout=60000)
-        iframe_src = iframe_handle.get_attribute("src")
-        if not iframe_src:
-            raise Exception("Iframe found, but has no 'src' attribute.")
-
-        parsed_url = urlparse(iframe_src)
-        file_param = parse_qs(parsed_url.query).get("file", [None])[0]
-        if not file_param:
-            raise Exception("Could not find 'file' parameter in iframe src.")
-
-        pdf_relative_path = unquote(file_param)
-        base_url = "https://publicaccess.hillsclerk.com"
-        pdf_url = urljoin(base_url, pdf_relative_path)
+        iframe_handle = wait_for_selector(page, "iframe#docDisplay", 'pdf_viewer', timeout=60000)
+        pdf_url = extract_pdf_url(iframe_handle.get_attribute("src"))
         logger.info('Extracted PDF URL.', extra={'context': {'step': 'extract_url', 'instrument_id': instrument_id, 'pdf_url': pdf_url}})
         print(f"Found PDF URL: {pdf_url}")
 
@@ -84,37 +87,45 @@ def download_pdf(page, instrument_id):
         logger.warning('No cookies found.', extra={'context': {'step': 'extract_cookies', 'instrument_id': instrument_id}})
         print("⚠️ Warning: No cookies found. Download may fail if authentication is required.")
 
-    # 3. Use 'requests' with the session cookies to download the file
-    try:
-        logger.info('Starting file download with requests.', extra={'context': {'step': 'start_download', 'instrument_id': instrument_id, 'pdf_url': pdf_url}})
-        print("Starting file download with 'requests'...")
-        # Create a session object to persist cookies
-        s = requests.Session()
+    # 3. Use 'requests' with the session cookies to download the file; cookies are
+    # only re-copied into the shared session when they changed
+    http_sessions.sync_cookies(cookies)
+    return fetch_pdf(pdf_url, instrument_id)
 
-        # Load the cookies from Playwright into the requests session
-        for cookie in cookies:
-            s.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
 
-        # Set a user-agent header to mimic a real browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # Make the request with streaming enabled to handle large files
-        # Set a generous timeout for the connection and initial response
-        response = s.get(pdf_url, headers=headers, stream=True, timeout=(10, 300)) # (connect_timeout, read_timeout)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+def extract_pdf_url(iframe_src):
+    """Builds the absolute PDF URL from the 'file' query parameter of the docDisplay iframe src."""
+    if not iframe_src:
+        raise Exception("Iframe found, but has no 'src' attribute.")
 
+    parsed_url = urlparse(iframe_src)
+    file_param = parse_qs(parsed_url.query).get("file", [None])[0]
+    if not file_param:
+        raise Exception("Could not find 'file' parameter in iframe src.")
+
+    pdf_relative_path = unquote(file_param)
+    base_url = "https://publicaccess.hillsclerk.com"
+    return urljoin(base_url, pdf_relative_path)
+
+
+def fetch_pdf(pdf_url, instrument_id):
+    """
+    Streams the PDF at pdf_url to PDF_DIRECTORY through the shared pooled session.
+    Safe to call from worker threads; cookies are synced by the thread that owns
+    the browser context, never here, so concurrent fetches see a complete jar.
+    """
+    try:
+        logger.info('Starting file download with requests.', extra={'context': {'step': 'start_download', 'instrument_id': instrument_id, 'pdf_url': pdf_url}})
+        print("Starting file download with 'requests'...")
         file_path = os.path.join(PDF_DIRECTORY, f"{instrument_id}.pdf")
-        
-        # Write the file to disk in chunks
+
+        # Bytes land in a .part file that is renamed into place once complete, so an
+        # interrupted fetch never leaves a truncated PDF behind
         logger.info('Streaming download to file.', extra={'context': {'step': 'stream_download', 'instrument_id': instrument_id, 'file_path': file_path}})
         print(f"Streaming download to: {file_path}")
-        with open(file_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        logger.info('PDF download successful.', extra={'context': {'step': 'download_success', 'instrument_id': instrument_id, 'file_path': file_path}})
+        file_path, size, sha256 = stream_download(http_sessions, pdf_url, file_path, timeout=(10, 300))  # (connect_timeout, read_timeout)
+
+        logger.info('PDF download successful.', extra={'context': {'step': 'download_success', 'instrument_id': instrument_id, 'file_path': file_path, 'size': size, 'sha256': sha256}})
         return file_path
 
     except requests.exceptions.RequestException as e:
@@ -125,6 +136,163 @@ def download_pdf(page, instrument_id):
         raise Exception(f"❌ An unexpected error occurred during download: {e}")
 
 
+def resolve_pdf_url_http(session, instrument_id):
+    """
+    Resolves the PDF URL with a single plain HTTP request by parsing the docDisplay
+    iframe src out of the instrument page HTML. Raises if the iframe can't be found.
+    """
+    response = session.get(BASE_URL_INSTRUMENT.format(instrument_id), timeout=(10, 60))
+    response.raise_for_status()
+
+    iframe_match = DOC_DISPLAY_IFRAME_PATTERN.search(response.text)
+    if not iframe_match:
+        raise Exception("docDisplay iframe not present in instrument page HTML.")
+    src_match = IFRAME_SRC_PATTERN.search(iframe_match.group(0))
+    return extract_pdf_url(html.unescape(src_match.group(1)) if src_match else None)
+
+
+def download_via_http(instrument_ids, db):
+    """
+    Bootstraps session cookies once through Playwright, then resolves each PDF URL
+    with plain HTTP. Falls back to the full browser flow only when parsing fails.
+    """
+    downloaded, fallbacks, failed = 0, 0, 0
+    with sync_playwright() as p:
+        logger.info('Launching browser.', extra={'context': {'step': 'launch_browser', 'headless': HEADLESS_MODE}})
+        browser = p.chromium.launch(headless=HEADLESS_MODE)
+        context = browser.new_context()
+        page = context.new_page()
+
+        logger.info('Bootstrapping session cookies.', extra={'context': {'step': 'bootstrap_cookies', 'url': config['BASE_URL']}})
+        page.goto(config['BASE_URL'], timeout=90000)
+        wait_for_network_idle(page, 'bootstrap_cookies')
+        # Everything below runs on this thread, so the manager may re-read cookies itself
+        http_sessions.bind_cookie_source(context.cookies)
+
+        for instrument_id in instrument_ids:
+            logger.info('Processing instrument for PDF download.', extra={'context': {'step': 'process_instrument', 'instrument_id': instrument_id, 'mode': 'http'}})
+            print(f"📄 Downloading PDF for Instrument: {instrument_id}")
+            try:
+                try:
+                    pdf_url = resolve_pdf_url_http(http_sessions, instrument_id)
+                    logger.info('Extracted PDF URL.', extra={'context': {'step': 'extract_url', 'instrument_id': instrument_id, 'pdf_url': pdf_url, 'resolver': 'http'}})
+                    http_sessions.sync_cookies(context.cookies())
+                    pdf_path = fetch_pdf(pdf_url, instrument_id)
+                except Exception as e:
+                    logger.warning('HTTP resolver failed, falling back to browser.', extra={'context': {'step': 'resolver_fallback', 'instrument_id': instrument_id, 'error': str(e)}})
+                    fallbacks += 1
+                    # download_pdf syncs any cookies the browser picked up into the shared session
+                    pdf_path = download_pdf(page, instrument_id)
+
+                record_pdf_download(db, instrument_id, pdf_path)
+                downloaded += 1
+                print(f"✅ PDF saved: {pdf_path}")
+            except Exception as e:
+                failed += 1
+                logger.error('Error downloading PDF for instrument.', extra={'context': {'error': str(e), 'instrument_id': instrument_id}})
+                print(f"❌ Error downloading for {instrument_id}: {e}")
+
+        http_sessions.bind_cookie_source(None)
+        context.close()
+        browser.close()
+
+    logger.info('HTTP resolver download finished.', extra={'context': {'step': 'http_complete', 'downloaded': downloaded, 'browser_fallbacks': fallbacks, 'failed': failed}})
+    return downloaded, failed
+
+
+def record_pdf_download(db, instrument_id, pdf_path):
+    """Marks the instrument as downloaded in the job store; Firestore is updated by the mirror."""
+    logger.info('Updating job store with PDF details.', extra={'context': {'step': 'update_job_store', 'instrument_id': instrument_id, 'pdf_path': pdf_path}})
+    get_job_store().update(config.get('COUNTY_NAMESPACE'), config.get('DOCUMENT_TYPE', 'mortgage_records'), instrument_id, {
+        "pdf_downloaded": True,
+        "pdf_path": pdf_path,
+        "status": "pdf_downloaded"
+    })
+
+
+#
+# Concurrent engine: N Playwright pages in one browser context resolve the
+# docDisplay URLs, and a separate thread pool streams the bytes. Resolving is
+# bound by page latency and fetching by bandwidth, so each gets its own limit.
+#
+async def _resolve_worker(worker_id, context, instrument_queue, fetch_executor, db, fetch_futures, failures):
+    page = await context.new_page()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            instrument_id = await instrument_queue.get()
+            if instrument_id is None:
+                break
+            logger.info('Resolving PDF URL.', extra={'context': {'step': 'resolve_url', 'worker_id': worker_id, 'instrument_id': instrument_id}})
+            try:
+                await page.goto(BASE_URL_INSTRUMENT.format(instrument_id), timeout=90000)
+                iframe_handle = await page.wait_for_selector("iframe#docDisplay", state="visible", timeout=60000)
+                pdf_url = extract_pdf_url(await iframe_handle.get_attribute("src"))
+                # Synced here, on the event loop, rather than in the fetcher threads
+                http_sessions.sync_cookies(await context.cookies())
+            except Exception as e:
+                logger.error('Failed to extract PDF URL.', extra={'context': {'error': str(e), 'worker_id': worker_id, 'instrument_id': instrument_id}})
+                print(f"❌ Failed to extract PDF URL for {instrument_id}: {e}")
+                failures.append(instrument_id)
+                continue
+
+            logger.info('Extracted PDF URL.', extra={'context': {'step': 'extract_url', 'worker_id': worker_id, 'instrument_id': instrument_id, 'pdf_url': pdf_url}})
+            fetch_futures.append(loop.run_in_executor(fetch_executor, _fetch_and_record, db, pdf_url, instrument_id))
+    finally:
+        await page.close()
+
+
+def _fetch_and_record(db, pdf_url, instrument_id):
+    pdf_path = fetch_pdf(pdf_url, instrument_id)
+    record_pdf_download(db, instrument_id, pdf_path)
+    print(f"✅ PDF saved: {pdf_path}")
+    return pdf_path
+
+
+async def _download_concurrently(instrument_ids, db, resolver_workers, fetch_workers):
+    instrument_queue = asyncio.Queue()
+    for instrument_id in instrument_ids:
+        instrument_queue.put_nowait(instrument_id)
+    for _ in range(resolver_workers):
+        instrument_queue.put_nowait(None)  # one stop sentinel per resolver
+
+    fetch_futures = []
+    failures = []
+    async with async_playwright() as p:
+        logger.info('Launching browser.', extra={'context': {'step': 'launch_browser', 'headless': HEADLESS_MODE}})
+        browser = await p.chromium.launch(headless=HEADLESS_MODE)
+        context = await browser.new_context()
+        with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_executor:
+            await asyncio.gather(*[
+                _resolve_worker(worker_id, context, instrument_queue, fetch_executor, db, fetch_futures, failures)
+                for worker_id in range(resolver_workers)
+            ])
+            # Browser work is done; only byte fetches may still be in flight
+            logger.info('All PDF URLs resolved.', extra={'context': {'step': 'resolve_complete', 'queued_fetches': len(fetch_futures)}})
+            await context.close()
+            await browser.close()
+            results = await asyncio.gather(*fetch_futures, return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error('Error downloading PDF for instrument.', extra={'context': {'error': str(result)}})
+            print(f"❌ {result}")
+    downloaded = sum(1 for result in results if not isinstance(result, Exception))
+    return downloaded, len(failures) + len(results) - downloaded
+
+
+def download_concurrently(instrument_ids, db, resolver_workers=None, fetch_workers=None):
+    resolver_workers = max(1, resolver_workers or config.get('PDF_RESOLVER_WORKERS', 4))
+    fetch_workers = max(1, fetch_workers or config.get('PDF_FETCH_WORKERS', 8))
+    logger.info('Starting concurrent PDF download.', extra={'context': {'step': 'concurrent_download', 'instruments': len(instrument_ids), 'resolver_workers': resolver_workers, 'fetch_workers': fetch_workers}})
+    started = time.monotonic()
+    downloaded, failed = asyncio.run(_download_concurrently(instrument_ids, db, resolver_workers, fetch_workers))
+    elapsed = time.monotonic() - started
+    logger.info('Concurrent PDF download finished.', extra={'context': {'step': 'concurrent_complete', 'downloaded': downloaded, 'failed': failed, 'elapsed_seconds': round(elapsed, 2)}})
+    print(f"📦 Downloaded {downloaded} PDFs ({failed} failed) in {elapsed:.1f}s")
+    return downloaded, failed
+
+
 def main():
     logger.info('Starting PDF downloader main process.', extra={'context': {'step': 'init'}})
     # CSV path
@@ -139,6 +307,18 @@ def main():
     print(f"Reading data from {CSV_FILE}...")
     df = pd.read_csv(CSV_FILE)
     db = init_firebase()
+    mirror = start_firestore_mirror(db, config.get('COUNTY_COLLECTION', 'County'))
+
+    download_mode = config.get('PDF_DOWNLOAD_MODE', 'sequential')
+    if download_mode in ('concurrent', 'http'):
+        instrument_ids = [str(instrument).strip() for instrument in df["Instrument"]]
+        if download_mode == 'concurrent':
+            download_concurrently(instrument_ids, db)
+        else:
+            download_via_http(instrument_ids, db)
+        mirror.stop()
+        logger.info('PDF downloader process completed successfully.', extra={'context': {'step': 'end'}})
+        return
 
     with sync_playwright() as p:
         logger.info('Launching browser.', extra={'context': {'step': 'launch_browser', 'headless': HEADLESS_MODE}})
@@ -166,16 +346,7 @@ def main():
                 pdf_path = download_pdf(page, instrument_id)
 
                 # Update Firebase
-                logger.info('Updating Firebase with PDF details.', extra={'context': {'step': 'update_firebase', 'instrument_id': instrument_id, 'pdf_path': pdf_path}})
-                doc_ref = db.collection(config.get('COUNTY_COLLECTION', 'County')) \
-                    .document(config.get('COUNTY_NAMESPACE')) \
-                    .collection(config.get('DOCUMENT_TYPE', 'mortgage_records')) \
-                    .document(instrument_id)
-                doc_ref.set({
-                    "pdf_downloaded": True,
-                    "pdf_path": pdf_path,
-                    "status": "pdf_downloaded"
-                }, merge=True)
+                record_pdf_download(db, instrument_id, pdf_path)
 
                 print(f"✅ PDF saved: {pdf_path}")
             except Exception as e:
@@ -186,7 +357,9 @@ def main():
         logger.info('Closing browser context and browser.', extra={'context': {'step': 'cleanup'}})
         context.close()
         browser.close()
+        log_wait_summary()
 
+    mirror.stop()
     logger.info('PDF downloader process completed successfully.', extra={'context': {'step': 'end'}})
 
 if __name__ == "__main__":
@@ -1,12 +1,107 @@
 import os
-import time
 from playwright.sync_api import sync_playwright
 from .config import load_config
 # from pdf_downloader import DOWNLOAD_DIRECTORY
 from utils.logging_utils import setup_logger  # Add this import for logging
+from utils.wait_strategy import wait_for_selector, wait_for_overlay, expect_download, log_wait_summary
+from utils.search_planner import plan_shards, run_shards, merge_csvs
 
 logger = setup_logger()  # Initialize logger early
 
+def search_and_export(context, config, start_date, end_date, download_dir):
+    """Runs one document-type search for start_date..end_date and saves the spreadsheet export to download_dir."""
+    logger.info('Creating new page.', extra={'context': {'step': 'create_page'}})
+    page = context.new_page()
+
+    # Step 1: Open the portal
+    logger.info('Opening portal.', extra={'context': {'step': 'open_portal', 'url': config['BASE_URL']}})
+    print("Opening portal...")
+    page.goto(config['BASE_URL'])
+
+    # Step 2: Click "Document Type" tab
+    logger.info('Waiting for Document Type tab.', extra={'context': {'step': 'wait_tab'}})
+    print("Waiting for 'Document Type' tab...")
+    wait_for_selector(page, 'div#ORI-Document\\ Type', 'search_form')
+    page.click('div#ORI-Document\\ Type')
+
+    # Step 3: Wait for loading to complete
+    wait_for_selector(page, "div#loading", 'search_form_loading', state="hidden")
+
+    # Step 4: Select document type from dropdown
+    logger.info('Selecting document type.', extra={'context': {'step': 'select_document_type', 'type': config['DOCUMENT_TYPE']}})
+    print(f"Selecting document type: {config['DOCUMENT_TYPE']}...")
+    page.click('input.chosen-search-input')
+    # Fill with just the code, e.g., MTG, for better searching
+    doc_code = config['DOCUMENT_TYPE'].split(')')[0].replace('(', '')
+    page.fill('input.chosen-search-input', doc_code)
+    wait_for_selector(page, 'li.active-result, li.result-selected', 'document_type_options')
+
+    # Use the exact match from shared HTML
+    options = page.query_selector_all('li.active-result, li.result-selected')
+    for option in options:
+        if config['DOCUMENT_TYPE'] in option.inner_text().strip():
+            option.click()
+            logger.info('Document type selected.', extra={'context': {'step': 'document_selected', 'type': config['DOCUMENT_TYPE']}})
+            print(f"✅ Selected {config['DOCUMENT_TYPE']}")
+            break
+    else:
+        logger.error('Document type not found in dropdown.', extra={'context': {'error': 'not_found', 'type': config['DOCUMENT_TYPE']}})
+        print(f"❌ '{config['DOCUMENT_TYPE']}' not found in dropdown.")
+        return None
+
+    # Step 5: Fill in the date range
+    logger.info('Filling date range.', extra={'context': {'step': 'fill_dates', 'start': start_date, 'end': end_date}})
+    print("Filling date range...")
+    page.fill('input#OBKey__1634_1', start_date)
+    page.fill('input#OBKey__1634_2', end_date)
+
+    # Step 6: Click Search
+    logger.info('Clicking Search.', extra={'context': {'step': 'click_search'}})
+    print("Clicking Search...")
+    page.click('button#sub')
+
+    # Step 7: Wait for results
+    logger.info('Waiting for results.', extra={'context': {'step': 'wait_results'}})
+    print("Waiting for results...")
+    # The loading overlay appears shortly after the click; wait for it to come and go
+    wait_for_overlay(page, "div#loading", 'search_results')
+
+    # Step 8: Export to Spreadsheet
+    logger.info('Exporting to spreadsheet.', extra={'context': {'step': 'export_spreadsheet'}})
+    print("Exporting to spreadsheet...")
+    download = expect_download(page, lambda: page.click("span:text('Export to Spreadsheet')"))
+
+    # Step 9: Save the file
+    os.makedirs(download_dir, exist_ok=True)
+    file_path = os.path.join(download_dir, download.suggested_filename)
+    download.save_as(file_path)
+    logger.info('File downloaded.', extra={'context': {'step': 'download_success', 'path': file_path}})
+    print(f"✅ File downloaded to: {file_path}")
+    return file_path
+
+
+def run_sharded(config, download_dir):
+    """
+    Splits START_DATE..END_DATE into SEARCH_SHARD_DAYS-day shards, exports each on a
+    pool of browser contexts and merges them into the CSV the later stages read.
+    Shards finished by an earlier run are skipped.
+    """
+    shards = plan_shards(config['START_DATE'], config['END_DATE'], config['SEARCH_SHARD_DAYS'])
+    csv_paths = run_shards(
+        shards,
+        lambda context, start_date, end_date, shard_dir: search_and_export(context, config, start_date, end_date, shard_dir),
+        download_dir,
+        workers=config['SEARCH_WORKERS'],
+        headless=config['HEADLESS_MODE'],
+    )
+    if not csv_paths:
+        logger.error('No search shard completed.', extra={'context': {'step': 'sharded_search', 'shards': len(shards)}})
+        return None
+    file_path = merge_csvs(csv_paths, os.path.join(download_dir, "OfficialRecords_Results.csv"), key_column="Instrument")
+    print(f"✅ Merged {len(csv_paths)}/{len(shards)} shard exports into: {file_path}")
+    return file_path
+
+
 def run():
     logger.info('Loading configuration.', extra={'context': {'step': 'load_config'}})
     config = load_config()
@@ -20,87 +115,23 @@ def run():
     logger.info('Creating download directory.', extra={'context': {'step': 'create_directory', 'path': DOWNLOAD_DIR}})
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
+    if config.get('SEARCH_SHARD_DAYS'):
+        run_sharded(config, DOWNLOAD_DIR)
+        log_wait_summary()
+        logger.info('Search scraper process completed successfully.', extra={'context': {'step': 'end'}})
+        return
+
     with sync_playwright() as p:
         logger.info('Launching browser.', extra={'context': {'step': 'launch_browser', 'headless': config['HEADLESS_MODE']}})
         browser = p.chromium.launch(headless=config['HEADLESS_MODE'])
         logger.info('Creating browser context.', extra={'context': {'step': 'create_context'}})
         context = browser.new_context(accept_downloads=True)
-        logger.info('Creating new page.', extra={'context': {'step': 'create_page'}})
-        page = context.new_page()
-
-        # Step 1: Open the portal
-        logger.info('Opening portal.', extra={'context': {'step': 'open_portal', 'url': config['BASE_URL']}})
-        print("Opening portal...")
-        page.goto(config['BASE_URL'])
-
-        # Step 2: Click "Document Type" tab
-        logger.info('Waiting for Document Type tab.', extra={'context': {'step': 'wait_tab'}})
-        print("Waiting for 'Document Type' tab...")
-        page.wait_for_selector('div#ORI-Document\\ Type', state='visible')
-        page.click('div#ORI-Document\\ Type')
-
-        # Step 3: Wait for loading to complete
-        page.wait_for_selector("div#loading", state="hidden")
-
-        # Step 4: Select document type from dropdown
-        logger.info('Selecting document type.', extra={'context': {'step': 'select_document_type', 'type': config['DOCUMENT_TYPE']}})
-        print(f"Selecting document type: {config['DOCUMENT_TYPE']}...")
-        page.click('input.chosen-search-input')
-        # Fill with just the code, e.g., MTG, for better searching
-        doc_code = config['DOCUMENT_TYPE'].split(')')[0].replace('(', '')
-        page.fill('input.chosen-search-input', doc_code)
-        page.wait_for_selector('li.active-result, li.result-selected')
-
-        # Use the exact match from shared HTML
-        options = page.query_selector_all('li.active-result, li.result-selected')
-        for option in options:
-            if config['DOCUMENT_TYPE'] in option.inner_text().strip():
-                option.click()
-                logger.info('Document type selected.', extra={'context': {'step': 'document_selected', 'type': config['DOCUMENT_TYPE']}})
-                print(f"✅ Selected {config['DOCUMENT_TYPE']}")
-                break
-        else:
-            logger.error('Document type not found in dropdown.', extra={'context': {'error': 'not_found', 'type': config['DOCUMENT_TYPE']}})
-            print(f"❌ '{config['DOCUMENT_TYPE']}' not found in dropdown.")
-            browser.close()
-            return
-
-        # Step 5: Fill in the date range
-        logger.info('Filling date range.', extra={'context': {'step': 'fill_dates', 'start': config['START_DATE'], 'end': config['END_DATE']}})
-        print("Filling date range...")
-        page.fill('input#OBKey__1634_1', config['START_DATE'])
-        page.fill('input#OBKey__1634_2', config['END_DATE'])
-
-        # Step 6: Click Search
-        logger.info('Clicking Search.', extra={'context': {'step': 'click_search'}})
-        print("Clicking Search...")
-        page.click('button#sub')
-
-        # Step 7: Wait for results
-        logger.info('Waiting for results.', extra={'context': {'step': 'wait_results'}})
-        print("Waiting for results...")
-        time.sleep(3)
-        page.wait_for_selector("div#loading", state="hidden")
-
-        # Step 8: Export to Spreadsheet
-        logger.info('Exporting to spreadsheet.', extra={'context': {'step': 'export_spreadsheet'}})
-        print("Exporting to spreadsheet...")
-        with page.expect_download() as download_info:
-            page.click("span:text('Export to Spreadsheet')")
-        download = download_info.value
-
-        # Step 9: Save the file
-        # download_directory = config.get('DOWNLOAD_DIRECTORY', 'downloads')
-        # DOWNLOAD_DIR = os.path.join(os.getcwd(), download_directory)
-        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-        file_path = os.path.join(DOWNLOAD_DIR, download.suggested_filename)
-        download.save_as(file_path)
-        logger.info('File downloaded.', extra={'context': {'step': 'download_success', 'path': file_path}})
-        print(f"✅ File downloaded to: {file_path}")
 
+        search_and_export(context, config, config['START_DATE'], config['END_DATE'], DOWNLOAD_DIR)
 
         logger.info('Closing browser.', extra={'context': {'step': 'close_browser'}})
         browser.close()
+        log_wait_summary()
 
     logger.info('Search scraper process completed successfully.', extra={'context': {'step': 'end'}})
 
@@ -38,6 +38,17 @@ def load_config():
     config['PDF_DIRECTORY'] = "data"
     logger.info('PDF_DIRECTORY set.', extra={'context': {'step': 'set_pdf_directory', 'value': config['PDF_DIRECTORY']}})
     
+    # 'filter' re-filters the grid per CSV instrument; 'paginate' walks the result grid once
+    config['GRID_MODE'] = os.getenv('GRID_MODE', 'filter')
+    logger.info('GRID_MODE set.', extra={'context': {'step': 'set_grid_mode', 'value': config['GRID_MODE']}})
+    
+    # Split the search window into shards of this many days (0 = one search for the whole range)
+    config['SEARCH_SHARD_DAYS'] = int(os.getenv('SEARCH_SHARD_DAYS', '0'))
+    logger.info('SEARCH_SHARD_DAYS set.', extra={'context': {'step': 'set_search_shard_days', 'value': config['SEARCH_SHARD_DAYS']}})
+    
+    config['SEARCH_WORKERS'] = int(os.getenv('SEARCH_WORKERS', '2'))
+    logger.info('SEARCH_WORKERS set.', extra={'context': {'step': 'set_search_workers', 'value': config['SEARCH_WORKERS']}})
+    
     # Compute dynamic CSV path
     download_directory = "downloads"
     logger.info('DOWNLOAD_DIRECTORY set.', extra={'context': {'step': 'set_download_directory', 'value': download_directory}})
@@ -1,8 +1,9 @@
 import os
-import time
 from playwright.sync_api import sync_playwright
 from .config import load_config
 from utils.logging_utils import setup_logger
+from utils.wait_strategy import wait_for_selector, wait_for_network_idle, expect_download, log_wait_summary
+from utils.search_planner import plan_shards, run_shards, merge_csvs
 
 # BASE_URL = os.getenv("BASE_URLs", "https://officialrecords.mypinellasclerk.gov/search/SearchTypeDocType")
 # HEADLESS_MODE = os.getenv("HEADLESS_MODE", "False").lower() in ('true', '1', 't')
@@ -20,6 +21,94 @@ from utils.logging_utils import setup_logger
 logger = setup_logger('mypinellas_search_scrapper')
 logger.info('Module initialized.', extra={'context': {'step': 'init'}})
 
+def search_and_export(context, config, start_date, end_date, download_dir):
+    logger.info('Entering search_and_export function.', extra={'context': {'step': 'function_entry', 'start_date': start_date, 'end_date': end_date}})
+    
+    page = context.new_page()
+    logger.info('New page created.', extra={'context': {'step': 'page_create'}})
+    
+    logger.info('Opening portal.', extra={'context': {'step': 'goto_portal', 'url': config['BASE_URL']}})
+    page.goto(config['BASE_URL'])
+    logger.info('Portal opened.', extra={'context': {'step': 'portal_opened'}})
+    
+    # Step 1: Accept terms if present
+    logger.info('Waiting for acceptance button.', extra={'context': {'step': 'wait_accept_button'}})
+    if wait_for_selector(page, "#btnButton", 'accept_terms', required=False):
+        logger.info('Acceptance button found.', extra={'context': {'step': 'accept_button_found'}})
+        
+        page.click("#btnButton")
+        logger.info('Clicked acceptance button.', extra={'context': {'step': 'click_accept'}})
+    else:
+        logger.info('No acceptance button, waiting for page load.', extra={'context': {'step': 'no_accept_wait'}})
+    
+    # Step 2: Fill Document Type
+    logger.info('Typing document type.', extra={'context': {'step': 'type_document', 'value': config['DOCUMENT_TYPE']}})
+    wait_for_selector(page, "#DocTypesDisplay-input", 'search_form')
+    logger.info('Document type selector found.', extra={'context': {'step': 'doc_type_selector_found'}})
+    
+    page.fill("#DocTypesDisplay-input", config['DOCUMENT_TYPE'])
+    logger.info('Document type filled.', extra={'context': {'step': 'doc_type_filled'}})
+    
+    page.keyboard.press("Enter")
+    logger.info('Enter pressed for document type.', extra={'context': {'step': 'enter_pressed_doc'}})
+    
+    wait_for_network_idle(page, 'doc_type_selected', timeout=5000)
+    
+    # Step 3: Fill date range
+    logger.info('Filling From Record Date.', extra={'context': {'step': 'fill_start_date', 'value': start_date}})
+    page.fill("#RecordDateFrom", start_date)
+    logger.info('From Record Date filled.', extra={'context': {'step': 'start_date_filled'}})
+    
+    logger.info('Filling To Record Date.', extra={'context': {'step': 'fill_end_date', 'value': end_date}})
+    page.fill("#RecordDateTo", end_date)
+    logger.info('To Record Date filled.', extra={'context': {'step': 'end_date_filled'}})
+    
+    # Step 4: Click Search
+    logger.info('Clicking Search.', extra={'context': {'step': 'click_search'}})
+    page.click("#btnSearch")
+    logger.info('Search clicked.', extra={'context': {'step': 'search_clicked'}})
+    
+    # Step 5: Click "Export to CSV" and download
+    logger.info('Looking for Export to CSV button.', extra={'context': {'step': 'look_csv_button'}})
+    try:
+        wait_for_selector(page, "#btnCsvButton", 'search_results')
+        logger.info('CSV button found.', extra={'context': {'step': 'csv_button_found'}})
+        
+        logger.info('Expecting download.', extra={'context': {'step': 'expect_download'}})
+        download = expect_download(page, lambda: page.click("#btnCsvButton"))
+        logger.info('CSV button clicked.', extra={'context': {'step': 'csv_clicked'}})
+        logger.info('Download received.', extra={'context': {'step': 'download_received', 'suggested_filename': download.suggested_filename}})
+        
+        file_path = os.path.join(download_dir, download.suggested_filename)
+        logger.info('File path computed.', extra={'context': {'step': 'compute_file_path', 'path': file_path}})
+        
+        download.save_as(file_path)
+        logger.info('CSV saved.', extra={'context': {'step': 'csv_saved', 'path': file_path}})
+        return file_path
+    except Exception as e:
+        logger.error('Export to CSV failed.', extra={'context': {'step': 'csv_failed', 'error': str(e)}}, exc_info=True)
+        return None
+
+
+def run_sharded(config, download_dir):
+    logger.info('Entering run_sharded function.', extra={'context': {'step': 'function_entry', 'shard_days': config['SEARCH_SHARD_DAYS']}})
+    
+    shards = plan_shards(config['START_DATE'], config['END_DATE'], config['SEARCH_SHARD_DAYS'], zero_pad=False)
+    csv_paths = run_shards(
+        shards,
+        lambda context, start_date, end_date, shard_dir: search_and_export(context, config, start_date, end_date, shard_dir),
+        download_dir,
+        workers=config['SEARCH_WORKERS'],
+        headless=config['HEADLESS_MODE'],
+    )
+    logger.info('Shards finished.', extra={'context': {'step': 'shards_finished', 'completed': len(csv_paths), 'total': len(shards)}})
+    
+    if not csv_paths:
+        logger.error('No search shard completed.', extra={'context': {'step': 'sharded_search_failed'}})
+        return None
+    return merge_csvs(csv_paths, os.path.join(download_dir, "SearchResults.csv"), key_column="InstrumentNumber")
+
+
 def run():
     logger.info('Entering run function.', extra={'context': {'step': 'function_entry'}})
     
@@ -36,6 +125,12 @@ def run():
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     logger.info('Download directory ensured.', extra={'context': {'step': 'ensure_dir'}})
     
+    if config.get('SEARCH_SHARD_DAYS'):
+        run_sharded(config, DOWNLOAD_DIR)
+        log_wait_summary()
+        logger.info('Exiting run function.', extra={'context': {'step': 'function_exit'}})
+        return
+    
     with sync_playwright() as p:
         logger.info('Playwright context started.', extra={'context': {'step': 'playwright_start'}})
         
@@ -45,84 +140,11 @@ def run():
         context = browser.new_context(accept_downloads=True)
         logger.info('Browser context created.', extra={'context': {'step': 'context_create'}})
         
-        page = context.new_page()
-        logger.info('New page created.', extra={'context': {'step': 'page_create'}})
-        
-        logger.info('Opening portal.', extra={'context': {'step': 'goto_portal', 'url': config['BASE_URL']}})
-        page.goto(config['BASE_URL'])
-        logger.info('Portal opened.', extra={'context': {'step': 'portal_opened'}})
-        
-        # Step 1: Accept terms if present
-        try:
-            logger.info('Waiting for acceptance button.', extra={'context': {'step': 'wait_accept_button'}})
-            page.wait_for_selector("#btnButton", timeout=5000)
-            logger.info('Acceptance button found.', extra={'context': {'step': 'accept_button_found'}})
-            
-            page.click("#btnButton")
-            logger.info('Clicked acceptance button.', extra={'context': {'step': 'click_accept'}})
-            
-            page.wait_for_timeout(8000)
-            logger.info('Waited after acceptance.', extra={'context': {'step': 'post_accept_wait'}})
-        except:
-            logger.info('No acceptance button, waiting for page load.', extra={'context': {'step': 'no_accept_wait'}})
-            time.sleep(20)
-            logger.info('Page load wait completed.', extra={'context': {'step': 'page_load_wait_done'}})
-        
-        # Step 2: Fill Document Type
-        logger.info('Typing document type.', extra={'context': {'step': 'type_document', 'value': config['DOCUMENT_TYPE']}})
-        page.wait_for_selector("#DocTypesDisplay-input", timeout=10000)
-        logger.info('Document type selector found.', extra={'context': {'step': 'doc_type_selector_found'}})
-        
-        page.fill("#DocTypesDisplay-input", config['DOCUMENT_TYPE'])
-        logger.info('Document type filled.', extra={'context': {'step': 'doc_type_filled'}})
-        
-        page.keyboard.press("Enter")
-        logger.info('Enter pressed for document type.', extra={'context': {'step': 'enter_pressed_doc'}})
-        
-        time.sleep(1)
-        logger.info('Short wait after document type.', extra={'context': {'step': 'post_doc_wait'}})
-        
-        # Step 3: Fill date range
-        logger.info('Filling From Record Date.', extra={'context': {'step': 'fill_start_date', 'value': config['START_DATE']}})
-        page.fill("#RecordDateFrom", config['START_DATE'])
-        logger.info('From Record Date filled.', extra={'context': {'step': 'start_date_filled'}})
-        
-        logger.info('Filling To Record Date.', extra={'context': {'step': 'fill_end_date', 'value': config['END_DATE']}})
-        page.fill("#RecordDateTo", config['END_DATE'])
-        logger.info('To Record Date filled.', extra={'context': {'step': 'end_date_filled'}})
-        
-        # Step 4: Click Search
-        logger.info('Clicking Search.', extra={'context': {'step': 'click_search'}})
-        page.click("#btnSearch")
-        logger.info('Search clicked.', extra={'context': {'step': 'search_clicked'}})
-        
-        page.wait_for_timeout(5000)
-        logger.info('Waited after search.', extra={'context': {'step': 'post_search_wait'}})
-        
-        # Step 5: Click "Export to CSV" and download
-        logger.info('Looking for Export to CSV button.', extra={'context': {'step': 'look_csv_button'}})
-        try:
-            page.wait_for_selector("#btnCsvButton", timeout=5000)
-            logger.info('CSV button found.', extra={'context': {'step': 'csv_button_found'}})
-            
-            with page.expect_download() as download_info:
-                logger.info('Expecting download.', extra={'context': {'step': 'expect_download'}})
-                page.click("#btnCsvButton")
-                logger.info('CSV button clicked.', extra={'context': {'step': 'csv_clicked'}})
-            
-            download = download_info.value
-            logger.info('Download received.', extra={'context': {'step': 'download_received', 'suggested_filename': download.suggested_filename}})
-            
-            file_path = os.path.join(DOWNLOAD_DIR, download.suggested_filename)
-            logger.info('File path computed.', extra={'context': {'step': 'compute_file_path', 'path': file_path}})
-            
-            download.save_as(file_path)
-            logger.info('CSV saved.', extra={'context': {'step': 'csv_saved', 'path': file_path}})
-        except Exception as e:
-            logger.error('Export to CSV failed.', extra={'context': {'step': 'csv_failed', 'error': str(e)}}, exc_info=True)
+        search_and_export(context, config, config['START_DATE'], config['END_DATE'], DOWNLOAD_DIR)
         
         browser.close()
         logger.info('Browser closed.', extra={'context': {'step': 'browser_close'}})
+        log_wait_summary()
     
     logger.info('Exiting run function.', extra={'context': {'step': 'function_exit'}})
 
@@ -1,11 +1,15 @@
 import os
 import csv
-import time
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright, TimeoutError
-import requests
+from playwright.sync_api import sync_playwright
 import sys
 
+from utils.http_session import get_session_manager, stream_download
+from utils.job_store import get_job_store, start_firestore_mirror
+from utils.wait_strategy import (
+    wait_for_selector, wait_for_locator, wait_for_function, wait_for_load,
+    wait_for_network_idle, expect_page, log_wait_summary,
+)
 from utils.logging_utils import setup_logger  # Added for structured logging
 
 # Adjust sys.path to include the parent directory
@@ -19,6 +23,7 @@ from .config import load_config
 
 db = init_firebase()
 logger = setup_logger()  # Initialize logger matching app.py style
+http_sessions = get_session_manager()
 # Function to load environment variables and return configuration
 # def load_config():
 #     print("Loading environment variables...")
@@ -40,6 +45,16 @@ logger = setup_logger()  # Initialize logger matching app.py style
 #     print("✅ Configuration loaded.")
 #     return config
 
+# True once the filtered grid shows only rows for the instrument, or its no-data row
+GRID_FILTERED_SCRIPT = """
+instrument => {
+    const rows = Array.from(document.querySelectorAll('.t-grid tbody tr'));
+    if (!rows.length) return false;
+    if (rows.some(tr => tr.classList.contains('t-no-data'))) return true;
+    return rows.every(tr => tr.innerText.includes(instrument));
+}
+"""
+
 # Function to get instrument numbers from CSV
 def get_instrument_numbers(csv_file):
     logger.info("Reading instrument numbers from CSV", extra={'context': {'csv_file': csv_file}})
@@ -67,22 +82,21 @@ def setup_browser(base_url, headless_mode):
 # Function to accept terms if present
 def accept_terms(page):
     logger.info("Checking for acceptance button", extra={'context': {'step': 'accept_terms'}})
-    try:
-        page.wait_for_selector("#btnButton", timeout=5000)
+    if wait_for_selector(page, "#btnButton", 'accept_terms', required=False):
         page.click("#btnButton")
         logger.info("Clicked 'I accept the conditions above'", extra={'context': {'action': 'clicked_accept'}})
-        page.wait_for_timeout(8000)
-    except:
+    else:
         logger.info("No acceptance button, waiting", extra={'context': {'action': 'waiting'}})
-        time.sleep(10)
+    # The search form is what we actually need; it appears once the terms page is gone
+    wait_for_selector(page, "#DocTypesDisplay-input", 'search_form')
 
 # Function to perform the initial search
 def perform_search(page, document_type, start_date, end_date):
     logger.info("Typing document type", extra={'context': {'document_type': document_type}})
-    page.wait_for_selector("#DocTypesDisplay-input", timeout=10000)
+    wait_for_selector(page, "#DocTypesDisplay-input", 'search_form')
     page.fill("#DocTypesDisplay-input", document_type)
     page.keyboard.press("Enter")
-    time.sleep(1)
+    wait_for_network_idle(page, 'doc_type_selected', timeout=5000)
 
     logger.info("Filling From Record Date", extra={'context': {'start_date': start_date}})
     page.fill("#RecordDateFrom", start_date)
@@ -92,10 +106,9 @@ def perform_search(page, document_type, start_date, end_date):
 
     logger.info("Clicking Search", extra={'context': {'action': 'search'}})
     page.click("#btnSearch")
-    page.wait_for_timeout(5000)
 
     logger.info("Waiting for results page to load", extra={'context': {'step': 'wait_results'}})
-    page.wait_for_selector("#fldName", timeout=10000)
+    wait_for_selector(page, "#fldName", 'search_results')
     logger.info("Search performed", extra={'context': {'step': 'search_complete'}})
 
 # Function to filter for a specific instrument number
@@ -104,16 +117,13 @@ def filter_instrument(page, instrument_number):
     page.select_option("#fldName", label="INSTRUMENT#")
     page.select_option("#fldOptions", value="eq")
     page.fill("#fldText", instrument_number)
-    time.sleep(3)
-    page.wait_for_timeout(500)
     page.click("button:has-text('Filter Grid')")
-    time.sleep(10)
-    try:
-        page.wait_for_selector("tr td.t-last", timeout=10000)
+    # Done once the grid shows only the filtered instrument, or its no-data row
+    filtered = wait_for_function(page, GRID_FILTERED_SCRIPT, 'grid_filter', arg=instrument_number, required=False)
+    if filtered and not page.query_selector(".t-grid tbody tr.t-no-data") and page.query_selector("tr td.t-last"):
         return True
-    except TimeoutError:
-        logger.warning("No result for Instrument #", extra={'context': {'instrument_number': instrument_number}})
-        return False
+    logger.warning("No result for Instrument #", extra={'context': {'instrument_number': instrument_number}})
+    return False
 
 # Function to click the document row and handle new page
 def click_document_row(context, page):
@@ -121,22 +131,15 @@ def click_document_row(context, page):
         row = page.query_selector("tr td.t-last")
         if row:
             logger.info("Clicking document row", extra={'context': {'action': 'click_row'}})
-            time.sleep(10)
-            pages_before = len(context.pages)
-            logger.info("Pages before click", extra={'context': {'count': pages_before}})
-            row.click()
-            time.sleep(5)
-            pages_after = len(context.pages)
-            logger.info("Pages after click", extra={'context': {'count': pages_after}})
-            if pages_after > pages_before:
-                new_page = context.pages[-1]
+            new_page = expect_page(context, row.click, 'document_page', timeout=10000, required=False)
+            if new_page:
                 opened_new = True
                 logger.info("New page detected and opened", extra={'context': {'status': 'new_page'}})
             else:
                 new_page = page
                 opened_new = False
                 logger.info("No new page detected, assuming same-page navigation", extra={'context': {'status': 'same_page'}})
-            new_page.wait_for_load_state('load', timeout=30000)
+            wait_for_load(new_page, 'document_page')
             logger.info("Page loaded", extra={'context': {'step': 'page_loaded'}})
             return new_page, opened_new
         else:
@@ -172,57 +175,43 @@ def extract_document_details(new_page):
     logger.info("Document details extraction completed", extra={'context': {'step': 'extraction_complete'}})
     return details_data
 
-# New function to dynamically update Firestore for each instrument ID
+# Records the instrument's state in the local job store; the Firestore mirror copies it asynchronously
 def update_firestore(config, instrument_id, update_data):
     try:
-        doc_ref = db.collection(config['COUNTY_COLLECTION']) \
-                    .document(config['COUNTY_NAMESPACE']) \
-                    .collection(config['DOCUMENT_TYPE']) \
-                    .document(instrument_id)
-        doc_ref.set(update_data, merge=True)
-        logger.info("Updated Firestore for instrument", extra={'context': {'instrument_id': instrument_id}})
+        get_job_store().update(config['COUNTY_NAMESPACE'], config['DOCUMENT_TYPE'], instrument_id, update_data)
+        logger.info("Updated job store for instrument", extra={'context': {'instrument_id': instrument_id}})
     except Exception as e:
-        logger.error("Error updating Firestore", exc_info=True, extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
+        logger.error("Error updating job store", exc_info=True, extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
 
 # Function to download PDF
 def download_pdf(context, new_page, instrument_number, config):
     try:
         pdf_relative_url = None
         logger.info("Checking for document iframe", extra={'context': {'instrument_number': instrument_number, 'step': 'check_iframe'}})
-        try:
-            new_page.wait_for_selector('iframe', timeout=15000)
-            iframe_present = True
-        except TimeoutError:
-            iframe_present = False
+        iframe_present = wait_for_selector(new_page, 'iframe', 'document_iframe', required=False) is not None
 
         if iframe_present:
-            time.sleep(2)  # Ensure the iframe is fully loaded
             logger.info("Iframe found. Analyzing its content", extra={'context': {'instrument_number': instrument_number, 'step': 'analyze_iframe'}})
             outer_frame = new_page.frame_locator('iframe').first
-            try:
-                time.sleep(2)  # Wait for the outer frame to be ready
-                logger.info("Checking for 'View as PDF' button", extra={'context': {'instrument_number': instrument_number, 'step': 'check_pdf_button'}})
-                view_as_pdf_button = outer_frame.locator('[title="Problems viewing images? View as PDF"]')
-                view_as_pdf_button.wait_for(state="visible", timeout=10000)
+            logger.info("Checking for 'View as PDF' button", extra={'context': {'instrument_number': instrument_number, 'step': 'check_pdf_button'}})
+            view_as_pdf_button = outer_frame.locator('[title="Problems viewing images? View as PDF"]')
+            if wait_for_locator(view_as_pdf_button, 'view_as_pdf_button', timeout=10000, required=False):
                 logger.info("'View as PDF' button is visible. Clicking it", extra={'context': {'instrument_number': instrument_number, 'action': 'click_pdf'}})
                 view_as_pdf_button.click()
-                time.sleep(2)  # Wait after clicking
-            except TimeoutError:
+            else:
                 logger.info("'View as PDF' button not visible in time. Assuming PDF is already loaded", extra={'context': {'instrument_number': instrument_number, 'status': 'pdf_assumed'}})
 
             # New: Check for 'Display All Pages' button inside the outer frame and click if available
-            try:
-                display_all_button = outer_frame.locator('#pdfToolbar button[name="btnOpenPdfAll"]')
-                display_all_button.wait_for(state="visible", timeout=10000)  # Increased timeout
+            display_all_button = outer_frame.locator('#pdfToolbar button[name="btnOpenPdfAll"]')
+            if wait_for_locator(display_all_button, 'display_all_button', timeout=10000, required=False):
                 logger.info("'Display All Pages' button found. Clicking it.", extra={'context': {'instrument_number': instrument_number, 'action': 'click_display_all'}})
                 display_all_button.click()
-                time.sleep(3)  # Increased wait for action to complete
-            except TimeoutError:
+            else:
                 logger.info("'Display All Pages' button not found or not visible within the frame.", extra={'context': {'instrument_number': instrument_number, 'status': 'no_display_all_button'}})
 
             logger.info("Locating nested PDF iframe", extra={'context': {'instrument_number': instrument_number, 'step': 'locate_nested'}})
             nested_iframe_element = outer_frame.locator('iframe#ImageInPdf')
-            nested_iframe_element.wait_for(state='visible', timeout=20000)
+            wait_for_locator(nested_iframe_element, 'pdf_viewer')
             logger.info("Nested PDF iframe is now visible", extra={'context': {'instrument_number': instrument_number, 'status': 'nested_visible'}})
             pdf_relative_url = nested_iframe_element.get_attribute('src')
         else:
@@ -239,27 +228,211 @@ def download_pdf(context, new_page, instrument_number, config):
         full_pdf_url = pdf_relative_url if pdf_relative_url.startswith('http') else base_domain + pdf_relative_url
 
         logger.info("Downloading from URL", extra={'context': {'full_pdf_url': full_pdf_url, 'instrument_number': instrument_number}})
-        cookies = context.cookies()
-        requests_cookies = {cookie['name']: cookie['value'] for cookie in cookies}
-        response = requests.get(full_pdf_url, cookies=requests_cookies, timeout=30)
-        response.raise_for_status()
+        # Shared keep-alive session; cookies are only re-copied when the browser's changed
+        http_sessions.sync_cookies(context.cookies())
 
         pdf_directory = f"{config['PDF_DIRECTORY']}/{config['COUNTY_COLLECTION']}/{config['COUNTY_NAMESPACE']}/{config['DOCUMENT_TYPE']}"
-        os.makedirs(pdf_directory, exist_ok=True)
         download_path = os.path.join(pdf_directory, f"{instrument_number}.pdf")
-        with open(download_path, 'wb') as f:
-            f.write(response.content)
+        # Chunked to a .part file, resumed with Range requests and renamed once the size checks out
+        download_path, size, sha256 = stream_download(http_sessions, full_pdf_url, download_path)
 
-        logger.info("File downloaded successfully", extra={'context': {'download_path': download_path, 'instrument_number': instrument_number}})
+        logger.info("File downloaded successfully", extra={'context': {'download_path': download_path, 'instrument_number': instrument_number, 'size': size, 'sha256': sha256}})
         return download_path
     except Exception as e:
         logger.error("Error during download process", exc_info=True, extra={'context': {'instrument_number': instrument_number, 'error': str(e)}})
 
+# Reads every row of the current grid page in one round-trip: cell texts plus the
+# document link when the row carries one, either as a real link or as a URL in a
+# data-url/data-href attribute or an onclick handler
+GRID_ROWS_SCRIPT = """
+() => {
+    const headers = Array.from(document.querySelectorAll('.t-grid th')).map(th => th.innerText.trim());
+    const rows = Array.from(document.querySelectorAll('.t-grid tbody tr:not(.t-no-data)'));
+    const documentUrl = tr => {
+        const link = tr.querySelector('a[href]:not([href^="javascript"])');
+        if (link) return link.href;
+        for (const el of [tr, ...tr.querySelectorAll('[data-url], [data-href], [onclick]')]) {
+            const value = el.getAttribute('data-url') || el.getAttribute('data-href');
+            if (value) return new URL(value, location.href).href;
+            const match = (el.getAttribute('onclick') || '').match(/['"]((?:https?:\\/\\/|\\/)[^'"]+)['"]/);
+            if (match) return new URL(match[1], location.href).href;
+        }
+        return null;
+    };
+    return {
+        headers,
+        rows: rows.map(tr => ({
+            cells: Array.from(tr.querySelectorAll('td')).map(td => td.innerText.trim()),
+            href: documentUrl(tr)
+        }))
+    };
+}
+"""
+
+
+def read_grid_rows(page):
+    grid = page.evaluate(GRID_ROWS_SCRIPT)
+    headers = [header.upper() for header in grid['headers']]
+    instrument_col = next((i for i, header in enumerate(headers) if 'INSTRUMENT' in header), None)
+    rows = []
+    for row_index, row in enumerate(grid['rows']):
+        cells = row['cells']
+        if instrument_col is None or instrument_col >= len(cells) or not cells[instrument_col]:
+            continue
+        rows.append({'row_index': row_index, 'instrument_number': cells[instrument_col], 'document_url': row['href']})
+    return rows
+
+
+def open_grid_row(context, page, row_index, instrument_number):
+    """
+    Clicks a row on the current grid page and returns (document page, opened_new).
+    Like click_document_row, a row that navigates in place returns the grid page itself.
+    Raises if the row no longer shows instrument_number (the grid changed under us).
+    """
+    row = page.query_selector_all(".t-grid tbody tr:not(.t-no-data)")[row_index]
+    if instrument_number not in row.inner_text():
+        raise Exception(f"Grid row {row_index} does not show instrument {instrument_number}")
+    new_page = expect_page(context, (row.query_selector("td.t-last") or row).click, 'document_page', timeout=10000, required=False)
+    if new_page:
+        opened_new = True
+        logger.info("New page detected and opened", extra={'context': {'status': 'new_page'}})
+    else:
+        new_page = page
+        opened_new = False
+        logger.info("No new page detected, assuming same-page navigation", extra={'context': {'status': 'same_page'}})
+    wait_for_load(new_page, 'document_page')
+    return new_page, opened_new
+
+
+def next_grid_page(page):
+    """Advances the Telerik pager. Returns False on the last page."""
+    next_button = page.query_selector(".t-pager .t-arrow-next")
+    if not next_button:
+        return False
+    next_link = next_button.query_selector("xpath=..")
+    if not next_link or 't-state-disabled' in (next_link.get_attribute('class') or ''):
+        return False
+    first_row_before = page.inner_text(".t-grid tbody tr") if page.query_selector(".t-grid tbody tr") else ''
+    next_link.click()
+    # The grid re-renders in place; wait until its first row changes
+    wait_for_function(
+        page,
+        "before => { const tr = document.querySelector('.t-grid tbody tr'); return tr && tr.innerText !== before; }",
+        'grid_page',
+        arg=first_row_before,
+    )
+    return True
+
+
+def find_grid_row(page, instrument_number):
+    """Index of the row showing instrument_number on the current grid page, or None."""
+    return next((row['row_index'] for row in read_grid_rows(page) if row['instrument_number'] == instrument_number), None)
+
+
+def current_grid_page(page):
+    active = page.query_selector(".t-pager .t-state-active")
+    text = active.inner_text().strip() if active else ''
+    return int(text) if text.isdigit() else 1
+
+
+def return_to_grid_page(page, grid_page):
+    """
+    Navigating back reloads the results on the grid's first page; pages forward
+    again to grid_page. Returns False if it can't be reached.
+    """
+    current = current_grid_page(page)
+    if current > grid_page:
+        return False
+    for _ in range(grid_page - current):
+        if not next_grid_page(page):
+            return False
+    return current_grid_page(page) == grid_page or not page.query_selector(".t-pager .t-state-active")
+
+
+def process_document(context, new_page, instrument_number, config):
+    """Extracts details from an open document page, downloads its PDF and records both in Firestore."""
+    details_data = extract_document_details(new_page)
+    doc_data = {
+        'metadata': details_data,
+        'status': 'visited',
+        'created_at': datetime.datetime.now()
+    }
+    update_firestore(config, instrument_number, doc_data)
+    pdf_path = download_pdf(context, new_page, instrument_number, config)
+    if pdf_path:
+        doc_data = {
+            'status': 'pdf_downloaded',
+            'pdf_path': pdf_path,
+            'modified_at': datetime.datetime.now()
+        }
+        update_firestore(config, instrument_number, doc_data)
+    return pdf_path
+
+
+def run_grid_pagination(config, context, page, instrument_numbers):
+    """
+    Walks the result grid once instead of filtering and resetting it for every
+    instrument. Rows with a document link are queued and visited directly on one
+    detail page; rows without one are opened by clicking them in place. A row
+    that opens in the same tab sends the grid back to its first page, so the walk
+    pages forward to where it was and looks rows up by instrument number again.
+    """
+    wanted = set(instrument_numbers) if instrument_numbers else None
+    link_queue = []
+    grid_page = 1
+    lost = False
+    while not lost:
+        rows = read_grid_rows(page)
+        logger.info("Read grid page", extra={'context': {'grid_page': grid_page, 'rows': len(rows)}})
+        for row in rows:
+            instrument_number = row['instrument_number']
+            if wanted is not None and instrument_number not in wanted:
+                continue
+            if row['document_url']:
+                link_queue.append(row)
+                continue
+            row_index = find_grid_row(page, instrument_number)
+            if row_index is None:
+                logger.warning("Grid row no longer on page", extra={'context': {'grid_page': grid_page, 'instrument_number': instrument_number}})
+                continue
+            new_page, opened_new = None, True
+            try:
+                new_page, opened_new = open_grid_row(context, page, row_index, instrument_number)
+                process_document(context, new_page, instrument_number, config)
+            except Exception as e:
+                logger.error("Error opening grid row", exc_info=True, extra={'context': {'instrument_number': instrument_number, 'error': str(e)}})
+            if new_page is not None:
+                try:
+                    close_new_page(new_page, opened_new, page)
+                except Exception as e:
+                    logger.error("Error leaving document page", exc_info=True, extra={'context': {'instrument_number': instrument_number, 'error': str(e)}})
+            if not opened_new and not return_to_grid_page(page, grid_page):
+                # Carrying on from another page would revisit or mislabel rows
+                logger.error("Could not return to grid page; stopping pagination", extra={'context': {'grid_page': grid_page, 'instrument_number': instrument_number}})
+                lost = True
+                break
+        if lost or not next_grid_page(page):
+            break
+        grid_page += 1
+
+    logger.info("Grid pagination complete", extra={'context': {'grid_pages': grid_page, 'queued_links': len(link_queue)}})
+    detail_page = context.new_page()
+    for idx, row in enumerate(link_queue, 1):
+        instrument_number = row['instrument_number']
+        logger.info("Processing instrument", extra={'context': {'index': idx, 'total': len(link_queue), 'instrument_number': instrument_number, 'mode': 'paginate'}})
+        try:
+            detail_page.goto(row['document_url'], timeout=60000)
+            process_document(context, detail_page, instrument_number, config)
+        except Exception as e:
+            logger.error("Error processing grid row", exc_info=True, extra={'context': {'instrument_number': instrument_number, 'error': str(e)}})
+    detail_page.close()
+
+
 # Function to reset grid
 def reset_grid(page):
     try:
         page.click("button:has-text('Reset Grid')")
-        page.wait_for_timeout(1000)
+        wait_for_network_idle(page, 'grid_reset', timeout=5000)
         logger.info("Grid reset", extra={'context': {'step': 'grid_reset'}})
     except:
         logger.warning("Reset Grid failed (may not be present)", extra={'context': {'warning': 'reset_failed'}})
@@ -271,47 +444,42 @@ def close_new_page(new_page, opened_new, page):
         new_page.close()
     else:
         new_page.go_back()
-        new_page.wait_for_load_state('networkidle')
-        new_page.wait_for_selector("#fldName", timeout=10000)
+        wait_for_network_idle(new_page, 'navigate_back')
+        wait_for_selector(new_page, "#fldName", 'search_results')
         logger.info("Navigated back to results page", extra={'context': {'action': 'navigated_back'}})
 
 def run():
     config = load_config()
     instrument_numbers = get_instrument_numbers(config['CSV_FILE'])
-    if not instrument_numbers:
+    grid_mode = config.get('GRID_MODE', 'filter')
+    if not instrument_numbers and grid_mode != 'paginate':
         logger.warning("No InstrumentNumber found in CSV", extra={'context': {'warning': 'no_instruments'}})
         return
 
+    mirror = start_firestore_mirror(db, config['COUNTY_COLLECTION'])
     playwright, browser, context, page = setup_browser(config['BASE_URL'], config['HEADLESS_MODE'])
+    http_sessions.bind_cookie_source(context.cookies)
     accept_terms(page)
     perform_search(page, config['DOCUMENT_TYPE'], config['START_DATE'], config['END_DATE'])
 
-    for idx, instrument_number in enumerate(instrument_numbers, 1):
-        logger.info("Processing instrument", extra={'context': {'index': idx, 'total': len(instrument_numbers), 'instrument_number': instrument_number}})
-        if filter_instrument(page, instrument_number):
-            new_page, opened_new = click_document_row(context, page)
-            if new_page:
-                details_data = extract_document_details(new_page)
-                doc_data = {
-                    'metadata': details_data,
-                    'status': 'visited',
-                    'created_at': datetime.datetime.now()
-                }
-                update_firestore(config, instrument_number, doc_data)
-                pdf_path = download_pdf(context, new_page, instrument_number, config)
-                if pdf_path:
-                    doc_data = {
-                        'status': 'pdf_downloaded',
-                        'pdf_path': pdf_path,
-                        'modified_at': datetime.datetime.now()
-                    }
-                    update_firestore(config, instrument_number, doc_data)
-                close_new_page(new_page, opened_new, page)
-        reset_grid(page)
+    if grid_mode == 'paginate':
+        run_grid_pagination(config, context, page, instrument_numbers)
+    else:
+        for idx, instrument_number in enumerate(instrument_numbers, 1):
+            logger.info("Processing instrument", extra={'context': {'index': idx, 'total': len(instrument_numbers), 'instrument_number': instrument_number}})
+            if filter_instrument(page, instrument_number):
+                new_page, opened_new = click_document_row(context, page)
+                if new_page:
+                    process_document(context, new_page, instrument_number, config)
+                    close_new_page(new_page, opened_new, page)
+            reset_grid(page)
 
     logger.info("All instruments processed", extra={'context': {'step': 'process_complete'}})
+    log_wait_summary()
+    http_sessions.bind_cookie_source(None)
     browser.close()
     playwright.stop()
+    mirror.stop()
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -1,11 +1,21 @@
 import os
+import sys
+import json
+import threading
+from concurrent.futures import Future
+from functools import partial
 from dotenv import load_dotenv
 from pinecone import Pinecone
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from firebase_utils.firebase_config import init_firebase
 from utils.logging_utils import setup_logger  # Add this import for logging
+from utils.job_store import get_job_store, new_worker_id, start_firestore_mirror
+from utils.vector_upload import VectorUploader
+from utils.embedding_cache import embed_with_cache, get_embedding_cache
+from utils.chunker import get_chunker
+from utils.chunk_store import get_chunk_store
+from utils.field_rules import parse_date
+from utils.vector_manifest import content_hash, get_vector_manifest, vector_id, vector_prefix
 import importlib  # Add this import for dynamic config loading
 
 logger = setup_logger()  # Initialize logger early
@@ -34,93 +44,303 @@ else:
     DOCUMENT_TYPE = os.getenv('DOCUMENT_TYPE', 'mortgage_records')
     EXTRACTED_TEXT_DIR = os.getenv('EXTRACTED_TEXT_DIR', 'data/extracted_text')
 
+# Chunks from many instruments are embedded together, up to this many tokens (or texts)
+# per embedding call, then upserted in batches of PINECONE_UPSERT_BATCH_SIZE vectors
+PINECONE_EMBED_BATCH_TOKENS = int(os.getenv('PINECONE_EMBED_BATCH_TOKENS', '100000'))
+PINECONE_EMBED_BATCH_TEXTS = int(os.getenv('PINECONE_EMBED_BATCH_TEXTS', '1000'))
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv('PINECONE_UPSERT_BATCH_SIZE', '100'))
+PINECONE_UPSERT_WORKERS = int(os.getenv('PINECONE_UPSERT_WORKERS', '4'))
+PINECONE_DELETE_BATCH_SIZE = 1000
+# A partial batch is sent anyway once its oldest chunk has waited this long
+PINECONE_BATCH_MAX_WAIT = float(os.getenv('PINECONE_BATCH_MAX_WAIT', '2'))
+
+# Keep only filterable fields (instrument, county, document type, recording date, page) in
+# Pinecone; chunk text and the full metadata go to the local chunk store (utils/chunk_store.py),
+# from which query results are hydrated
+PINECONE_LEAN_METADATA = os.getenv('PINECONE_LEAN_METADATA', 'False') == 'True'
+
 # Initialize embeddings and Pinecone
-embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=OPENAI_EMBEDDING_MODEL)
+embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=OPENAI_EMBEDDING_MODEL, chunk_size=PINECONE_EMBED_BATCH_TEXTS)
 pc = Pinecone(api_key=PINECONE_API_KEY)
 
-# Use LangChain's text splitter for chunking
-def chunk_text(text, chunk_size=1000, chunk_overlap=150):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-    )
-    return splitter.split_text(text)
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    """Returns the process-wide uploader, which holds the one index handle every instrument shares."""
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = VectorUploader(
+                pc.Index(PINECONE_INDEX_NAME),
+                # Chunks embedded before (re-runs, boilerplate shared across filings) come from the local cache
+                partial(embed_with_cache, get_embedding_cache(embeddings.model), embeddings.embed_documents),
+                COUNTY_NAMESPACE,
+                lambda text: len(get_chunker().encoding.encode_ordinary(text)),
+                batch_tokens=PINECONE_EMBED_BATCH_TOKENS,
+                batch_texts=PINECONE_EMBED_BATCH_TEXTS,
+                upsert_batch_size=PINECONE_UPSERT_BATCH_SIZE,
+                upsert_workers=PINECONE_UPSERT_WORKERS,
+                max_wait_seconds=PINECONE_BATCH_MAX_WAIT,
+            )
+        return _uploader
+
+
+def close_uploader():
+    """Sends whatever is still queued and waits for it; returns the upload stats."""
+    global _uploader
+    with _uploader_lock:
+        uploader = _uploader
+    # Cleared only once close() returns, as finishing documents still use the uploader's index
+    stats = uploader.close() if uploader else {}
+    with _uploader_lock:
+        if _uploader is uploader:
+            _uploader = None
+    cache = get_embedding_cache(embeddings.model)
+    if cache is not None:
+        logger.info('Embedding cache summary.', extra={'context': {'step': 'embedding_cache', **cache.stats()}})
+    return stats
+
+def existing_vector_ids(index, instrument_id):
+    """Vector IDs the index holds for an instrument the manifest has never seen (e.g. on a fresh machine)."""
+    ids = []
+    try:
+        for page in index.list(prefix=vector_prefix(instrument_id), namespace=COUNTY_NAMESPACE):
+            ids.extend(page)
+    except Exception as e:
+        # Listing needs a serverless index; without it stale chunks of unknown instruments stay
+        logger.warning('Could not list existing vectors.', extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
+    return ids
+
+def delete_vectors(index, ids):
+    for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+        index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH_SIZE], namespace=COUNTY_NAMESPACE)
+
+def recording_date_for(instrument_id, txt_path, common_metadata):
+    """The instrument's recording date as YYYY-MM-DD: from its field record if there is one, else the scraped metadata."""
+    record_path = os.path.join(os.path.dirname(txt_path), f"{instrument_id}.json")
+    if os.path.exists(record_path):
+        try:
+            with open(record_path, 'r', encoding='utf-8') as f:
+                recording_date = json.load(f).get('recording_date')
+            if recording_date:
+                return recording_date
+        except (OSError, ValueError):
+            pass
+    for key, value in common_metadata.items():
+        if 'date' in key.lower() and parse_date(value):
+            return parse_date(value)
+    return None
 
 def upsert_to_pinecone(db, instrument_id, txt_path, common_metadata):
+    """
+    Queues one instrument's new and changed chunks on the shared uploader, then
+    deletes the vectors of chunks it no longer has. Returns a Future that resolves
+    to the number of vectors sent once the index matches the text.
+    """
     with open(txt_path, 'r', encoding='utf-8') as f:
         full_text = f.read()
     
-    # Split by page separators (adjust if your separator differs)
-    pages = full_text.split('--- Page ')
-    page_texts = [pages[0]] + [f'--- Page {p}' for p in pages[1:]] if pages[0] else [f'--- Page {p}' for p in pages[1:]]
+    if PINECONE_LEAN_METADATA:
+        filters = {'instrument': instrument_id, 'county': COUNTY_NAMESPACE, 'document_type': DOCUMENT_TYPE}
+        recording_date = recording_date_for(instrument_id, txt_path, common_metadata)
+        if recording_date:
+            filters['recording_date'] = recording_date
     
-    all_chunks = []
-    all_metadatas = []
-    for page_num, page_text in enumerate(page_texts, start=1):
-        chunks = chunk_text(page_text)
-        metadatas = [
-            {
-                'text': chunk,
-                **common_metadata
-            } for chunk in chunks
-        ]
-        all_chunks.extend(chunks)
-        all_metadatas.extend(metadatas)
+    # Chunks never span pages; each carries its page number
+    items = []
+    texts = {}
+    hashes = {}
+    for chunk in get_chunker().chunk(full_text):
+        vid = vector_id(instrument_id, chunk['page'], chunk['index'])
+        metadata = {**common_metadata, 'page': chunk['page']}
+        if PINECONE_LEAN_METADATA:
+            index_metadata = {**filters, 'page': chunk['page']}
+            texts[vid] = (chunk['text'], metadata)
+        else:
+            # Same vector layout PineconeVectorStore.add_texts wrote (text under 'text')
+            index_metadata = {'text': chunk['text'], **metadata}
+        # Covers what the index holds as well, so switching modes re-uploads
+        hashes[vid] = content_hash(chunk['text'], [metadata, index_metadata])
+        items.append((vid, chunk['text'], index_metadata, chunk['tokens']))
     
-    vectorstore = PineconeVectorStore.from_existing_index(
-        index_name=PINECONE_INDEX_NAME,
-        embedding=embeddings,
-        namespace=COUNTY_NAMESPACE,
-        text_key='text'
-    )
+    # Only chunks whose text or metadata differ from the last upload are embedded again
+    uploader = get_uploader()
+    manifest = get_vector_manifest()
+    if manifest.known(COUNTY_NAMESPACE, instrument_id):
+        previous = manifest.hashes(COUNTY_NAMESPACE, instrument_id)
+        stored_ids = set(previous)
+    else:
+        previous = {}
+        stored_ids = set(existing_vector_ids(uploader.index, instrument_id))
+    changed = [item for item in items if previous.get(item[0]) != hashes[item[0]]]
+    stale = sorted(stored_ids - set(hashes))
+    logger.info('Compared instrument with vector manifest.', extra={'context': {
+        'instrument_id': instrument_id, 'chunks': len(items), 'changed': len(changed), 'stale': len(stale),
+        'lean_metadata': PINECONE_LEAN_METADATA,
+        'metadata_bytes': sum(len(json.dumps(item[2], default=str)) for item in changed),
+    }})
+    if PINECONE_LEAN_METADATA:
+        # Stored before the upsert so a vector is never in the index without its text
+        get_chunk_store().put_many(COUNTY_NAMESPACE, [(item[0], *texts[item[0]]) for item in changed])
     
-    vectorstore.add_texts(all_chunks, metadatas=all_metadatas)
-
-def main():
-    logger.info('Initializing Pinecone uploader.', extra={'context': {'step': 'init'}})
-    db = init_firebase()
+    result = Future()
     
-    # Query Firebase for records with status 'vision_extracted' using nested path
+    def finish(upload):
+        try:
+            upload.result()
+            # Delete only after the new vectors are in, so the instrument is never missing from search
+            delete_vectors(uploader.index, stale)
+            if PINECONE_LEAN_METADATA:
+                get_chunk_store().delete_many(COUNTY_NAMESPACE, stale)
+            manifest.replace(COUNTY_NAMESPACE, instrument_id, hashes)
+            result.set_result(len(changed))
+        except Exception as e:
+            result.set_exception(e)
+    
+    uploader.add(instrument_id, changed).add_done_callback(finish)
+    return result
+
+def seed_job_store(db, jobs, status='vision_extracted'):
+    """The first time this stage reads `status` from the local job store, imports what Firestore already has in it."""
+    if jobs.imported(COUNTY_NAMESPACE, DOCUMENT_TYPE, status):
+        return 0
     collection_ref = db.collection(COUNTY_COLLECTION) \
         .document(COUNTY_NAMESPACE) \
         .collection(DOCUMENT_TYPE)
-    records = collection_ref.where('status', '==', 'vision_extracted').stream()
+    records = collection_ref.where('status', '==', status).stream()
+    return jobs.import_records(COUNTY_NAMESPACE, DOCUMENT_TYPE, records, status)
+
+def queue_instrument(db, jobs, instrument_id, data):
+    """
+    Queues one instrument's extracted text for upload. Returns a Future that
+    resolves once it is stored and marked 'pinecone_uploaded' (to False if the
+    upload failed), or None when there is nothing to upload.
+    """
+    logger.info('Processing instrument.', extra={'context': {'instrument_id': instrument_id}})
+    print(f"Processing {instrument_id}...")
     
-    for record in records:
-        data = record.to_dict()
-        instrument_id = record.id
-        logger.info('Processing instrument.', extra={'context': {'instrument_id': instrument_id}})
-        print(f"Processing {instrument_id}...")
-        
-        # Fetch dynamic metadata from the document
-        common_metadata = data.get('metadata', {})  # Assuming 'metadata' is a dict
-        
-        extracted_dir = os.path.join(EXTRACTED_TEXT_DIR, instrument_id)
-        if not os.path.exists(extracted_dir):
-            print(f"Directory not found: {extracted_dir}")
-            logger.info('Directory not found.', extra={'context': {'instrument_id': instrument_id, 'extracted_dir': extracted_dir}})
-            continue
+    # Fetch dynamic metadata from the document
+    common_metadata = data.get('metadata', {})  # Assuming 'metadata' is a dict
+    
+    extracted_dir = os.path.join(EXTRACTED_TEXT_DIR, instrument_id)
+    if not os.path.exists(extracted_dir):
+        print(f"Directory not found: {extracted_dir}")
+        logger.info('Directory not found.', extra={'context': {'instrument_id': instrument_id, 'extracted_dir': extracted_dir}})
+        return None
+    
+    try:
+        txt_filename = f"{instrument_id}.txt"
+        txt_path = os.path.join(extracted_dir, txt_filename)
+        if not os.path.exists(txt_path):
+            print(f"File not found: {txt_path}")
+            logger.info('File not found.', extra={'context': {'instrument_id': instrument_id, 'txt_path': txt_path}})
+            return None
         
+        logger.info('Preparing to upload file to Pinecone.', extra={'context': {'instrument_id': instrument_id, 'filename': txt_filename}})
+        upload = upsert_to_pinecone(db, instrument_id, txt_path, common_metadata)
+    except Exception as e:
+        logger.error('Error uploading instrument to Pinecone.', extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
+        print(f"❌ Error uploading {instrument_id}: {e}")
+        return None
+    
+    result = Future()
+    
+    def finish(upload):
         try:
-            txt_filename = f"{instrument_id}.txt"
-            txt_path = os.path.join(extracted_dir, txt_filename)
-            if not os.path.exists(txt_path):
-                print(f"File not found: {txt_path}")
-                logger.info('File not found.', extra={'context': {'instrument_id': instrument_id, 'txt_path': txt_path}})
-                continue
-            
-            logger.info('Preparing to upload file to Pinecone.', extra={'context': {'instrument_id': instrument_id, 'filename': txt_filename}})
-            upsert_to_pinecone(db, instrument_id, txt_path, common_metadata)
-            
-            # Update status using nested path
-            doc_ref = collection_ref.document(instrument_id)
-            doc_ref.update({'status': 'pinecone_uploaded'})
+            upload.result()
+            # Update status locally; the mirror copies it to Firestore
+            jobs.update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {'status': 'pinecone_uploaded'})
             logger.info('Uploaded instrument to Pinecone.', extra={'context': {'instrument_id': instrument_id}})
             print(f"✅ Uploaded {instrument_id} to Pinecone")
+            result.set_result(True)
         except Exception as e:
             logger.error('Error uploading instrument to Pinecone.', extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
             print(f"❌ Error uploading {instrument_id}: {e}")
+            result.set_result(False)
+    
+    upload.add_done_callback(finish)
+    return result
+
+def upload_instrument(db, jobs, instrument_id, data):
+    """Uploads one instrument's extracted text and marks it 'pinecone_uploaded'. Returns False on failure."""
+    # Concurrent callers (the streaming pipeline's workers) still share embedding batches
+    result = queue_instrument(db, jobs, instrument_id, data)
+    return result is not None and result.result()
+
+def upload_pending(db, jobs):
+    """Uploads every claimable 'vision_extracted' instrument. Returns the instruments that failed."""
+    # Claim records with status 'vision_extracted' from the local job store and queue
+    # them all; their chunks are embedded and upserted together in large batches
+    failed = []
+    uploads = {}
+    worker_id = new_worker_id()
+    with jobs.holding_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, worker_id):
+        for instrument_id, data in jobs.iter_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, 'vision_extracted', worker_id=worker_id):
+            result = queue_instrument(db, jobs, instrument_id, data)
+            if result is None:
+                failed.append(instrument_id)
+            else:
+                uploads[instrument_id] = result
+        close_uploader()
+    failed.extend(instrument_id for instrument_id, result in uploads.items() if not result.result())
+
+    # Failed records keep their status; release them so the next run retries right away
+    for instrument_id in failed:
+        jobs.release(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id)
+    return failed
+
+def legacy_vector_ids(index):
+    """IDs in the namespace from before deterministic IDs; those were random UUIDs, so they have no '#'."""
+    ids = []
+    for page in index.list(namespace=COUNTY_NAMESPACE):
+        ids.extend(vid for vid in page if '#' not in vid)
+    return ids
+
+def migrate_vector_ids(db, jobs):
+    """
+    One-time cleanup for an index filled before deterministic IDs. Every
+    'pinecone_uploaded' instrument the manifest doesn't know is re-uploaded under
+    the new IDs; once all of them are in, the random-ID vectors are deleted, so
+    search never loses an instrument and the index ends up without duplicates.
+    Listing the namespace needs a serverless index. Returns the number of vectors deleted.
+    """
+    seed_job_store(db, jobs, 'pinecone_uploaded')
+    manifest = get_vector_manifest()
+    requeued = [
+        instrument_id for instrument_id in jobs.claimable(COUNTY_NAMESPACE, DOCUMENT_TYPE, 'pinecone_uploaded')
+        if not manifest.known(COUNTY_NAMESPACE, instrument_id)
+    ]
+    for instrument_id in requeued:
+        jobs.update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {'status': 'vision_extracted'})
+    logger.info('Requeued instruments for deterministic vector IDs.', extra={'context': {'step': 'migrate_ids', 'requeued': len(requeued)}})
+    failed = upload_pending(db, jobs)
+    if failed:
+        # Their old vectors are all the index has for them; try again after fixing them
+        logger.error('Legacy vectors kept: instruments failed to re-upload.', extra={'context': {'step': 'migrate_ids', 'failed': failed}})
+        print(f"❌ {len(failed)} instruments failed to re-upload; legacy vectors were not deleted")
+        return 0
+    index = pc.Index(PINECONE_INDEX_NAME)
+    ids = legacy_vector_ids(index)
+    delete_vectors(index, ids)
+    logger.info('Deleted legacy vectors.', extra={'context': {'step': 'migrate_ids', 'deleted': len(ids)}})
+    print(f"✅ Deleted {len(ids)} legacy vectors")
+    return len(ids)
+
+def main(command='upload'):
+    """upload: upload every 'vision_extracted' instrument; migrate-ids: one-time cleanup of random-ID vectors (see migrate_vector_ids)."""
+    logger.info('Initializing Pinecone uploader.', extra={'context': {'step': 'init', 'command': command}})
+    db = init_firebase()
+    jobs = get_job_store()
+    mirror = start_firestore_mirror(db, COUNTY_COLLECTION)
+    seed_job_store(db, jobs)
+    if command == 'migrate-ids':
+        migrate_vector_ids(db, jobs)
+    else:
+        upload_pending(db, jobs)
+    mirror.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python pinecone_uploader.py [upload|migrate-ids]
+    main(sys.argv[1] if len(sys.argv) > 1 else 'upload')
@@ -0,0 +1,228 @@
+import importlib
+import os
+import queue
+import threading
+import time
+
+from firebase_utils.firebase_config import init_firebase
+from utils.job_store import get_job_store, start_firestore_mirror
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+# Per-stage worker counts and queue depth for the streaming pipeline
+VISION_WORKERS = int(os.getenv('PIPELINE_VISION_WORKERS', '2'))
+PINECONE_WORKERS = int(os.getenv('PIPELINE_PINECONE_WORKERS', '2'))
+# A full queue blocks the stage feeding it, so at most this many documents wait between stages
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '8'))
+
+_STOP = object()
+
+
+class Stage:
+    """
+    Worker pool fed by a bounded queue of instrument ids. Each worker claims the
+    job in the job store (so a document queued twice is only processed once) and
+    runs handler(instrument_id, data) -> bool. The handler itself moves the job to
+    output_status, which is what hands the document to the next stage.
+
+    Each worker keeps renewing the leases on what it has claimed until close(),
+    so failed documents stay claimed and aren't retried in a loop within one
+    run; close() releases them for the next run.
+    """
+
+    def __init__(self, name, status, output_status, handler, workers, queue_size, jobs, county, document_type):
+        self.name = name
+        self.status = status
+        self.output_status = output_status
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.jobs = jobs
+        self.county = county
+        self.document_type = document_type
+        self.processed = 0
+        self.failed = []
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closing = threading.Event()
+
+    def start(self):
+        for worker_id in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"pipeline-{self.name}-{worker_id}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, instrument_id):
+        """Queues a document; blocks while the stage is at capacity. Ignored once the stage is closing."""
+        while not self._closing.is_set():
+            try:
+                self.queue.put(instrument_id, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def submit_backlog(self):
+        """Queues every unclaimed document already waiting in this stage's status."""
+        backlog = self.jobs.claimable(self.county, self.document_type, self.status)
+        for instrument_id in backlog:
+            self.submit(instrument_id)
+        return len(backlog)
+
+    def _run(self, worker_id):
+        worker_name = f"{os.getpid()}-{self.name}-{worker_id}"
+        with self.jobs.holding_claims(self.county, self.document_type, worker_name):
+            while True:
+                instrument_id = self.queue.get()
+                if instrument_id is _STOP:
+                    return
+                data = self.jobs.claim(self.county, self.document_type, instrument_id, self.status, worker_id=worker_name)
+                if data is None:
+                    continue  # Already taken by another worker or moved past this stage
+                started = time.monotonic()
+                try:
+                    ok = self.handler(instrument_id, data)
+                except Exception as e:
+                    ok = False
+                    logger.error('Pipeline stage failed.', extra={'context': {'stage': self.name, 'instrument_id': instrument_id, 'error': str(e)}})
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self.busy_seconds += elapsed
+                    if ok:
+                        self.processed += 1
+                    else:
+                        self.failed.append(instrument_id)
+                logger.info('Pipeline stage finished document.', extra={'context': {'stage': self.name, 'worker_id': worker_id, 'instrument_id': instrument_id, 'ok': bool(ok), 'seconds': round(elapsed, 2)}})
+
+    def close(self):
+        """Lets the workers drain the queue, waits for them and releases failed documents."""
+        self._closing.set()
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        for instrument_id in self.failed:
+            self.jobs.release(self.county, self.document_type, instrument_id)
+
+    def summary(self):
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': len(self.failed),
+            'avg_seconds': round(self.busy_seconds / (self.processed + len(self.failed)), 2) if self.processed or self.failed else 0,
+        }
+
+
+class StreamingPipeline:
+    """
+    Runs download -> vision -> Pinecone as concurrent stages. Stages are linked
+    through job-store status changes: when a job reaches a stage's input status
+    (e.g. the downloader records 'pdf_downloaded'), it is queued on that stage
+    right away instead of waiting for the whole batch to finish upstream.
+
+    Status changes are only recorded on the writing thread (often a stage
+    worker); a router thread does the possibly blocking hand-off to the next
+    stage, so a full queue never stalls the worker that fills it.
+    """
+
+    def __init__(self, county, document_type, stages):
+        self.county = county
+        self.document_type = document_type
+        self.stages = stages
+        self._by_status = {stage.status: stage for stage in stages}
+        self._entered = {}
+        self._latencies = []
+        self._lock = threading.Lock()
+        self._events = queue.Queue()
+        self._router = threading.Thread(target=self._dispatch, name='pipeline-router', daemon=True)
+
+    def _route(self, county, document_type, instrument_id, data, status_changed):
+        # Job-store listener: runs on the thread that wrote the job, so it must not block
+        if not status_changed or county != self.county or document_type != self.document_type:
+            return
+        self._events.put((instrument_id, data.get('status'), time.monotonic()))
+
+    def _dispatch(self):
+        while True:
+            event = self._events.get()
+            try:
+                if event is _STOP:
+                    return
+                instrument_id, status, changed_at = event
+                with self._lock:
+                    if instrument_id not in self._entered:
+                        self._entered[instrument_id] = changed_at
+                    elif self.stages and status == self.stages[-1].output_status:
+                        # Latency from the first status change this run saw to the last stage's output
+                        self._latencies.append(changed_at - self._entered[instrument_id])
+                stage = self._by_status.get(status)
+                if stage is not None:
+                    stage.submit(instrument_id)
+            except Exception as e:
+                logger.error('Pipeline routing failed.', extra={'context': {'event': str(event), 'error': str(e)}})
+            finally:
+                self._events.task_done()
+
+    def run(self, download):
+        """Runs download() on this thread while the stages consume its output, then drains them in order."""
+        jobs = self.stages[0].jobs if self.stages else get_job_store()
+        jobs.add_listener(self._route)
+        self._router.start()
+        for stage in self.stages:
+            stage.start()
+        try:
+            download()
+        finally:
+            # Downstream stages keep running while upstream ones drain into them
+            for stage in self.stages:
+                self._events.join()  # Everything upstream produced is queued on its stage
+                backlog = stage.submit_backlog()
+                logger.info('Draining pipeline stage.', extra={'context': {'stage': stage.name, 'backlog': backlog}})
+                stage.close()
+            jobs.remove_listener(self._route)
+            self._events.put(_STOP)
+            self._router.join()
+
+        latencies = sorted(self._latencies)
+        summary = {
+            'stages': {stage.name: stage.summary() for stage in self.stages},
+            'documents_completed': len(latencies),
+            'median_latency_seconds': round(latencies[len(latencies) // 2], 2) if latencies else None,
+            'max_latency_seconds': round(latencies[-1], 2) if latencies else None,
+        }
+        logger.info('Pipeline summary.', extra={'context': {'step': 'pipeline_summary', **summary}})
+        return summary
+
+
+def run(county, download, vision_enabled, pinecone_enabled):
+    """Streams documents from download() through the enabled vision and Pinecone stages."""
+    config = importlib.import_module(f'{county}.config').load_config()
+    county_namespace = config.get('COUNTY_NAMESPACE')
+    document_type = config.get('DOCUMENT_TYPE')
+    db = init_firebase()
+    jobs = get_job_store()
+    mirror = start_firestore_mirror(db, config.get('COUNTY_COLLECTION'))
+
+    stages = []
+    if vision_enabled:
+        import vision_extractor
+        vision_extractor.seed_job_store(db, jobs, 'pdf_downloaded')
+        stage = Stage('vision', 'pdf_downloaded', 'vision_extracted',
+                      lambda instrument_id, data: vision_extractor.extract_vision_summary(db, instrument_id, document_type) is not None,
+                      VISION_WORKERS, QUEUE_SIZE, jobs, county_namespace, document_type)
+        stages.append(stage)
+    if pinecone_enabled:
+        import pinecone_uploader
+        pinecone_uploader.seed_job_store(db, jobs)
+        stage = Stage('pinecone', 'vision_extracted', 'pinecone_uploaded',
+                      lambda instrument_id, data: pinecone_uploader.upload_instrument(db, jobs, instrument_id, data),
+                      PINECONE_WORKERS, QUEUE_SIZE, jobs, county_namespace, document_type)
+        stages.append(stage)
+
+    summary = StreamingPipeline(county_namespace, document_type, stages).run(download)
+    if pinecone_enabled:
+        pinecone_uploader.close_uploader()
+    mirror.stop()
+    return summary
@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from utils.embedding_cache import EmbeddingCache, embed_with_cache
+
+
+class FailingConnection:
+    """Wraps the cache's SQLite connection and fails the first statement containing `fail_on`."""
+
+    def __init__(self, conn, fail_on):
+        self._conn = conn
+        self.fail_on = fail_on
+
+    def _check(self, sql):
+        if self.fail_on and self.fail_on in sql:
+            self.fail_on = None
+            raise RuntimeError('injected failure')
+
+    def execute(self, sql, *args):
+        self._check(sql)
+        return self._conn.execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self._check(sql)
+        return self._conn.executemany(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def make_cache(tmp_path, max_entries=2):
+    return EmbeddingCache('test-model', str(tmp_path), max_entries=max_entries)
+
+
+def test_round_trip_and_lru_eviction(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_many(['a', 'b'], [[1.0, 1.0], [2.0, 2.0]])
+    assert cache.get_many(['a']) == [[1.0, 1.0]]  # b is now least recently used
+    cache.put_many(['c'], [[3.0, 3.0]])
+    assert cache.get_many(['a', 'b', 'c']) == [[1.0, 1.0], None, [3.0, 3.0]]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_rolled_back_eviction_keeps_evicted_vector(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_many(['a', 'b'], [[1.0, 1.0], [2.0, 2.0]])
+    cache.get_many(['a'])
+    # Fails after b's row was deleted to make room for c, before the commit
+    cache._conn = FailingConnection(cache._conn, 'INSERT INTO embedding_cache (')
+    with pytest.raises(RuntimeError):
+        cache.put_many(['c'], [[9.0, 9.0]])
+    assert cache.get_many(['a', 'b', 'c']) == [[1.0, 1.0], [2.0, 2.0], None]
+
+
+def test_unfinished_write_is_not_read(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put_many(['a', 'b'], [[1.0, 1.0], [2.0, 2.0]])
+    cache.get_many(['a'])
+    # The slot is reserved and written, but the writer dies before marking it ready
+    cache._conn = FailingConnection(cache._conn, 'SET ready = 1')
+    with pytest.raises(RuntimeError):
+        cache.put_many(['c'], [[9.0, 9.0]])
+    cache._conn = cache._conn._conn
+    assert cache.get_many(['a', 'b', 'c']) == [[1.0, 1.0], None, None]
+    # A later put of the same text finishes the pending entry
+    cache.put_many(['c'], [[3.0, 3.0]])
+    assert cache.get_many(['c']) == [[3.0, 3.0]]
+
+
+def test_embed_with_cache_embeds_each_missing_text_once(tmp_path):
+    cache = make_cache(tmp_path, max_entries=10)
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text)), 0.0] for text in texts]
+
+    assert embed_with_cache(cache, embed, ['a', 'bb', 'a']) == [[1.0, 0.0], [2.0, 0.0], [1.0, 0.0]]
+    assert embed_with_cache(cache, embed, ['bb', 'ccc']) == [[2.0, 0.0], [3.0, 0.0]]
+    assert calls == [['a', 'bb'], ['ccc']]
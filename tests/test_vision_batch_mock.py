@@ -0,0 +1,87 @@
+import importlib
+import os
+
+import pytest
+
+pytest.importorskip('firebase_admin')
+fitz = pytest.importorskip('fitz')
+
+from utils.job_store import JobStore
+from utils.mock_openai_batch import MockBatchClient
+from utils.ocr_cache import OcrCache
+
+
+@pytest.fixture
+def batch_env(tmp_path, monkeypatch):
+    # Batch mode against the local mock endpoint must work without an API key
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    monkeypatch.setenv('COUNTY', 'mypinellasclerk')
+    vision_extractor = importlib.import_module('vision_extractor')
+    vision_batch = importlib.import_module('vision_batch')
+    monkeypatch.setattr(vision_extractor, 'OPENAI_API_KEY', None)
+    monkeypatch.setattr(vision_extractor, 'PDF_DIRECTORY', str(tmp_path / 'pdfs'))
+    monkeypatch.setattr(vision_extractor, 'IMAGE_DIRECTORY', str(tmp_path / 'images'))
+    for module in (vision_extractor, vision_batch):
+        monkeypatch.setattr(module, 'EXTRACTED_TEXT_DIRECTORY', str(tmp_path / 'text'))
+    monkeypatch.setattr(vision_batch, 'VISION_BATCH_DIR', str(tmp_path / 'batches'))
+    monkeypatch.setattr(vision_batch, 'VISION_BATCH_MOCK', True)
+    monkeypatch.setattr(vision_batch, 'FIELD_EXTRACTION_ENABLED', False)
+    cache = OcrCache(str(tmp_path / 'ocr_cache.sqlite3'))
+    monkeypatch.setattr(vision_batch, 'get_ocr_cache', lambda: cache)
+    jobs = JobStore(str(tmp_path / 'job_state.sqlite3'))
+    return vision_extractor, vision_batch, jobs
+
+
+def queue_pdf(vision_extractor, vision_batch, jobs, instrument_id, pages):
+    path = vision_extractor.pdf_path_for(instrument_id)
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        # Too little text to stand in for OCR, but enough to make every page image distinct
+        doc.new_page().insert_text((72, 72), f"{instrument_id} p{page_num}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc.save(path)
+    jobs.update(vision_batch.COUNTY_NAMESPACE, vision_batch.DOCUMENT_TYPE, instrument_id, {'status': 'pdf_downloaded'})
+
+
+def status_of(vision_batch, jobs, instrument_id):
+    return jobs.get(vision_batch.COUNTY_NAMESPACE, vision_batch.DOCUMENT_TYPE, instrument_id)['status']
+
+
+def test_mock_batch_round_trip(batch_env, tmp_path):
+    vision_extractor, vision_batch, jobs = batch_env
+    queue_pdf(vision_extractor, vision_batch, jobs, '1001', 2)
+    queue_pdf(vision_extractor, vision_batch, jobs, '1002', 1)
+    assert isinstance(vision_batch.get_batch_client(), MockBatchClient)
+    client = MockBatchClient(str(tmp_path / 'batches' / 'mock_api'), polls_until_complete=2)
+
+    vision_batch.submit_pending(client, jobs)
+    assert status_of(vision_batch, jobs, '1001') == vision_batch.SUBMITTED_STATUS
+    assert status_of(vision_batch, jobs, '1002') == vision_batch.SUBMITTED_STATUS
+
+    assert vision_batch.collect(client, jobs) == 1  # Still running on the first poll
+    assert vision_batch.collect(client, jobs) == 0
+    for instrument_id, pages in (('1001', 2), ('1002', 1)):
+        assert status_of(vision_batch, jobs, instrument_id) == 'vision_extracted'
+        with open(tmp_path / 'text' / instrument_id / f"{instrument_id}.txt", encoding='utf-8') as f:
+            text = f.read()
+        for page_num in range(1, pages + 1):
+            assert f"[mock OCR output for {instrument_id}|{page_num}]" in text
+
+
+def test_mock_batch_failed_requests_return_for_retry(batch_env, tmp_path):
+    vision_extractor, vision_batch, jobs = batch_env
+    queue_pdf(vision_extractor, vision_batch, jobs, '2001', 2)
+    client = MockBatchClient(str(tmp_path / 'batches' / 'mock_api'), fail_ids={'2001|2'})
+
+    vision_batch.submit_pending(client, jobs)
+    assert vision_batch.collect(client, jobs) == 0
+    assert status_of(vision_batch, jobs, '2001') == 'pdf_downloaded'
+
+    # Only the failed page is sent again
+    client = MockBatchClient(str(tmp_path / 'batches' / 'mock_api'))
+    vision_batch.submit_pending(client, jobs)
+    manifests = [vision_batch.load_manifest(path) for path in vision_batch.manifest_paths()]
+    assert sorted(len(manifest['requests']) for manifest in manifests) == [1, 2]
+    assert vision_batch.collect(client, jobs) == 0
+    assert status_of(vision_batch, jobs, '2001') == 'vision_extracted'
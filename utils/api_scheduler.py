@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+
+class RateBudget:
+    """
+    Token bucket holding up to per_minute units that refills continuously.
+    acquire() blocks until the requested amount is available; an amount larger
+    than the whole bucket waits for a full bucket rather than forever.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        if not self.capacity:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) / self.rate
+            delay = min(delay, 1.0)
+            time.sleep(delay)
+            waited += delay
+
+    def empty(self):
+        """Drops whatever is left, e.g. after the server says we're over quota."""
+        with self._lock:
+            self._refill()
+            self.level = 0.0
+
+
+class AdaptiveConcurrency:
+    """
+    Limits in-flight calls. The limit grows by one after `limit` consecutive
+    successes and halves on a rate-limit response (additive increase,
+    multiplicative decrease), so it settles just under what the quota allows.
+    """
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, success=True):
+        with self._cond:
+            self.active -= 1
+            if success:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def backoff(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+            return self.limit
+
+
+class ApiScheduler:
+    """
+    Runs API calls from any number of callers on a shared thread pool, within a
+    global requests-per-minute and tokens-per-minute budget. Calls failing with
+    HTTP 429 shrink the concurrency limit, pause every caller for the server's
+    Retry-After (or an exponential backoff), and are retried. Exceptions of the
+    `retryable` types are retried with backoff without touching concurrency.
+    """
+
+    def __init__(self, name, max_concurrency=16, requests_per_minute=0, tokens_per_minute=0,
+                 max_retries=6, retryable=(), initial_concurrency=None):
+        self.name = name
+        self.max_retries = max_retries
+        self.retryable = tuple(retryable)
+        self.requests = RateBudget(requests_per_minute)
+        self.tokens = RateBudget(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency or max(1, max_concurrency // 2), max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix=f"{name}-api")
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'rate_limited': 0, 'retried': 0, 'failed': 0, 'budget_wait_seconds': 0.0}
+
+    def submit(self, call, *args, estimated_tokens=0, **kwargs):
+        """Schedules call(*args, **kwargs) and returns a Future for its result."""
+        return self._executor.submit(self._execute, call, args, kwargs, estimated_tokens)
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                remaining = self._pause_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def _execute(self, call, args, kwargs, estimated_tokens):
+        for attempt in range(self.max_retries + 1):
+            self.concurrency.acquire()
+            success = False
+            try:
+                self._wait_for_pause()
+                waited = self.requests.acquire(1) + self.tokens.acquire(estimated_tokens)
+                result = call(*args, **kwargs)
+                success = True
+                with self._lock:
+                    self.stats['calls'] += 1
+                    self.stats['budget_wait_seconds'] += waited
+                return result
+            except Exception as e:
+                rate_limited = _status_code(e) == 429
+                if attempt == self.max_retries or not (rate_limited or isinstance(e, self.retryable)):
+                    with self._lock:
+                        self.stats['failed'] += 1
+                    raise
+                delay = _retry_after(e) or min(60.0, (2 ** attempt) * (1 + random.random()))
+                with self._lock:
+                    self.stats['retried'] += 1
+                    self.stats['rate_limited'] += rate_limited
+                if rate_limited:
+                    limit = self.concurrency.backoff()
+                    self.tokens.empty()
+                    self._pause(delay)
+                    logger.warning('Rate limited, backing off.', extra={'context': {'scheduler': self.name, 'attempt': attempt + 1, 'retry_in_seconds': round(delay, 2), 'concurrency': limit}})
+                else:
+                    logger.warning('API call failed, retrying.', extra={'context': {'scheduler': self.name, 'attempt': attempt + 1, 'retry_in_seconds': round(delay, 2), 'error': str(e)}})
+            finally:
+                self.concurrency.release(success)
+            if not rate_limited:
+                time.sleep(delay)
+
+    def summary(self):
+        with self._lock:
+            return {**self.stats, 'budget_wait_seconds': round(self.stats['budget_wait_seconds'], 2), 'concurrency': self.concurrency.limit}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for name in ('retry-after-ms', 'retry-after'):
+        value = headers.get(name)
+        try:
+            if value is not None:
+                seconds = float(value) / (1000.0 if name == 'retry-after-ms' else 1.0)
+                return min(seconds, 120.0)
+        except (TypeError, ValueError):
+            continue
+    return None
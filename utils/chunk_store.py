@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", os.path.join("data", "chunk_store.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (namespace, vector_id)
+);
+"""
+
+
+class ChunkStore:
+    """
+    Local home of each vector's chunk text and full metadata, zlib-compressed and
+    keyed by vector ID, for indexes that only keep filterable fields in Pinecone.
+    Query results are filled back in with hydrate().
+    """
+
+    def __init__(self, path=CHUNK_STORE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def put_many(self, namespace, entries):
+        """Stores (vector_id, text, metadata) entries, replacing earlier versions."""
+        rows = [
+            (namespace, vector_id, zlib.compress(json.dumps({'text': text, 'metadata': metadata}, default=str).encode('utf-8'), 6))
+            for vector_id, text, metadata in entries
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (namespace, vector_id, data) VALUES (?, ?, ?)", rows)
+
+    def get_many(self, namespace, vector_ids):
+        """Returns {vector_id: {'text', 'metadata'}} for the IDs that are stored."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(vector_ids), 500):
+                part = list(vector_ids[start:start + 500])
+                query = f"SELECT vector_id, data FROM chunks WHERE namespace = ? AND vector_id IN ({','.join('?' * len(part))})"
+                found.update(self._conn.execute(query, [namespace, *part]).fetchall())
+        return {vector_id: json.loads(zlib.decompress(data)) for vector_id, data in found.items()}
+
+    def delete_many(self, namespace, vector_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE namespace = ? AND vector_id = ?", [(namespace, vector_id) for vector_id in vector_ids])
+
+    def hydrate(self, namespace, matches, text_key='text'):
+        """
+        Fills Pinecone query matches (dicts or match objects) back in with their
+        full metadata and chunk text under text_key. Matches not in the store
+        are returned unchanged.
+        """
+        def get(match, name):
+            return match.get(name) if isinstance(match, dict) else getattr(match, name, None)
+
+        stored = self.get_many(namespace, [get(match, 'id') for match in matches])
+        hydrated = []
+        for match in matches:
+            entry = stored.get(get(match, 'id'))
+            if entry is None:
+                hydrated.append(match)
+                continue
+            metadata = {**(get(match, 'metadata') or {}), **entry['metadata'], text_key: entry['text']}
+            hydrated.append({'id': get(match, 'id'), 'score': get(match, 'score'), 'metadata': metadata})
+        return hydrated
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chunk_store():
+    """Returns the process-wide ChunkStore at CHUNK_STORE_PATH."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChunkStore()
+        return _store
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+
+import tiktoken
+
+# Chunk size and overlap in embedding-model tokens (~1000/150 characters of English)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+CHUNK_ENCODING = os.getenv("CHUNK_ENCODING", "cl100k_base")
+
+# '--- Page N ---' is what vision_extractor writes; '--- PAGE BREAK ---' is the older format
+PAGE_MARKER = re.compile(r"^[ \t]*---[ \t]*(?:Page[ \t]+(\d+)|PAGE BREAK)[ \t]*---[ \t]*$\n?", re.MULTILINE)
+
+
+def split_pages(text):
+    """Splits combined text on its page markers into [(page_num, page_text, start offset)]; unmarked text is page 1."""
+    pages = []
+    page_num, start = 1, 0
+    for match in PAGE_MARKER.finditer(text):
+        if text[start:match.start()].strip():
+            pages.append((page_num, text[start:match.start()], start))
+            page_num += 1
+        if match.group(1):
+            page_num = int(match.group(1))
+        start = match.end()
+    if text[start:].strip():
+        pages.append((page_num, text[start:], start))
+    return pages
+
+
+class TokenChunker:
+    """
+    Packs whole lines into chunks of up to chunk_tokens tokens, repeating about
+    overlap_tokens worth of trailing lines at the start of the next chunk, and never
+    crosses a page marker. All lines of a document are tokenized in one batch;
+    lines longer than a chunk are cut on token boundaries.
+    """
+
+    def __init__(self, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, encoding=CHUNK_ENCODING):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = tiktoken.get_encoding(encoding)
+
+    def chunk(self, text):
+        """Returns [{'text', 'page', 'index', 'start', 'tokens'}]; index counts chunks within the page."""
+        pages = split_pages(text)
+        lines = []  # (page_num, start offset, line)
+        for page_num, page_text, page_start in pages:
+            offset = page_start
+            for line in page_text.splitlines(keepends=True):
+                lines.append((page_num, offset, line))
+                offset += len(line)
+        counts = [len(tokens) for tokens in self.encoding.encode_ordinary_batch([line for _, _, line in lines])]
+
+        chunks = []
+        current, current_tokens, current_page = [], 0, None
+        for (page_num, offset, line), tokens in zip(lines, counts):
+            if page_num != current_page:
+                self._emit(chunks, current)
+                current, current_tokens, current_page = [], 0, page_num
+            for piece_offset, piece, piece_tokens in self._pieces(offset, line, tokens):
+                if current and current_tokens + piece_tokens > self.chunk_tokens:
+                    self._emit(chunks, current)
+                    current, current_tokens = self._overlap(current)
+                    if current_tokens + piece_tokens > self.chunk_tokens:
+                        current, current_tokens = [], 0
+                current.append((page_num, piece_offset, piece, piece_tokens))
+                current_tokens += piece_tokens
+        self._emit(chunks, current)
+        return chunks
+
+    def _pieces(self, offset, line, tokens):
+        if tokens <= self.chunk_tokens:
+            return [(offset, line, tokens)]
+        encoded = self.encoding.encode_ordinary(line)
+        pieces = []
+        for start in range(0, len(encoded), self.chunk_tokens):
+            piece = self.encoding.decode(encoded[start:start + self.chunk_tokens])
+            pieces.append((offset, piece, len(encoded[start:start + self.chunk_tokens])))
+            offset += len(piece)
+        return pieces
+
+    def _overlap(self, current):
+        tail, tokens = [], 0
+        for item in reversed(current):
+            if tokens + item[3] > self.overlap_tokens:
+                break
+            tail.append(item)
+            tokens += item[3]
+        tail.reverse()
+        return tail, tokens
+
+    @staticmethod
+    def _emit(chunks, current):
+        text = ''.join(item[2] for item in current).strip()
+        if not text:
+            return
+        page_num = current[0][0]
+        index = chunks[-1]['index'] + 1 if chunks and chunks[-1]['page'] == page_num else 0
+        chunks.append({
+            'text': text,
+            'page': page_num,
+            'index': index,
+            'start': current[0][1],
+            'tokens': sum(item[3] for item in current),
+        })
+
+
+_chunker = None
+_chunker_lock = threading.Lock()
+
+
+def get_chunker():
+    """Returns the process-wide TokenChunker; the tokenizer is loaded once."""
+    global _chunker
+    with _chunker_lock:
+        if _chunker is None:
+            _chunker = TokenChunker()
+        return _chunker
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join("data", "embedding_cache"))
+# Vectors kept per model; the least recently used slot is reused once it is full.
+# 200,000 x 1536 dims is about 1.2 GB of float32.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "True") == "True"
+INITIAL_ROWS = 1024
+# A slot reserved by a writer that never finished (crashed) can be reused after this long
+PENDING_SLOT_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    key TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL UNIQUE,
+    last_used REAL NOT NULL,
+    ready INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used);
+CREATE TABLE IF NOT EXISTS embedding_cache_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent map from sha256(chunk text) to its embedding for one model. Vectors
+    live in a memory-mapped float32 matrix ({model}.f32, one row per slot); the
+    SQLite index ({model}.sqlite3) maps keys to slots and tracks recency for LRU
+    reuse of slots once max_entries is reached.
+
+    Several processes may share a cache. A slot is first reserved for its new key
+    (ready = 0) in a committed transaction that also deletes the entry it evicts;
+    only then is the vector written, and the key marked ready. Reads hold the
+    write lock while they copy vectors, so no slot changes under them, and a
+    rolled-back reservation never leaves another key pointing at a rewritten slot.
+    """
+
+    def __init__(self, model, directory=EMBEDDING_CACHE_DIR, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model = model
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', model)
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, f"{name}.sqlite3"), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(embedding_cache)")]
+        if 'ready' not in columns:
+            self._conn.execute("ALTER TABLE embedding_cache ADD COLUMN ready INTEGER NOT NULL DEFAULT 1")
+        self.dim = None
+        self._vectors = None
+        self._rows = 0
+        self._load_dim()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_dim(self):
+        # Set by whichever process stored the first vector
+        row = self._conn.execute("SELECT value FROM embedding_cache_meta WHERE name = 'dim'").fetchone()
+        if row and self.dim is None:
+            self.dim = int(row[0])
+            self._open(max(INITIAL_ROWS, self._file_rows()))
+        return self.dim
+
+    def _file_rows(self):
+        return os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+
+    def _ensure_rows(self, rows):
+        """Makes sure slots below rows are mapped, growing the file or picking up growth by other processes."""
+        if rows > self._rows:
+            self._open(max(rows, self._file_rows()))
+
+    def _open(self, rows):
+        # Grow the file first; np.memmap can't extend an existing mapping
+        with open(self.vectors_path, 'ab') as f:
+            if f.tell() < rows * self.dim * 4:
+                f.truncate(rows * self.dim * 4)
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dim))
+        self._rows = rows
+
+    def get_many(self, texts):
+        """Returns a list with each text's cached vector (list of floats), or None where it isn't cached."""
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        now = time.time()
+        with self._lock:
+            if self.dim is None and self._load_dim() is None:
+                self.misses += len(texts)
+                return results
+            # Held until the vectors are copied: a slot is only evicted under this lock
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                slots = {}
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    query = f"SELECT key, slot FROM embedding_cache WHERE ready = 1 AND key IN ({','.join('?' * len(part))})"
+                    slots.update(self._conn.execute(query, part).fetchall())
+                if slots:
+                    self._ensure_rows(max(slots.values()) + 1)
+                for i, key in enumerate(keys):
+                    if key in slots:
+                        results[i] = self._vectors[slots[key]].tolist()
+                found = [(now, key) for key in slots]
+                self._conn.executemany("UPDATE embedding_cache SET last_used = ? WHERE key = ?", found)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return results
+
+    def put_many(self, texts, vectors):
+        if not texts:
+            return
+        with self._lock:
+            reserved, evicted = self._reserve(texts, vectors)
+            if not reserved:
+                return
+            # The slots now belong to keys nobody reads yet, so they can be written outside the lock
+            for key, slot, vector in reserved:
+                self._vectors[slot] = vector
+            self._vectors.flush()
+            self._conn.executemany("UPDATE embedding_cache SET ready = 1 WHERE key = ? AND slot = ?", [(key, slot) for key, slot, _ in reserved])
+            self.evictions += evicted
+
+    def _reserve(self, texts, vectors):
+        """Commits a not-yet-ready row, and a slot, for every text that isn't cached. Returns ([(key, slot, vector)], evictions)."""
+        now = time.time()
+        reserved, evicted = [], 0
+        # IMMEDIATE takes the write lock before the slot count is read, so two
+        # processes can't hand out the same free slot
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.dim is None and self._load_dim() is None:
+                self.dim = len(vectors[0])
+                self._conn.execute("INSERT INTO embedding_cache_meta (name, value) VALUES ('dim', ?)", (str(self.dim),))
+                self._open(INITIAL_ROWS)
+            for text, vector in zip(texts, vectors):
+                if len(vector) != self.dim:
+                    continue
+                key = text_key(text)
+                row = self._conn.execute("SELECT slot, ready FROM embedding_cache WHERE key = ?", (key,)).fetchone()
+                if row and row[1]:
+                    continue  # Cached meanwhile by another process
+                if row:
+                    slot = row[0]  # Left pending by a writer that didn't finish; write it again
+                else:
+                    slot, was_evicted = self._free_slot(now)
+                    if slot is None:
+                        continue
+                    evicted += was_evicted
+                    self._conn.execute("INSERT INTO embedding_cache (key, slot, last_used, ready) VALUES (?, ?, ?, 0)", (key, slot, now))
+                self._ensure_rows(slot + 1)
+                reserved.append((key, slot, vector))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return reserved, evicted
+
+    def _free_slot(self, now):
+        """Returns (slot, evicted) for a new entry, or (None, False) when every slot is reserved by an unfinished write."""
+        # Entries are only removed by handing their slot to a new entry, so slots 0..count-1 are the used ones
+        count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if count < self.max_entries:
+            if count >= self._rows:
+                self._ensure_rows(min(self.max_entries, max(self._rows * 2, count + 1)))
+            return count, False
+        # Full: take the least recently used entry's slot
+        row = self._conn.execute(
+            "SELECT key, slot FROM embedding_cache WHERE ready = 1 OR last_used < ? ORDER BY last_used LIMIT 1",
+            (now - PENDING_SLOT_SECONDS,),
+        ).fetchone()
+        if row is None:
+            return None, False
+        self._conn.execute("DELETE FROM embedding_cache WHERE key = ?", (row[0],))
+        return row[1], True
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache WHERE ready = 1").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'model': self.model, 'hits': self.hits, 'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'entries': entries, 'evictions': self.evictions,
+            'size_bytes': self._rows * (self.dim or 0) * 4,
+        }
+
+
+def embed_with_cache(cache, embed, texts):
+    """
+    embed(texts) for only the texts the cache doesn't have, each distinct text once;
+    duplicates within the batch and chunks embedded on earlier runs cost nothing.
+    """
+    if cache is None:
+        return embed(texts)
+    vectors = cache.get_many(texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        fresh = dict(zip(missing, embed(missing)))
+        cache.put_many(missing, [fresh[text] for text in missing])
+        vectors = [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+    return vectors
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model):
+    """Returns the process-wide EmbeddingCache for model, or None when EMBEDDING_CACHE_ENABLED is off."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EmbeddingCache(model)
+        return _caches[model]
@@ -0,0 +1,111 @@
+import re
+from datetime import datetime
+
+# Fields of a lien/mortgage record, in output order. debtor is the borrower or
+# property owner; creditor is the lender, lienor or claimant.
+RECORD_FIELDS = ('debtor', 'creditor', 'amount', 'parcel_id', 'loan_number', 'recording_date')
+
+QUOTE = r"[\"“”']"
+DATE_FORMATS = ('%m/%d/%Y', '%m-%d-%Y', '%m/%d/%y', '%B %d, %Y', '%b %d, %Y', '%B %d %Y', '%Y-%m-%d')
+
+# The clerk's recording stamp heads page 1: "Instrument #: 2025297466, Pg 1 of 14, 7/9/2025 4:46:25 PM ..."
+RECORDING_STAMP = re.compile(r"Instrument\s*#?:?\s*\d{6,}[^\n]{0,40}?(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE)
+RECORDED_ON = re.compile(r"(?:Recorded|Filed)\s*(?:on|date)?\s*:?\s*(\d{1,2}/\d{1,2}/\d{4}|[A-Z][a-z]+\.? \d{1,2},? \d{4})", re.IGNORECASE)
+
+# Only amounts anchored to wording about the debt; the recording stamp's tax amounts come first otherwise
+AMOUNT_PATTERNS = (
+    re.compile(r"U\.?\s?S\.?\s*\$\s*([\d,]+(?:\.\d{2})?)"),
+    re.compile(r"(?:principal (?:sum|amount|balance)|amount of the lien|lien amount|amount due|total amount|sum of|in the amount of)[^$\n]{0,60}\$\s*([\d,]+(?:\.\d{2})?)", re.IGNORECASE),
+)
+PARCEL_PATTERN = re.compile(
+    r"(?:Parcel\s*(?:Identification|I\.?D\.?)?\s*(?:No\.?|Number|#)?|Folio\s*(?:No\.?|Number|#)?|Tax\s*(?:Parcel\s*)?I\.?D\.?(?:\s*No\.?)?|P\.?I\.?N\.?)"
+    r"\s*[:#]?\s*([A-Z0-9][A-Z0-9\-.]{5,}[A-Z0-9])",
+    re.IGNORECASE,
+)
+LOAN_PATTERN = re.compile(r"Loan\s*(?:#|No\.?|Number)\s*:?\s*([A-Z0-9][A-Z0-9\-]{3,})", re.IGNORECASE)
+
+# Defined-term parties ('"Borrower" is ...') as used by uniform mortgage instruments
+DEBTOR_TERMS = ('Borrower', 'Mortgagor', 'Owner', 'Debtor', 'Grantor')
+CREDITOR_TERMS = ('Lender', 'Mortgagee', 'Lienor', 'Claimant', 'Creditor', 'Grantee')
+PARTY_END = r"(?=\.\s|\.$|\n\s*\n|\s+currently residing|\s+whose address|\s+residing at|\s+with an address|,\s+a\s|,?\s+located at)"
+
+
+def _defined_term(terms):
+    names = '|'.join(terms)
+    return re.compile(rf"{QUOTE}(?:{names}){QUOTE}\s+(?:is|means)\s+(.+?){PARTY_END}", re.IGNORECASE | re.DOTALL)
+
+
+def _labelled(terms):
+    names = '|'.join(terms)
+    return re.compile(rf"^\s*(?:{names})s?(?:\(s\))?\s*:\s*(\S.{{1,150}})$", re.IGNORECASE | re.MULTILINE)
+
+
+DEBTOR_PATTERNS = (_defined_term(DEBTOR_TERMS), _labelled(DEBTOR_TERMS))
+CREDITOR_PATTERNS = (_defined_term(CREDITOR_TERMS), _labelled(CREDITOR_TERMS))
+
+
+def parse_amount(value):
+    """'526,200.00' or '$1,000' -> 526200.0; None when it doesn't parse."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.]", "", str(value))
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    """Normalizes the date formats found on recorded documents to YYYY-MM-DD; None when unknown."""
+    if not value:
+        return None
+    cleaned = re.sub(r"\s+", " ", str(value).strip()).replace('.', '')
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def clean_party(value):
+    """Collapses whitespace and strips trailing punctuation from a party name; None when empty."""
+    if not value:
+        return None
+    cleaned = re.sub(r"\s+", " ", str(value)).strip(" ,;:.\"'“”")
+    return cleaned or None
+
+
+def _first(patterns, text):
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _identifier(pattern, text):
+    # Identifiers always contain digits; this skips captions like "Parcel Number: SEE EXHIBIT A"
+    for match in pattern.finditer(text):
+        if any(c.isdigit() for c in match.group(1)):
+            return match.group(1).rstrip('.-')
+    return None
+
+
+def extract_rule_fields(text):
+    """
+    Pulls the RECORD_FIELDS that simple patterns can find out of a document's
+    OCR text. Returns {field: value or None}; amount is a float and
+    recording_date is YYYY-MM-DD, the rest are strings.
+    """
+    recording_date = _first((RECORDING_STAMP, RECORDED_ON), text)
+    return {
+        'debtor': clean_party(_first(DEBTOR_PATTERNS, text)),
+        'creditor': clean_party(_first(CREDITOR_PATTERNS, text)),
+        'amount': parse_amount(_first(AMOUNT_PATTERNS, text)),
+        'parcel_id': _identifier(PARCEL_PATTERN, text),
+        'loan_number': _identifier(LOAN_PATTERN, text),
+        'recording_date': parse_date(recording_date),
+    }
@@ -0,0 +1,323 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+# Set a user-agent header to mimic a real browser
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+# Responses that mean the portal no longer accepts our session cookies
+SESSION_EXPIRED_STATUSES = (401, 403, 419, 440)
+
+
+class SessionManager:
+    """
+    Shared requests.Session with keep-alive connection pools per host.
+
+    Cookies are copied from a Playwright context only when they actually change,
+    and the session is renewed when its cookies expire (if they can be re-read
+    from cookie_source), it outlives max_age, or the server answers with a
+    session-expired status.
+
+    cookie_source is an optional callable returning Playwright-style cookie dicts
+    (e.g. context.cookies). Sync Playwright objects are bound to the thread that
+    created them, so only bind it when requests are made from that thread;
+    otherwise push cookies explicitly with sync_cookies().
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, max_retries=3, max_age=1800, headers=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.max_age = max_age
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self.cookie_source = None
+        self._lock = threading.RLock()
+        self._cookies = []
+        self._cookie_fingerprint = None
+        self._cookies_expire_at = None
+        self._session = self._new_session()
+        self._created_at = time.monotonic()
+        # Requests still running per session, and replaced sessions waiting on them
+        self._in_flight = {}
+        self._retired = set()
+
+    def _new_session(self):
+        session = requests.Session()
+        retry = Retry(total=self.max_retries, backoff_factor=1, status_forcelist=(500, 502, 503, 504), allowed_methods=('GET', 'HEAD'))
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.headers)
+        return session
+
+    @property
+    def session(self):
+        return self._session
+
+    def bind_cookie_source(self, cookie_source):
+        with self._lock:
+            self.cookie_source = cookie_source
+        if cookie_source:
+            self.sync_cookies(cookie_source())
+
+    def sync_cookies(self, cookies):
+        """Copies Playwright cookies into the session. Returns False when nothing changed."""
+        fingerprint = tuple(sorted(
+            (cookie['name'], cookie['value'], cookie.get('domain', ''), cookie.get('path', '/')) for cookie in cookies
+        ))
+        with self._lock:
+            if fingerprint == self._cookie_fingerprint:
+                return False
+            self._apply_cookies(self._session, cookies)
+            self._cookies = list(cookies)
+            self._cookie_fingerprint = fingerprint
+            expiries = [cookie['expires'] for cookie in cookies if cookie.get('expires', -1) > 0]
+            self._cookies_expire_at = min(expiries) if expiries else None
+        logger.info('Session cookies synced.', extra={'context': {'step': 'sync_cookies', 'count': len(cookies)}})
+        return True
+
+    @staticmethod
+    def _apply_cookies(session, cookies):
+        # Build the new jar aside and swap it in, so a request prepared by another
+        # thread sees either the old cookies or the new ones, never an empty jar
+        jar = requests.cookies.RequestsCookieJar()
+        for cookie in cookies:
+            jar.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+        session.cookies = jar
+
+    def _expiry_reason(self):
+        if self.max_age and time.monotonic() - self._created_at > self.max_age:
+            return 'max_age'
+        if self._cookies_expire_at is not None and time.time() >= self._cookies_expire_at:
+            return 'cookies_expired'
+        return None
+
+    def is_expired(self):
+        return self._expiry_reason() is not None
+
+    def _drop_expired_cookies(self):
+        # Without a cookie_source there is nothing fresher to copy, and a new session
+        # would carry the same cookies, so only move the expiry trigger forward
+        now = time.time()
+        expiries = [cookie['expires'] for cookie in self._cookies if cookie.get('expires', -1) > now]
+        self._cookies_expire_at = min(expiries) if expiries else None
+        logger.warning('Session cookies expired and no cookie source is bound.', extra={'context': {'step': 'cookies_expired', 'next_expiry': self._cookies_expire_at}})
+
+    def renew(self, reason, stale_session=None):
+        """
+        Replaces the session (and its pools), re-reading cookies from cookie_source if bound.
+
+        Expiry renewals are re-checked under the lock and status renewals pass the
+        session that failed, so threads racing on the same trigger renew only once.
+        The replaced session is closed once its in-flight requests have finished.
+        """
+        with self._lock:
+            if stale_session is not None and stale_session is not self._session:
+                return
+            if reason in ('max_age', 'cookies_expired') and self._expiry_reason() is None:
+                return
+            if reason == 'cookies_expired' and not self.cookie_source:
+                self._drop_expired_cookies()
+                return
+
+            logger.info('Renewing HTTP session.', extra={'context': {'step': 'renew_session', 'reason': reason}})
+            old_session = self._session
+            self._session = self._new_session()
+            self._created_at = time.monotonic()
+            if self.cookie_source:
+                self._cookie_fingerprint = None
+                self.sync_cookies(self.cookie_source())
+            else:
+                self._apply_cookies(self._session, self._cookies)
+            self._retire(old_session)
+
+    def _retire(self, session):
+        if self._in_flight.get(session):
+            self._retired.add(session)
+        else:
+            session.close()
+
+    def _acquire(self):
+        with self._lock:
+            session = self._session
+            self._in_flight[session] = self._in_flight.get(session, 0) + 1
+            return session
+
+    def _release(self, session):
+        with self._lock:
+            remaining = self._in_flight[session] - 1
+            if remaining:
+                self._in_flight[session] = remaining
+                return
+            del self._in_flight[session]
+            if session in self._retired:
+                self._retired.discard(session)
+                session.close()
+
+    def _request(self, url, **kwargs):
+        session = self._acquire()
+        try:
+            response = session.get(url, **kwargs)
+        except BaseException:
+            self._release(session)
+            raise
+        if not kwargs.get('stream'):
+            # The body has been read, so the connection is already back in the pool
+            self._release(session)
+            return session, response
+
+        # A streamed body still holds its connection until the caller closes it
+        close = response.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release(session)
+
+        response.close = close_and_release
+        return session, response
+
+    def get(self, url, **kwargs):
+        reason = self._expiry_reason()
+        if reason:
+            self.renew(reason)
+        session, response = self._request(url, **kwargs)
+        if response.status_code in SESSION_EXPIRED_STATUSES:
+            response.close()
+            self.renew(f'status_{response.status_code}', stale_session=session)
+            session, response = self._request(url, **kwargs)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._session.close()
+            for session in self._retired:
+                session.close()
+            self._retired.clear()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_session_manager(name='default', **kwargs):
+    """Returns the process-wide SessionManager registered under name, creating it on first use."""
+    with _managers_lock:
+        if name not in _managers:
+            _managers[name] = SessionManager(**kwargs)
+        return _managers[name]
+
+
+def _content_range_total(content_range):
+    # "bytes 1000-4999/5000" -> (1000, 5000); total may be "*" when unknown
+    try:
+        unit_range, total = content_range.split('/')
+        start = int(unit_range.split()[-1].split('-')[0])
+        return start, (None if total == '*' else int(total))
+    except (AttributeError, ValueError, IndexError):
+        return None, None
+
+
+def stream_download(session_manager, url, dest_path, chunk_size=64 * 1024, timeout=(10, 120), max_attempts=5, expect_pdf=True):
+    """
+    Streams url to dest_path in bounded memory.
+
+    Bytes go to dest_path + '.part' and are renamed into place atomically once the
+    size matches Content-Length (or the Content-Range total). A .part file left by
+    an earlier attempt or a dropped connection is resumed with an HTTP Range
+    request. The timeout applies per read, so large files never hit a total cap.
+    Returns (dest_path, size_bytes, sha256_hex).
+    """
+    part_path = dest_path + '.part'
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+
+    for attempt in range(1, max_attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        response = None
+        try:
+            response = session_manager.get(url, stream=True, timeout=timeout, headers=headers)
+            if response.status_code == 416:
+                # Range no longer valid for this entity; start over
+                logger.warning('Range not satisfiable, restarting download.', extra={'context': {'url': url, 'offset': offset}})
+                os.remove(part_path)
+                continue
+            response.raise_for_status()
+
+            if offset and response.status_code == 206:
+                start, expected_size = _content_range_total(response.headers.get('Content-Range'))
+                if start != offset:
+                    logger.warning('Server resumed at unexpected offset, restarting download.', extra={'context': {'url': url, 'offset': offset, 'server_offset': start}})
+                    os.remove(part_path)
+                    continue
+                mode = 'ab'
+                logger.info('Resuming partial download.', extra={'context': {'url': url, 'offset': offset, 'expected_size': expected_size}})
+            else:
+                # Fresh download, or the server ignored the Range header
+                offset = 0
+                mode = 'wb'
+                content_length = response.headers.get('Content-Length')
+                expected_size = int(content_length) if content_length and content_length.isdigit() else None
+
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            logger.warning('Download interrupted, will resume.', extra={'context': {'url': url, 'attempt': attempt, 'error': str(e)}})
+            time.sleep(min(2 ** attempt, 30))
+            continue
+        finally:
+            if response is not None:
+                response.close()
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size < expected_size:
+            logger.warning('Download incomplete, will resume.', extra={'context': {'url': url, 'attempt': attempt, 'size': size, 'expected_size': expected_size}})
+            continue
+        if expected_size is not None and size > expected_size:
+            os.remove(part_path)
+            raise Exception(f"Downloaded {size} bytes but server announced {expected_size} for {url}")
+
+        sha256 = _verify_file(part_path, response.headers if mode == 'wb' else {}, expect_pdf)
+        os.replace(part_path, dest_path)
+        logger.info('Download verified and saved.', extra={'context': {'url': url, 'dest_path': dest_path, 'size': size, 'sha256': sha256, 'attempts': attempt}})
+        return dest_path, size, sha256
+
+    raise Exception(f"Download of {url} did not complete after {max_attempts} attempts")
+
+
+def _verify_file(path, headers, expect_pdf):
+    """Hashes the finished file, checking the PDF signature and any Content-MD5 the server sent."""
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        head = f.read(5)
+        f.seek(0)
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+            md5.update(block)
+
+    if expect_pdf and head != b'%PDF-':
+        os.remove(path)
+        raise Exception(f"Downloaded file is not a PDF (starts with {head!r})")
+    content_md5 = headers.get('Content-MD5')
+    if content_md5 and base64.b64encode(md5.digest()).decode('ascii') != content_md5:
+        os.remove(path)
+        raise Exception("Downloaded file does not match the server's Content-MD5")
+    return sha256.hexdigest()
@@ -0,0 +1,456 @@
+import atexit
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from firebase_utils.batch_writer import FirestoreBatchWriter, MAX_BATCH_SIZE
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join("data", "job_state.sqlite3"))
+# A claim older than this is considered abandoned (crashed worker) and can be re-claimed
+CLAIM_LEASE_SECONDS = int(os.getenv("JOB_CLAIM_LEASE_SECONDS", "900"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    county TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    status TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    claimed_by TEXT,
+    claimed_at REAL,
+    updated_at REAL NOT NULL,
+    mirrored INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (county, document_type, instrument)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (county, document_type, status, claimed_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_unmirrored ON jobs (mirrored, updated_at) WHERE mirrored = 0;
+CREATE TABLE IF NOT EXISTS job_imports (
+    county TEXT NOT NULL,
+    document_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    imported_at REAL NOT NULL,
+    PRIMARY KEY (county, document_type, status)
+);
+"""
+
+
+def _encode(value):
+    # Firestore fields may hold datetimes; keep them round-trippable through JSON
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Unsupported job field type: {type(value).__name__}")
+
+
+def _decode(obj):
+    if set(obj) == {'__datetime__'}:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def new_worker_id():
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def dumps(data):
+    return json.dumps(data, default=_encode)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_decode)
+
+
+class JobStore:
+    """
+    Embedded SQLite store of per-instrument pipeline state, keyed by
+    (county, document_type, instrument). Each row holds the same field dict the
+    Firestore document gets; `status` is mirrored into an indexed column so stages
+    can claim work at local-disk speed. Rows changed since their last Firestore
+    write are flagged mirrored=0 for FirestoreMirror to pick up.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        callback(county, document_type, instrument, data, status_changed) is invoked
+        after every write, outside the store lock, on the writing thread. Used to wake
+        the Firestore mirror and to hand finished jobs to the next pipeline stage.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, county, document_type, instrument, data, status_changed):
+        for callback in list(self._listeners):
+            callback(county, document_type, instrument, data, status_changed)
+
+    def update(self, county, document_type, instrument, fields):
+        """Merges fields into the job (like Firestore set(..., merge=True)). A status change releases any claim."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data, status FROM jobs WHERE county = ? AND document_type = ? AND instrument = ?",
+                    (county, document_type, instrument),
+                ).fetchone()
+                data = loads(row[0]) if row else {}
+                data.update(fields)
+                status = data.get('status')
+                status_changed = not row or row[1] != status
+                self._conn.execute(
+                    """
+                    INSERT INTO jobs (county, document_type, instrument, status, data, updated_at, mirrored)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                    ON CONFLICT (county, document_type, instrument) DO UPDATE SET
+                        status = excluded.status,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at,
+                        mirrored = 0,
+                        claimed_by = CASE WHEN ? THEN NULL ELSE claimed_by END,
+                        claimed_at = CASE WHEN ? THEN NULL ELSE claimed_at END
+                    """,
+                    (county, document_type, instrument, status, dumps(data), time.time(), status_changed, status_changed),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._notify(county, document_type, instrument, data, status_changed)
+
+    def get(self, county, document_type, instrument):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM jobs WHERE county = ? AND document_type = ? AND instrument = ?",
+                (county, document_type, instrument),
+            ).fetchone()
+        return loads(row[0]) if row else None
+
+    def claim_batch(self, county, document_type, status, limit=50, worker_id=None, lease_seconds=CLAIM_LEASE_SECONDS):
+        """
+        Atomically claims up to `limit` jobs in `status` that nobody holds (or whose
+        lease expired). Returns a list of (instrument, data). The claim is released
+        when the job's status changes or release() is called.
+        """
+        worker_id = worker_id or f"{os.getpid()}-{threading.get_ident()}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT instrument, data FROM jobs
+                    WHERE county = ? AND document_type = ? AND status = ?
+                      AND (claimed_at IS NULL OR claimed_at < ?)
+                    ORDER BY updated_at
+                    LIMIT ?
+                    """,
+                    (county, document_type, status, now - lease_seconds, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE jobs SET claimed_by = ?, claimed_at = ? WHERE county = ? AND document_type = ? AND instrument = ?",
+                    [(worker_id, now, county, document_type, instrument) for instrument, _ in rows],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(instrument, loads(data)) for instrument, data in rows]
+
+    def claim(self, county, document_type, instrument, status, worker_id=None, lease_seconds=CLAIM_LEASE_SECONDS):
+        """Claims one job if it is still in status and unclaimed. Returns its data, or None when someone else has it."""
+        worker_id = worker_id or f"{os.getpid()}-{threading.get_ident()}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT data FROM jobs
+                    WHERE county = ? AND document_type = ? AND instrument = ? AND status = ?
+                      AND (claimed_at IS NULL OR claimed_at < ?)
+                    """,
+                    (county, document_type, instrument, status, now - lease_seconds),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET claimed_by = ?, claimed_at = ? WHERE county = ? AND document_type = ? AND instrument = ?",
+                        (worker_id, now, county, document_type, instrument),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return loads(row[0]) if row else None
+
+    def claimable(self, county, document_type, status, lease_seconds=CLAIM_LEASE_SECONDS):
+        """Lists instruments in status that nobody holds, without claiming them."""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT instrument FROM jobs
+                WHERE county = ? AND document_type = ? AND status = ?
+                  AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY updated_at
+                """,
+                (county, document_type, status, time.time() - lease_seconds),
+            ).fetchall()
+        return [instrument for instrument, in rows]
+
+    def iter_claims(self, county, document_type, status, batch_size=50, worker_id=None):
+        """
+        Yields (instrument, data) for every claimable job in status, claiming
+        batch_size at a time. Each instrument is yielded at most once, even if its
+        lease runs out while it is still in status (e.g. it failed); such jobs are
+        claimed again so they stay held, but not handed out a second time.
+        """
+        worker_id = worker_id or new_worker_id()
+        yielded = set()
+        while True:
+            batch = self.claim_batch(county, document_type, status, limit=batch_size, worker_id=worker_id)
+            if not batch:
+                return
+            for instrument, data in batch:
+                if instrument not in yielded:
+                    yielded.add(instrument)
+                    yield instrument, data
+
+    def renew_claims(self, county, document_type, worker_id):
+        """Restarts the lease on every job worker_id still holds. Returns how many were renewed."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET claimed_at = ? WHERE county = ? AND document_type = ? AND claimed_by = ?",
+                (time.time(), county, document_type, worker_id),
+            )
+        return cursor.rowcount
+
+    @contextlib.contextmanager
+    def holding_claims(self, county, document_type, worker_id, interval=None):
+        """
+        Renews worker_id's claims every third of a lease while the block runs, so
+        documents that take longer than a lease aren't claimed by another worker.
+        """
+        interval = interval or CLAIM_LEASE_SECONDS / 3
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(interval):
+                try:
+                    self.renew_claims(county, document_type, worker_id)
+                except Exception as e:
+                    logger.error('Claim renewal failed.', extra={'context': {'worker_id': worker_id, 'error': str(e)}})
+
+        thread = threading.Thread(target=renew, name=f"claim-renewal-{worker_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, county, document_type, instrument):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET claimed_by = NULL, claimed_at = NULL WHERE county = ? AND document_type = ? AND instrument = ?",
+                (county, document_type, instrument),
+            )
+
+    def imported(self, county, document_type, status):
+        """True once import_records() has seeded the store with Firestore's records in status."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM job_imports WHERE county = ? AND document_type = ? AND status = ?", (county, document_type, status)
+            ).fetchone() is not None
+
+    def count_by_status(self, county, document_type):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE county = ? AND document_type = ? GROUP BY status",
+                (county, document_type),
+            ).fetchall()
+        return dict(rows)
+
+    def unmirrored(self, limit=500):
+        """Returns (county, document_type, instrument, data, updated_at) rows not yet written to Firestore."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT county, document_type, instrument, data, updated_at FROM jobs WHERE mirrored = 0 ORDER BY updated_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(county, document_type, instrument, loads(data), updated_at) for county, document_type, instrument, data, updated_at in rows]
+
+    def mark_mirrored(self, rows):
+        """Flags rows as mirrored unless they changed again after being read."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET mirrored = 1 WHERE county = ? AND document_type = ? AND instrument = ? AND updated_at = ?",
+                [(county, document_type, instrument, updated_at) for county, document_type, instrument, _, updated_at in rows],
+            )
+
+    def import_records(self, county, document_type, records, status):
+        """
+        Seeds the store from Firestore snapshots (records with .id and .to_dict())
+        queried for status, without re-mirroring them, and records that status as imported.
+        """
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    data = record.to_dict() or {}
+                    self._conn.execute(
+                        """
+                        INSERT INTO jobs (county, document_type, instrument, status, data, updated_at, mirrored)
+                        VALUES (?, ?, ?, ?, ?, ?, 1)
+                        ON CONFLICT (county, document_type, instrument) DO NOTHING
+                        """,
+                        (county, document_type, record.id, data.get('status'), dumps(data), time.time()),
+                    )
+                    count += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO job_imports (county, document_type, status, imported_at) VALUES (?, ?, ?, ?)",
+                    (county, document_type, status, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info('Imported Firestore records into job store.', extra={'context': {'county': county, 'document_type': document_type, 'status': status, 'count': count}})
+        return count
+
+
+class FirestoreMirror:
+    """
+    Background thread that copies changed jobs to Firestore
+    ({county_collection}/{county}/{document_type}/{instrument}, merged), so no
+    stage blocks on a Firestore round-trip. Rows go out as WriteBatch commits of
+    up to 500 documents: a pass runs once batch_size rows have changed, or every
+    interval seconds for whatever is pending. Firestore being slow or down only
+    delays the mirror; unmirrored rows are retried on the next pass.
+    """
+
+    def __init__(self, job_store, db, county_collection='County', interval=5.0, batch_size=MAX_BATCH_SIZE):
+        self.job_store = job_store
+        self.db = db
+        self.county_collection = county_collection
+        self.interval = interval
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        # Rows are only marked mirrored once their batch committed
+        self.writer = FirestoreBatchWriter(db)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        # Serialises passes so the thread, wake-ups and stop() never commit a row twice
+        self._flush_lock = threading.Lock()
+        self._changes_lock = threading.Lock()
+        self._changes = 0
+        self._thread = threading.Thread(target=self._run, name='firestore-mirror', daemon=True)
+        job_store.add_listener(self._on_change)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def _doc_ref(self, county, document_type, instrument):
+        return self.db.collection(self.county_collection) \
+            .document(county) \
+            .collection(document_type) \
+            .document(instrument)
+
+    def _on_change(self, *_):
+        with self._changes_lock:
+            self._changes += 1
+            full = self._changes >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def wake(self):
+        """Asks the mirror thread for a pass now instead of at the next interval."""
+        self._wake.set()
+
+    def flush(self):
+        """Writes every pending row to Firestore in batch commits. Returns the number of documents written."""
+        with self._flush_lock:
+            with self._changes_lock:
+                self._changes = 0
+            return self._flush()
+
+    def _flush(self):
+        written = 0
+        while True:
+            rows = self.job_store.unmirrored(limit=self.batch_size)
+            if not rows:
+                return written
+            writes = [(self._doc_ref(county, document_type, instrument), data, True) for county, document_type, instrument, data, _ in rows]
+            failed = self.writer.commit(writes)
+            mirrored = [row for i, row in enumerate(rows) if i not in failed]
+            self.job_store.mark_mirrored(mirrored)
+            written += len(mirrored)
+            if failed:
+                return written  # Firestore is failing; leave the rest for the next pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('Firestore mirror pass failed.', extra={'context': {'error': str(e)}})
+
+    def stop(self):
+        """Stops the thread and writes what is left. Safe to call again (e.g. from atexit)."""
+        self.job_store.remove_listener(self._on_change)
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        written = self.flush()
+        logger.info('Firestore mirror stopped.', extra={'context': {'final_flush': written}})
+
+
+_job_store = None
+_mirror = None
+_singleton_lock = threading.RLock()
+
+
+def get_job_store():
+    """Returns the process-wide JobStore at JOB_STORE_PATH."""
+    global _job_store
+    with _singleton_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
+
+
+def start_firestore_mirror(db, county_collection='County'):
+    """
+    Starts (once per process) the background mirror for the shared job store; it is
+    flushed at exit. A mirror stopped by an earlier main() is replaced by a new one.
+    """
+    global _mirror
+    with _singleton_lock:
+        if _mirror is None or _mirror.stopped:
+            _mirror = FirestoreMirror(get_job_store(), db, county_collection).start()
+            atexit.register(_mirror.stop)
+        return _mirror
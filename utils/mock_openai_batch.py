@@ -0,0 +1,135 @@
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+
+def default_responder(custom_id, body):
+    return f"[mock OCR output for {custom_id}]"
+
+
+class MockBatchClient:
+    """
+    Local stand-in for the OpenAI files and batches endpoints used by
+    vision_batch, so batch mode can be exercised without an API key or cost.
+    State lives under root, so submit and collect can run in separate processes.
+    A batch completes on its `polls_until_complete`-th retrieve(); every request
+    is answered with responder(custom_id, body), except custom_ids listed in
+    fail_ids, which come back in the error file.
+    """
+
+    def __init__(self, root, responder=default_responder, polls_until_complete=1, fail_ids=()):
+        self.root = root
+        self.responder = responder
+        self.polls_until_complete = polls_until_complete
+        self.fail_ids = set(fail_ids)
+        os.makedirs(os.path.join(root, 'files'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'batches'), exist_ok=True)
+        self.files = _MockFiles(self)
+        self.batches = _MockBatches(self)
+
+    def _file_path(self, file_id):
+        return os.path.join(self.root, 'files', file_id)
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.root, 'batches', f"{batch_id}.json")
+
+    def _store_file(self, data):
+        file_id = f"file-mock-{uuid.uuid4().hex[:12]}"
+        with open(self._file_path(file_id), 'wb') as f:
+            f.write(data)
+        return file_id
+
+
+class _MockFiles:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, file, purpose):
+        data = file.read() if hasattr(file, 'read') else file[1]
+        return SimpleNamespace(id=self._client._store_file(data), purpose=purpose, bytes=len(data))
+
+    def content(self, file_id):
+        with open(self._client._file_path(file_id), 'rb') as f:
+            data = f.read()
+        return SimpleNamespace(content=data, text=data.decode('utf-8'), read=lambda: data)
+
+
+class _MockBatches:
+    def __init__(self, client):
+        self._client = client
+
+    def _save(self, batch):
+        with open(self._client._batch_path(batch['id']), 'w', encoding='utf-8') as f:
+            json.dump(batch, f)
+
+    def _load(self, batch_id):
+        with open(self._client._batch_path(batch_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _view(batch):
+        return SimpleNamespace(**{**batch, 'request_counts': SimpleNamespace(**batch['request_counts'])})
+
+    def create(self, input_file_id, endpoint, completion_window, metadata=None):
+        batch = {
+            'id': f"batch_mock_{uuid.uuid4().hex[:12]}",
+            'status': 'validating',
+            'endpoint': endpoint,
+            'completion_window': completion_window,
+            'input_file_id': input_file_id,
+            'output_file_id': None,
+            'error_file_id': None,
+            'metadata': metadata or {},
+            'created_at': int(time.time()),
+            'polls': 0,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+        }
+        self._save(batch)
+        return self._view(batch)
+
+    def retrieve(self, batch_id):
+        batch = self._load(batch_id)
+        if batch['status'] in ('validating', 'in_progress'):
+            batch['polls'] += 1
+            batch['status'] = 'in_progress'
+            if batch['polls'] >= self._client.polls_until_complete:
+                self._complete(batch)
+            self._save(batch)
+        return self._view(batch)
+
+    def _complete(self, batch):
+        outputs, errors = [], []
+        input_text = self._client.files.content(batch['input_file_id']).text
+        for line in input_text.splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request['custom_id']
+            if custom_id in self._client.fail_ids:
+                errors.append({'id': f"batch_req_{uuid.uuid4().hex[:8]}", 'custom_id': custom_id, 'response': None,
+                               'error': {'code': 'mock_failure', 'message': 'Request failed in mock batch.'}})
+                continue
+            text = self._client.responder(custom_id, request['body'])
+            outputs.append({
+                'id': f"batch_req_{uuid.uuid4().hex[:8]}",
+                'custom_id': custom_id,
+                'response': {
+                    'status_code': 200,
+                    'request_id': uuid.uuid4().hex,
+                    'body': {
+                        'object': 'chat.completion',
+                        'model': request['body'].get('model'),
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': 0, 'completion_tokens': len(text) // 4, 'total_tokens': len(text) // 4},
+                    },
+                },
+                'error': None,
+            })
+        if outputs:
+            batch['output_file_id'] = self._client._store_file('\n'.join(json.dumps(o) for o in outputs).encode('utf-8'))
+        if errors:
+            batch['error_file_id'] = self._client._store_file('\n'.join(json.dumps(e) for e in errors).encode('utf-8'))
+        batch['status'] = 'completed'
+        batch['request_counts'] = {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)}
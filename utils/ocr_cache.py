@@ -0,0 +1,131 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", os.path.join("data", "ocr_cache.sqlite3"))
+# Entries older than this many days are dropped; 0 keeps them forever
+OCR_CACHE_MAX_AGE_DAYS = float(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "0"))
+# Least recently used entries are dropped once the stored text exceeds this many MB; 0 means no limit
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_created_at ON ocr_cache (created_at);
+"""
+
+
+def cache_key(image, model, prompt, dpi):
+    """Content address of an OCR call: the exact image payload plus everything that changes the answer."""
+    if isinstance(image, str):
+        image = image.encode('ascii')
+    digest = hashlib.sha256()
+    for part in (model.encode('utf-8'), str(dpi).encode('ascii'), hashlib.sha256(prompt.encode('utf-8')).digest(), hashlib.sha256(image).digest()):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class OcrCache:
+    """
+    Persistent SQLite map from cache_key() to the text the model returned.
+    Identical pages, whether from a re-run or the same document filed under
+    another instrument, are answered locally instead of being sent again.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, max_age_days=OCR_CACHE_MAX_AGE_DAYS, max_mb=OCR_CACHE_MAX_MB):
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT text, created_at FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row and self.max_age_seconds and row[1] < now - self.max_age_seconds:
+                self._conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, model, text):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO ocr_cache (key, model, text, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET text = excluded.text, size = excluded.size, last_used = excluded.last_used
+                """,
+                (key, model, text, len(text.encode('utf-8')), now, now),
+            )
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self.evict()
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones until the cache fits max_mb. Returns the number removed."""
+        removed = 0
+        with self._lock:
+            self._writes_since_evict = 0
+            if self.max_age_seconds:
+                removed += self._conn.execute("DELETE FROM ocr_cache WHERE created_at < ?", (time.time() - self.max_age_seconds,)).rowcount
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    keys = []
+                    for key, size in self._conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used"):
+                        keys.append((key,))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", keys)
+                    removed += len(keys)
+        if removed:
+            logger.info('Evicted OCR cache entries.', extra={'context': {'removed': removed}})
+        return removed
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size_bytes': size}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Returns the process-wide OcrCache at OCR_CACHE_PATH."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OcrCache()
+            _cache.evict()
+        return _cache
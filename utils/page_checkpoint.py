@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def page_text_path(output_dir, instrument_id, page_num):
+    return os.path.join(output_dir, f"{instrument_id}_page_{page_num}.txt")
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PageCheckpoint:
+    """
+    Tracks which pages of an instrument already have extracted text, in
+    {instrument_id}.checkpoint.json next to the page files. A page counts as done
+    only while its page file still matches the hash recorded for it, and the whole
+    checkpoint is discarded when the PDF itself changes (different SHA-256).
+    """
+
+    def __init__(self, output_dir, instrument_id, pdf_path):
+        self.output_dir = output_dir
+        self.instrument_id = instrument_id
+        self.path = os.path.join(output_dir, f"{instrument_id}.checkpoint.json")
+        self.pdf_sha256 = _sha256_file(pdf_path)
+        self.pages = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+            if saved.get('pdf_sha256') == self.pdf_sha256:
+                self.pages = saved.get('pages', {})
+
+    def completed_pages(self):
+        """Returns {page_num: text} for every checkpointed page whose file is intact."""
+        completed = {}
+        for page_num, entry in self.pages.items():
+            path = page_text_path(self.output_dir, self.instrument_id, page_num)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            if _sha256_text(text) == entry.get('sha256'):
+                completed[int(page_num)] = text
+        return completed
+
+    def mark_done(self, page_num, text, source):
+        """Records a page whose file has just been written; saved right away so a crash keeps it."""
+        with self._lock:
+            self.pages[str(page_num)] = {'sha256': _sha256_text(text), 'source': source, 'chars': len(text)}
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pdf_sha256': self.pdf_sha256, 'pages': self.pages}, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,151 @@
+import atexit
+import base64
+import io
+import math
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import fitz  # PyMuPDF library
+from PIL import Image
+
+# Rendering processes; defaults to one per core. 1 renders in the calling thread.
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", "0")) or os.cpu_count() or 1
+
+# Vision payload profiles. 'lossless' is the original color PNG at the requested DPI;
+# 'optimized' sends what the model actually looks at, in far fewer bytes.
+IMAGE_PROFILES = {
+    'lossless': {'format': 'png', 'quality': None, 'grayscale': False, 'threshold': 0, 'fit_tiles': False},
+    'optimized': {'format': 'jpeg', 'quality': 80, 'grayscale': True, 'threshold': 200, 'fit_tiles': True},
+}
+MIME_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# OpenAI high-detail image handling: fit within 2048x2048, then scale the short side
+# down to 768, then bill 85 tokens plus 170 per 512px tile
+MAX_IMAGE_SIDE = 2048
+SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_IMAGE_TOKENS = 85
+TILE_TOKENS = 170
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def image_settings():
+    """Payload settings from VISION_IMAGE_PROFILE, with per-field VISION_IMAGE_* overrides."""
+    profile = os.getenv("VISION_IMAGE_PROFILE", "lossless")
+    settings = dict(IMAGE_PROFILES.get(profile, IMAGE_PROFILES['lossless']))
+    if os.getenv("VISION_IMAGE_FORMAT"):
+        settings['format'] = os.getenv("VISION_IMAGE_FORMAT").lower()
+    if os.getenv("VISION_IMAGE_QUALITY"):
+        settings['quality'] = int(os.getenv("VISION_IMAGE_QUALITY"))
+    if os.getenv("VISION_IMAGE_GRAYSCALE"):
+        settings['grayscale'] = os.getenv("VISION_IMAGE_GRAYSCALE") == "True"
+    if os.getenv("VISION_IMAGE_THRESHOLD"):
+        settings['threshold'] = int(os.getenv("VISION_IMAGE_THRESHOLD"))
+    if os.getenv("VISION_IMAGE_FIT_TILES"):
+        settings['fit_tiles'] = os.getenv("VISION_IMAGE_FIT_TILES") == "True"
+    if settings['format'] not in MIME_TYPES:
+        raise ValueError(f"Unsupported VISION_IMAGE_FORMAT: {settings['format']}")
+    return settings
+
+
+def model_image_size(width, height):
+    """The size a high-detail image is resized to on the model side."""
+    scale = min(1.0, MAX_IMAGE_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def image_tokens(width, height):
+    """Input tokens a high-detail image of this size is billed as."""
+    width, height = model_image_size(width, height)
+    return BASE_IMAGE_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def _render_page(page, dpi, settings):
+    zoom = dpi / 72.0
+    if settings['fit_tiles']:
+        # Render straight at the size the model will downscale to; more pixels only cost bytes
+        width, height = page.rect.width * zoom, page.rect.height * zoom
+        target_width, _ = model_image_size(width, height)
+        zoom *= target_width / width
+    colorspace = fitz.csGRAY if settings['grayscale'] or settings['threshold'] else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+    if settings['format'] == 'png' and not settings['threshold']:
+        return pix.tobytes("png"), pix.width, pix.height
+
+    image = Image.frombytes('L' if pix.n == 1 else 'RGB', (pix.width, pix.height), pix.samples)
+    if settings['threshold']:
+        # Faint watermarks are light gray: push everything lighter than the threshold to
+        # white while keeping the darker anti-aliased text edges the model reads from
+        threshold = settings['threshold']
+        image = image.point([255 if value >= threshold else value for value in range(256)])
+    buffer = io.BytesIO()
+    if settings['format'] == 'jpeg':
+        image.save(buffer, format='JPEG', quality=settings['quality'] or 80, optimize=True)
+    elif settings['format'] == 'webp':
+        image.save(buffer, format='WEBP', quality=settings['quality'] or 80, method=4)
+    else:
+        image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue(), image.width, image.height
+
+
+def render_pages(pdf_path, page_nums, dpi, image_paths, settings=None):
+    """
+    Renders the 0-based page_nums of pdf_path and encodes each page once. The
+    same bytes are written to image_paths[i] (when not None) and returned
+    base64-encoded, in page_nums order, as dicts with 'image', 'mime',
+    'width', 'height', 'payload_bytes' and 'image_tokens'. Runs inside pool
+    workers, so it only takes picklable arguments and opens its own document.
+    """
+    settings = settings or IMAGE_PROFILES['lossless']
+    results = []
+    with fitz.open(pdf_path) as doc:
+        for page_num, image_path in zip(page_nums, image_paths):
+            data, width, height = _render_page(doc.load_page(page_num), dpi, settings)
+            if image_path:
+                with open(image_path, 'wb') as f:
+                    f.write(data)
+            results.append({
+                'image': base64.b64encode(data).decode('ascii'),
+                'mime': MIME_TYPES[settings['format']],
+                'width': width,
+                'height': height,
+                'payload_bytes': len(data),
+                'image_tokens': image_tokens(width, height),
+            })
+    return results
+
+
+def get_raster_pool():
+    """Returns the process-wide rendering pool, created on first use and shut down at exit."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RASTER_WORKERS)
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def _render_one(pdf_path, page_num, dpi, image_path, settings):
+    return render_pages(pdf_path, [page_num], dpi, [image_path], settings)[0]
+
+
+def render_page_async(pdf_path, page_num, dpi, image_path=None, settings=None):
+    """
+    Queues one 0-based page on the process pool and returns a Future of its
+    render_pages() dict. With RASTER_WORKERS=1 the page is rendered right here
+    and the Future comes back already resolved.
+    """
+    if RASTER_WORKERS <= 1:
+        future = Future()
+        try:
+            future.set_result(_render_one(pdf_path, page_num, dpi, image_path, settings))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return get_raster_pool().submit(_render_one, pdf_path, page_num, dpi, image_path, settings)
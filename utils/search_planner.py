@@ -0,0 +1,155 @@
+import csv
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from playwright.sync_api import sync_playwright
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+MANIFEST_FILENAME = "shards_manifest.json"
+
+
+def format_date(value, zero_pad=True):
+    if zero_pad:
+        return value.strftime('%m/%d/%Y')
+    return f"{value.month}/{value.day}/{value.year}"
+
+
+def shard_key(start_date, end_date):
+    return f"{start_date.replace('/', '_')}__{end_date.replace('/', '_')}"
+
+
+def plan_shards(start_date, end_date, shard_days=7, zero_pad=True):
+    """
+    Splits an inclusive MM/DD/YYYY date range into consecutive shards of at most
+    shard_days days (1 = daily, 7 = weekly). Returns a list of (start, end) strings
+    in the same date style the portal expects.
+    """
+    start = datetime.strptime(start_date, '%m/%d/%Y')
+    end = datetime.strptime(end_date, '%m/%d/%Y')
+    if end < start:
+        raise ValueError(f"END_DATE {end_date} is before START_DATE {start_date}")
+    shard_days = max(1, int(shard_days))
+
+    shards = []
+    shard_start = start
+    while shard_start <= end:
+        shard_end = min(shard_start + timedelta(days=shard_days - 1), end)
+        shards.append((format_date(shard_start, zero_pad), format_date(shard_end, zero_pad)))
+        shard_start = shard_end + timedelta(days=1)
+    logger.info('Planned search shards.', extra={'context': {'start_date': start_date, 'end_date': end_date, 'shard_days': shard_days, 'shards': len(shards)}})
+    return shards
+
+
+class ShardManifest:
+    """Records finished shards (and their exported CSV) in a JSON file so re-runs can skip them."""
+
+    def __init__(self, job_dir):
+        self.path = os.path.join(job_dir, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self.completed = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.completed = json.load(f)
+
+    def is_done(self, key):
+        csv_path = self.completed.get(key)
+        return bool(csv_path) and os.path.exists(csv_path)
+
+    def mark_done(self, key, csv_path):
+        with self._lock:
+            self.completed[key] = csv_path
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.completed, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def run_shards(shards, search_shard, job_dir, workers=2, headless=False):
+    """
+    Runs search_shard(context, start_date, end_date, shard_dir) -> csv_path for every
+    shard not already in the manifest, spread over `workers` threads. Each worker
+    thread owns its own Playwright browser (sync Playwright objects can't cross
+    threads) and gives every shard a fresh browser context.
+    Returns the CSV paths of all completed shards, in shard order.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    manifest = ShardManifest(job_dir)
+    pending = queue.Queue()
+    for start_date, end_date in shards:
+        key = shard_key(start_date, end_date)
+        if manifest.is_done(key):
+            logger.info('Skipping completed shard.', extra={'context': {'shard': key}})
+            continue
+        pending.put((start_date, end_date))
+
+    def worker(worker_id):
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=headless)
+            try:
+                while True:
+                    try:
+                        start_date, end_date = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    key = shard_key(start_date, end_date)
+                    shard_dir = os.path.join(job_dir, 'shards', key)
+                    os.makedirs(shard_dir, exist_ok=True)
+                    context = browser.new_context(accept_downloads=True)
+                    try:
+                        logger.info('Running search shard.', extra={'context': {'worker_id': worker_id, 'shard': key}})
+                        csv_path = search_shard(context, start_date, end_date, shard_dir)
+                        if csv_path:
+                            manifest.mark_done(key, csv_path)
+                            logger.info('Search shard completed.', extra={'context': {'worker_id': worker_id, 'shard': key, 'csv_path': csv_path}})
+                        else:
+                            logger.error('Search shard produced no export.', extra={'context': {'worker_id': worker_id, 'shard': key}})
+                    except Exception as e:
+                        logger.error('Search shard failed.', extra={'context': {'worker_id': worker_id, 'shard': key, 'error': str(e)}})
+                    finally:
+                        context.close()
+            finally:
+                browser.close()
+
+    threads = [threading.Thread(target=worker, args=(worker_id,), name=f"search-shard-{worker_id}") for worker_id in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    missing = [shard_key(*shard) for shard in shards if not manifest.is_done(shard_key(*shard))]
+    if missing:
+        logger.warning('Some shards did not complete; re-run to retry them.', extra={'context': {'missing_shards': missing}})
+    return [manifest.completed[shard_key(*shard)] for shard in shards if manifest.is_done(shard_key(*shard))]
+
+
+def merge_csvs(csv_paths, output_path, key_column):
+    """Concatenates shard exports into output_path, keeping the first row seen for each key_column value."""
+    seen = set()
+    fieldnames = []
+    rows = []
+    for csv_path in csv_paths:
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            for name in reader.fieldnames or []:
+                if name not in fieldnames:
+                    fieldnames.append(name)
+            for row in reader:
+                key = (row.get(key_column) or '').strip()
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                rows.append(row)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    logger.info('Merged shard exports.', extra={'context': {'output_path': output_path, 'shards': len(csv_paths), 'instruments': len(rows)}})
+    return output_path
@@ -0,0 +1,68 @@
+import os
+import re
+
+# A page's own text layer is used instead of vision OCR when it passes these checks
+NATIVE_TEXT_ENABLED = os.getenv("NATIVE_TEXT_ENABLED", "True") == "True"
+# Minimum characters on a mostly-vector page
+NATIVE_TEXT_MIN_CHARS = int(os.getenv("NATIVE_TEXT_MIN_CHARS", "200"))
+# Minimum characters when images cover most of the page; scanned pages often only
+# carry a short recorder's stamp as text, which must not pass for the whole page
+NATIVE_TEXT_MIN_CHARS_SCANNED = int(os.getenv("NATIVE_TEXT_MIN_CHARS_SCANNED", "1200"))
+SCANNED_IMAGE_COVERAGE = 0.5
+# Share of characters that must be letters, digits, whitespace or common punctuation
+MIN_PRINTABLE_RATIO = 0.9
+# Share of tokens that must look like words (broken font encodings produce symbol soup)
+MIN_WORD_RATIO = 0.5
+
+WORD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z'\-]*[A-Za-z]$|^[A-Za-z]$|^\d[\d,./\-]*$")
+COMMON_PUNCTUATION = set(".,;:!?'\"()[]{}-_/\\&%$#@*+=<>|~`§°")
+
+
+def text_quality(text):
+    """Returns metrics describing whether extracted text reads like real text."""
+    stripped = text.strip()
+    chars = len(stripped)
+    if not chars:
+        return {'chars': 0, 'printable_ratio': 0.0, 'word_ratio': 0.0, 'replacement_chars': 0}
+    printable = sum(1 for c in stripped if c.isalnum() or c.isspace() or c in COMMON_PUNCTUATION)
+    replacement = stripped.count('\ufffd') + sum(1 for c in stripped if '\ue000' <= c <= '\uf8ff')
+    tokens = [token.strip(".,;:!?()[]\"") for token in stripped.split()]
+    tokens = [token for token in tokens if token]
+    words = sum(1 for token in tokens if WORD_PATTERN.match(token))
+    return {
+        'chars': chars,
+        'printable_ratio': round(printable / chars, 3),
+        'word_ratio': round(words / len(tokens), 3) if tokens else 0.0,
+        'replacement_chars': replacement,
+    }
+
+
+def image_coverage(page):
+    """Fraction of the page area covered by placed images (capped at 1)."""
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = page.rect & info['bbox']
+        if not bbox.is_empty:
+            covered += abs(bbox)
+    return min(1.0, covered / page_area)
+
+
+def classify_page(page):
+    """
+    Decides whether a PyMuPDF page's text layer can stand in for OCR.
+    Returns (text or None, metrics); text is None when the page needs vision.
+    """
+    text = page.get_text("text", sort=True)
+    metrics = text_quality(text)
+    metrics['image_coverage'] = round(image_coverage(page), 3)
+    min_chars = NATIVE_TEXT_MIN_CHARS_SCANNED if metrics['image_coverage'] >= SCANNED_IMAGE_COVERAGE else NATIVE_TEXT_MIN_CHARS
+    usable = (
+        NATIVE_TEXT_ENABLED
+        and metrics['chars'] >= min_chars
+        and metrics['printable_ratio'] >= MIN_PRINTABLE_RATIO
+        and metrics['word_ratio'] >= MIN_WORD_RATIO
+        and metrics['replacement_chars'] <= metrics['chars'] * 0.01
+    )
+    metrics['native'] = usable
+    return (text.strip() if usable else None), metrics
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+VECTOR_MANIFEST_PATH = os.getenv("VECTOR_MANIFEST_PATH", os.path.join("data", "vector_manifest.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vector_manifest (
+    namespace TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (namespace, document_id, vector_id)
+);
+CREATE TABLE IF NOT EXISTS vector_manifest_documents (
+    namespace TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    PRIMARY KEY (namespace, document_id)
+);
+"""
+
+
+def vector_id(document_id, page_num, chunk_index):
+    """Deterministic vector ID; re-uploading a chunk overwrites its vector instead of adding another."""
+    return f"{document_id}#{page_num}#{chunk_index}"
+
+
+def vector_prefix(document_id):
+    return f"{document_id}#"
+
+
+def content_hash(text, metadata):
+    """Changes whenever anything stored with the vector changes, text or metadata."""
+    payload = json.dumps({'text': text, 'metadata': metadata}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class VectorManifest:
+    """
+    Local record of which vectors each document has in the index and what they
+    were built from, so a re-upload only sends new or changed chunks and knows
+    which vectors no longer exist in the document.
+    """
+
+    def __init__(self, path=VECTOR_MANIFEST_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def known(self, namespace, document_id):
+        """True once the document has been recorded, even if it had no vectors."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM vector_manifest_documents WHERE namespace = ? AND document_id = ?", (namespace, document_id)
+            ).fetchone() is not None
+
+    def hashes(self, namespace, document_id):
+        """Returns {vector_id: content_hash} as last recorded for the document."""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT vector_id, content_hash FROM vector_manifest WHERE namespace = ? AND document_id = ?", (namespace, document_id)
+            ).fetchall())
+
+    def replace(self, namespace, document_id, hashes):
+        """Records {vector_id: content_hash} as the document's complete set of vectors."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM vector_manifest WHERE namespace = ? AND document_id = ?", (namespace, document_id))
+                self._conn.executemany(
+                    "INSERT INTO vector_manifest (namespace, document_id, vector_id, content_hash) VALUES (?, ?, ?, ?)",
+                    [(namespace, document_id, vid, digest) for vid, digest in hashes.items()],
+                )
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO vector_manifest_documents (namespace, document_id) VALUES (?, ?)", (namespace, document_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_vector_manifest():
+    """Returns the process-wide VectorManifest at VECTOR_MANIFEST_PATH."""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = VectorManifest()
+        return _manifest
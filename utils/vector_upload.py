@@ -0,0 +1,169 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+
+class _Document:
+    """Tracks one document's vectors through embedding and upsert; its future resolves to the vector count."""
+
+    def __init__(self, key, count):
+        self.key = key
+        self.count = count
+        self.remaining = count
+        self.future = Future()
+        self._lock = threading.Lock()
+        if not count:
+            self.future.set_result(0)
+
+    def done(self, count):
+        with self._lock:
+            if self.future.done():
+                return
+            self.remaining -= count
+            if self.remaining <= 0:
+                self.future.set_result(self.count)
+
+    def fail(self, error):
+        with self._lock:
+            if not self.future.done():
+                self.future.set_exception(error)
+
+
+class VectorUploader:
+    """
+    Embeds and upserts chunks from many documents together. Chunks queue up until
+    batch_tokens (or batch_texts) is reached, or the oldest has waited
+    max_wait_seconds, and are then embedded in one call; the vectors go to the
+    index in upsert_batch_size batches on upsert_workers threads. add() is
+    thread-safe and returns a Future per document, resolved once all of its
+    vectors are stored (or failed with the first error that hit any of them).
+    """
+
+    def __init__(self, index, embed, namespace, count_tokens, batch_tokens=100000, batch_texts=1000,
+                 upsert_batch_size=100, upsert_workers=4, max_wait_seconds=2.0):
+        self.index = index
+        self.embed = embed
+        self.namespace = namespace
+        self.count_tokens = count_tokens
+        self.batch_tokens = batch_tokens
+        self.batch_texts = batch_texts
+        self.upsert_batch_size = upsert_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = []  # (vector_id, text, metadata, tokens, _Document)
+        self._pending_tokens = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._upserts = ThreadPoolExecutor(max_workers=upsert_workers, thread_name_prefix='vector-upsert')
+        self._stats_lock = threading.Lock()
+        self.stats = {'documents': 0, 'chunks': 0, 'tokens': 0, 'embed_calls': 0, 'embed_seconds': 0.0,
+                      'upsert_calls': 0, 'upsert_seconds': 0.0, 'failed_documents': 0}
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_when_idle, name='vector-flusher', daemon=True)
+        self._flusher.start()
+
+    def add(self, key, items):
+        """
+        Queues (vector_id, text, metadata) items for document `key`; a fourth element,
+        when present, is the text's token count. Returns the document's Future.
+        """
+        document = _Document(key, len(items))
+        batches = []
+        with self._stats_lock:
+            self.stats['documents'] += 1
+        with self._lock:
+            for item in items:
+                vector_id, text, metadata = item[:3]
+                tokens = item[3] if len(item) > 3 else self.count_tokens(text)
+                self._pending.append((vector_id, text, metadata, tokens, document))
+                self._pending_tokens += tokens
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+                if self._pending_tokens >= self.batch_tokens or len(self._pending) >= self.batch_texts:
+                    batches.append(self._take())
+        # Embed outside the lock so other documents can keep queueing meanwhile
+        for batch in batches:
+            self._process(batch)
+        return document.future
+
+    def flush(self):
+        """Embeds and queues the upserts for everything pending, however small."""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._process(batch)
+
+    def close(self):
+        """Flushes, waits for every upsert and returns the stats."""
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+        self._upserts.shutdown(wait=True)
+        logger.info('Vector upload summary.', extra={'context': {'namespace': self.namespace, **self.stats}})
+        return dict(self.stats)
+
+    def _take(self):
+        batch = self._pending
+        self._pending = []
+        self._pending_tokens = 0
+        self._oldest = None
+        return batch
+
+    def _flush_when_idle(self):
+        # Documents arriving one by one (e.g. the streaming pipeline) still get
+        # uploaded promptly when no batch fills up behind them
+        while not self._closed.wait(min(0.5, self.max_wait_seconds)):
+            with self._lock:
+                stale = self._oldest is not None and time.monotonic() - self._oldest >= self.max_wait_seconds
+                batch = self._take() if stale else None
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        texts = [text for _, text, _, _, _ in batch]
+        started = time.monotonic()
+        try:
+            vectors = self.embed(texts)
+        except Exception as e:
+            logger.error('Embedding batch failed.', extra={'context': {'chunks': len(batch), 'error': str(e)}})
+            self._fail(batch, e)
+            return
+        with self._stats_lock:
+            self.stats['embed_calls'] += 1
+            self.stats['embed_seconds'] += time.monotonic() - started
+            self.stats['chunks'] += len(batch)
+            self.stats['tokens'] += sum(tokens for _, _, _, tokens, _ in batch)
+        records = [
+            ({'id': vector_id, 'values': values, 'metadata': metadata}, document)
+            for (vector_id, _, metadata, _, document), values in zip(batch, vectors)
+        ]
+        for start in range(0, len(records), self.upsert_batch_size):
+            self._upserts.submit(self._upsert, records[start:start + self.upsert_batch_size])
+
+    def _upsert(self, records):
+        started = time.monotonic()
+        try:
+            self.index.upsert(vectors=[record for record, _ in records], namespace=self.namespace)
+        except Exception as e:
+            logger.error('Upsert batch failed.', extra={'context': {'vectors': len(records), 'error': str(e)}})
+            self._fail(records, e)
+            return
+        with self._stats_lock:
+            self.stats['upsert_calls'] += 1
+            self.stats['upsert_seconds'] += time.monotonic() - started
+        counts = {}
+        for record in records:
+            document = record[-1]
+            counts[document] = counts.get(document, 0) + 1
+        for document, count in counts.items():
+            document.done(count)
+
+    def _fail(self, items, error):
+        documents = {item[-1] for item in items}
+        with self._stats_lock:
+            self.stats['failed_documents'] += sum(1 for document in documents if not document.future.done())
+        for document in documents:
+            document.fail(error)
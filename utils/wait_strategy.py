@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from playwright.sync_api import TimeoutError
+
+from utils.logging_utils import setup_logger
+
+logger = setup_logger()
+
+# Default per-step timeouts (ms). Override any step with WAIT_TIMEOUT_<STEP>, e.g. WAIT_TIMEOUT_SEARCH_RESULTS=60000
+DEFAULT_TIMEOUT_MS = 30000
+STEP_TIMEOUTS_MS = {
+    'accept_terms': 5000,
+    'search_form': 30000,
+    'search_results': 60000,
+    'grid_filter': 30000,
+    'grid_page': 30000,
+    'document_page': 30000,
+    'document_iframe': 15000,
+    'pdf_viewer': 20000,
+    'export_download': 60000,
+    'network_idle': 15000,
+}
+
+# step -> {'count', 'timeouts', 'total_ms', 'max_ms'}; shard threads record into it concurrently
+_wait_stats = defaultdict(lambda: {'count': 0, 'timeouts': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+_wait_stats_lock = threading.Lock()
+
+
+def step_timeout(step, timeout=None):
+    if timeout is not None:
+        return timeout
+    override = os.getenv(f"WAIT_TIMEOUT_{step.upper()}")
+    if override:
+        return int(override)
+    return STEP_TIMEOUTS_MS.get(step, DEFAULT_TIMEOUT_MS)
+
+
+@contextmanager
+def timed_wait(step, timeout):
+    """Records how long the wrapped wait actually took and whether it timed out."""
+    started = time.monotonic()
+    outcome = 'ok'
+    try:
+        yield
+    except TimeoutError:
+        outcome = 'timeout'
+        raise
+    finally:
+        waited_ms = (time.monotonic() - started) * 1000
+        with _wait_stats_lock:
+            stats = _wait_stats[step]
+            stats['count'] += 1
+            stats['timeouts'] += outcome == 'timeout'
+            stats['total_ms'] += waited_ms
+            stats['max_ms'] = max(stats['max_ms'], waited_ms)
+        logger.info('Wait finished.', extra={'context': {'step': step, 'outcome': outcome, 'waited_ms': round(waited_ms), 'timeout_ms': timeout}})
+
+
+def wait_for_selector(page, selector, step, state='visible', timeout=None, required=True):
+    """Waits for selector to reach state. Returns the element handle, or None on timeout when not required."""
+    timeout = step_timeout(step, timeout)
+    try:
+        with timed_wait(step, timeout):
+            return page.wait_for_selector(selector, state=state, timeout=timeout)
+    except TimeoutError:
+        if required:
+            raise
+        return None
+
+
+def wait_for_locator(locator, step, state='visible', timeout=None, required=True):
+    """Locator variant of wait_for_selector (works inside frame_locator chains). Returns True when reached."""
+    timeout = step_timeout(step, timeout)
+    try:
+        with timed_wait(step, timeout):
+            locator.wait_for(state=state, timeout=timeout)
+        return True
+    except TimeoutError:
+        if required:
+            raise
+        return False
+
+
+def wait_for_function(page, expression, step, arg=None, timeout=None, required=True):
+    """Waits until the JS expression is truthy in the page. Returns True when it was."""
+    timeout = step_timeout(step, timeout)
+    try:
+        with timed_wait(step, timeout):
+            page.wait_for_function(expression, arg=arg, timeout=timeout)
+        return True
+    except TimeoutError:
+        if required:
+            raise
+        return False
+
+
+def wait_for_load(page, step, state='load', timeout=None, required=True):
+    """Waits for a load state: 'load', 'domcontentloaded' or 'networkidle'."""
+    timeout = step_timeout(step, timeout)
+    try:
+        with timed_wait(step, timeout):
+            page.wait_for_load_state(state, timeout=timeout)
+        return True
+    except TimeoutError:
+        if required:
+            raise
+        return False
+
+
+def wait_for_network_idle(page, step='network_idle', timeout=None):
+    """Best-effort wait for in-flight requests to settle; a busy page is not an error."""
+    return wait_for_load(page, step, state='networkidle', timeout=timeout, required=False)
+
+
+def wait_for_overlay(page, selector, step, appear_timeout=2000, timeout=None):
+    """
+    Waits out a loading overlay: gives it appear_timeout ms to show up, then waits
+    until it is hidden. Replaces "sleep, then wait for hidden" patterns.
+    """
+    wait_for_selector(page, selector, f"{step}_overlay_shown", state='visible', timeout=appear_timeout, required=False)
+    return wait_for_selector(page, selector, step, state='hidden', timeout=timeout)
+
+
+def expect_download(page, action, step='export_download', timeout=None):
+    """Runs action and returns the Download it triggers."""
+    timeout = step_timeout(step, timeout)
+    with timed_wait(step, timeout):
+        with page.expect_download(timeout=timeout) as download_info:
+            action()
+        return download_info.value
+
+
+def expect_page(context, action, step='document_page', timeout=None, required=True):
+    """Runs action and returns the new page it opens, or None on timeout when not required."""
+    timeout = step_timeout(step, timeout)
+    try:
+        with timed_wait(step, timeout):
+            with context.expect_page(timeout=timeout) as page_info:
+                action()
+            return page_info.value
+    except TimeoutError:
+        if required:
+            raise
+        return None
+
+
+def wait_summary():
+    """Returns per-step wait statistics collected so far in this process."""
+    with _wait_stats_lock:
+        return {
+            step: {**stats, 'total_ms': round(stats['total_ms']), 'max_ms': round(stats['max_ms']),
+                   'avg_ms': round(stats['total_ms'] / stats['count']) if stats['count'] else 0}
+            for step, stats in _wait_stats.items()
+        }
+
+
+def log_wait_summary():
+    summary = wait_summary()
+    logger.info('Wait summary.', extra={'context': {'step': 'wait_summary', 'waits': summary}})
+    return summary
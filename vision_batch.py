@@ -0,0 +1,306 @@
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+
+from openai import OpenAI
+
+from vision_extractor import (
+    COUNTY_COLLECTION, COUNTY_NAMESPACE, DOCUMENT_TYPE, EXTRACTED_TEXT_DIRECTORY, MAX_PAGES_TO_PROCESS,
+    OPENAI_API_KEY, OPENAI_VISION_MODEL, VISION_MAX_TOKENS,
+    get_vision_prompt, page_cache_key, iter_page_inputs, pdf_path_for, seed_job_store, write_combined_text, write_page_text,
+)
+from field_extractor import FIELD_EXTRACTION_ENABLED, extract_record
+from firebase_utils.firebase_config import init_firebase
+from utils.job_store import get_job_store, new_worker_id, start_firestore_mirror
+from utils.logging_utils import setup_logger
+from utils.mock_openai_batch import MockBatchClient
+from utils.ocr_cache import get_ocr_cache
+from utils.page_checkpoint import PageCheckpoint
+
+logger = setup_logger()
+
+# Offline bulk OCR through the OpenAI Batch API (half price, results within 24h)
+VISION_BATCH_DIR = os.getenv("VISION_BATCH_DIR", os.path.join("data", "vision_batches", str(COUNTY_NAMESPACE), str(DOCUMENT_TYPE)))
+# Batch API limits: 50,000 requests and 200 MB per input file
+VISION_BATCH_MAX_REQUESTS = int(os.getenv("VISION_BATCH_MAX_REQUESTS", "50000"))
+VISION_BATCH_MAX_BYTES = int(os.getenv("VISION_BATCH_MAX_MB", "190")) * 1024 * 1024
+VISION_BATCH_POLL_SECONDS = int(os.getenv("VISION_BATCH_POLL_SECONDS", "60"))
+# Use the local mock endpoint instead of OpenAI (no key or cost needed)
+VISION_BATCH_MOCK = os.getenv("VISION_BATCH_MOCK", "False") == "True"
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+SUBMITTED_STATUS = "vision_batch_submitted"
+TERMINAL_BATCH_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def get_batch_client():
+    if VISION_BATCH_MOCK:
+        return MockBatchClient(os.path.join(VISION_BATCH_DIR, 'mock_api'))
+    # Unlike the online path, let the SDK retry uploads and polls itself
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+
+def custom_id_for(instrument_id, page_num):
+    return f"{instrument_id}|{page_num}"
+
+
+def batch_request_line(custom_id, prompt, page):
+    body = {
+        "model": OPENAI_VISION_MODEL,
+        "max_tokens": VISION_MAX_TOKENS,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{page['mime']};base64,{page['image']}"}}
+                ],
+            }
+        ],
+    }
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n"
+
+
+def manifest_paths():
+    return sorted(glob.glob(os.path.join(VISION_BATCH_DIR, "*.manifest.json")))
+
+
+def load_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchFileWriter:
+    """
+    Accumulates request lines for one Batch API input file. Documents are never
+    split across files, so each batch can be applied (and its documents finished)
+    on its own.
+    """
+
+    def __init__(self, client, jobs):
+        self.client = client
+        self.jobs = jobs
+        self._reset()
+
+    def _reset(self):
+        self.name = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.input_path = os.path.join(VISION_BATCH_DIR, f"{self.name}.jsonl")
+        self._file = None
+        self.size = 0
+        self.requests = {}
+        self.documents = {}
+
+    def add_document(self, instrument_id, page_nums, lines, requests):
+        """lines/requests hold this document's pages still needing OCR; page_nums are all of its pages."""
+        doc_size = sum(len(line.encode('utf-8')) for line in lines)
+        if self.requests and (self.size + doc_size > VISION_BATCH_MAX_BYTES or len(self.requests) + len(requests) > VISION_BATCH_MAX_REQUESTS):
+            self.submit()
+        if doc_size > VISION_BATCH_MAX_BYTES:
+            logger.warning('Document alone exceeds the batch file size limit.', extra={'context': {'instrument_id': instrument_id, 'bytes': doc_size}})
+        if self._file is None:
+            os.makedirs(VISION_BATCH_DIR, exist_ok=True)
+            self._file = open(self.input_path, 'w', encoding='utf-8')
+        # Lines go straight to disk; only the small request index stays in memory
+        self._file.writelines(lines)
+        self.size += doc_size
+        self.requests.update(requests)
+        self.documents[instrument_id] = page_nums
+
+    def submit(self):
+        """Uploads the pending file, creates the batch and records its manifest. Returns the batch id, or None if empty."""
+        if not self.requests:
+            return None
+        self._file.close()
+        with open(self.input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata={'county': str(COUNTY_NAMESPACE), 'document_type': str(DOCUMENT_TYPE), 'name': self.name},
+        )
+        manifest = {
+            'name': self.name,
+            'batch_id': batch.id,
+            'input_file_id': input_file.id,
+            'input_path': self.input_path,
+            'status': 'submitted',
+            'submitted_at': time.time(),
+            'requests': self.requests,
+            'documents': self.documents,
+        }
+        save_manifest(os.path.join(VISION_BATCH_DIR, f"{self.name}.manifest.json"), manifest)
+        for instrument_id in self.documents:
+            self.jobs.update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {'status': SUBMITTED_STATUS, 'vision_batch_id': batch.id})
+        logger.info('Submitted vision batch.', extra={'context': {'batch_id': batch.id, 'requests': len(self.requests), 'documents': len(self.documents), 'bytes': self.size}})
+        print(f"📦 Submitted batch {batch.id} with {len(self.requests)} pages from {len(self.documents)} documents")
+        # The uploaded copy is what counts; the local file is only needed until then
+        os.remove(self.input_path)
+        self._reset()
+        return batch.id
+
+
+def finish_document(jobs, instrument_id, page_nums):
+    """Assembles {instrument}.txt and marks the job extracted if every page is checkpointed. Returns True when done."""
+    output_dir = os.path.join(EXTRACTED_TEXT_DIRECTORY, instrument_id)
+    completed = PageCheckpoint(output_dir, instrument_id, pdf_path_for(instrument_id)).completed_pages()
+    if any(page_num not in completed for page_num in page_nums):
+        return False
+    write_combined_text(output_dir, instrument_id, [(page_num, completed[page_num]) for page_num in page_nums])
+    if FIELD_EXTRACTION_ENABLED:
+        extract_record(output_dir, instrument_id, '\n'.join(completed[page_num] for page_num in page_nums))
+    jobs.update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {'status': 'vision_extracted'})
+    print(f"✅ Successfully extracted vision summary for {instrument_id}")
+    return True
+
+
+def submit_pending(client, jobs):
+    """
+    Packs every page of every 'pdf_downloaded' job that still needs OCR into batch
+    input files and submits them. Native-text and cached pages are written right
+    away; documents with nothing left to OCR are finished without a batch.
+    """
+    prompt = get_vision_prompt()
+    cache = get_ocr_cache()
+    writer = BatchFileWriter(client, jobs)
+    failed = []
+    # Documents stay claimed until their batch file is submitted, however long rendering takes
+    worker_id = new_worker_id()
+    with jobs.holding_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, worker_id):
+        for instrument_id, _ in jobs.iter_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, 'pdf_downloaded', worker_id=worker_id):
+            pdf_path = pdf_path_for(instrument_id)
+            if not os.path.exists(pdf_path):
+                logger.error('PDF file not found.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path}})
+                failed.append(instrument_id)
+                continue
+            output_dir = os.path.join(EXTRACTED_TEXT_DIRECTORY, instrument_id)
+            os.makedirs(output_dir, exist_ok=True)
+            # Checkpointed pages (from an earlier online or batch run) are not sent again
+            checkpoint = PageCheckpoint(output_dir, instrument_id, pdf_path)
+            lines, requests, page_nums = [], {}, []
+            try:
+                for page in iter_page_inputs(pdf_path, MAX_PAGES_TO_PROCESS, completed=checkpoint.completed_pages()):
+                    page_nums.append(page['page_num'])
+                    if 'checkpoint_text' in page:
+                        continue
+                    if 'native_text' in page:
+                        write_page_text(output_dir, instrument_id, page['page_num'], page['native_text'], checkpoint, 'native')
+                        continue
+                    key = page_cache_key(prompt, page)
+                    cached_text = cache.get(key)
+                    if cached_text is not None:
+                        write_page_text(output_dir, instrument_id, page['page_num'], cached_text, checkpoint)
+                        continue
+                    # Only the request line is kept; the page dict and its image are dropped here
+                    custom_id = custom_id_for(instrument_id, page['page_num'])
+                    lines.append(batch_request_line(custom_id, prompt, page))
+                    requests[custom_id] = {'instrument_id': instrument_id, 'page_num': page['page_num'], 'cache_key': key}
+            except Exception as e:
+                logger.error('Error preparing pages for batch.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path, 'error': str(e)}})
+                page_nums = []
+            if not page_nums:
+                logger.error('No pages prepared for batch.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path}})
+                failed.append(instrument_id)
+                continue
+            if not lines:
+                finish_document(jobs, instrument_id, page_nums)
+                continue
+            writer.add_document(instrument_id, page_nums, lines, requests)
+        writer.submit()
+    for instrument_id in failed:
+        jobs.release(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id)
+
+
+def _read_jsonl(client, file_id):
+    if not file_id:
+        return []
+    text = client.files.content(file_id).text
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def apply_results(client, jobs, manifest, batch):
+    """Writes every successful page, then finishes complete documents and returns the rest to 'pdf_downloaded'."""
+    cache = get_ocr_cache()
+    checkpoints = {}
+    written = 0
+    for result in _read_jsonl(client, batch.output_file_id):
+        request = manifest['requests'].get(result.get('custom_id'))
+        response = result.get('response') or {}
+        if request is None or response.get('status_code') != 200:
+            continue
+        text = response['body']['choices'][0]['message']['content']
+        instrument_id = request['instrument_id']
+        output_dir = os.path.join(EXTRACTED_TEXT_DIRECTORY, instrument_id)
+        os.makedirs(output_dir, exist_ok=True)
+        if instrument_id not in checkpoints:
+            checkpoints[instrument_id] = PageCheckpoint(output_dir, instrument_id, pdf_path_for(instrument_id))
+        write_page_text(output_dir, instrument_id, request['page_num'], text, checkpoints[instrument_id])
+        cache.put(request['cache_key'], OPENAI_VISION_MODEL, text)
+        written += 1
+    errors = _read_jsonl(client, batch.error_file_id)
+    for error in errors:
+        logger.error('Batch request failed.', extra={'context': {'batch_id': batch.id, 'custom_id': error.get('custom_id'), 'error': error.get('error')}})
+
+    finished, retry = 0, 0
+    for instrument_id, page_nums in manifest['documents'].items():
+        if finish_document(jobs, instrument_id, page_nums):
+            finished += 1
+        else:
+            # Missing pages go back to the online path (or the next batch)
+            jobs.update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {'status': 'pdf_downloaded'})
+            retry += 1
+    logger.info('Applied vision batch results.', extra={'context': {'batch_id': batch.id, 'batch_status': batch.status, 'pages_written': written, 'failed_requests': len(errors), 'documents_finished': finished, 'documents_returned': retry}})
+    print(f"📥 Batch {batch.id}: {written} pages written, {finished} documents finished, {retry} returned for retry")
+
+
+def collect(client, jobs):
+    """Polls every submitted batch once and applies the ones that reached a terminal state. Returns how many are still running."""
+    running = 0
+    for path in manifest_paths():
+        manifest = load_manifest(path)
+        if manifest['status'] != 'submitted':
+            continue
+        batch = client.batches.retrieve(manifest['batch_id'])
+        if batch.status not in TERMINAL_BATCH_STATUSES:
+            running += 1
+            logger.info('Vision batch still running.', extra={'context': {'batch_id': batch.id, 'batch_status': batch.status}})
+            continue
+        # Failed or expired batches can still carry partial output
+        apply_results(client, jobs, manifest, batch)
+        manifest['status'] = 'applied'
+        manifest['batch_status'] = batch.status
+        manifest['applied_at'] = time.time()
+        save_manifest(path, manifest)
+    return running
+
+
+def main(command='run'):
+    """submit: queue pending pages; collect: apply finished batches once; run: submit, then poll until all are applied."""
+    logger.info('Starting vision batch mode.', extra={'context': {'step': 'vision_batch', 'command': command, 'mock': VISION_BATCH_MOCK}})
+    db = init_firebase()
+    jobs = get_job_store()
+    mirror = start_firestore_mirror(db, COUNTY_COLLECTION)
+    client = get_batch_client()
+    if command in ('submit', 'run'):
+        seed_job_store(db, jobs, 'pdf_downloaded')
+        submit_pending(client, jobs)
+    if command in ('collect', 'run'):
+        while collect(client, jobs) and command == 'run':
+            mirror.wake()
+            time.sleep(VISION_BATCH_POLL_SECONDS)
+    mirror.stop()
+    logger.info('Vision batch mode finished.', extra={'context': {'step': 'vision_batch_end', 'statuses': jobs.count_by_status(COUNTY_NAMESPACE, DOCUMENT_TYPE)}})
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'run')
@@ -1,14 +1,26 @@
 import os
-import base64
+import re
 import json
 import fitz  # PyMuPDF library
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, InternalServerError
 from firebase_admin import firestore
 import importlib
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from firebase_utils.firebase_config import init_firebase
 from utils.logging_utils import setup_logger  # Add this import for logging
+from utils.job_store import get_job_store, new_worker_id, start_firestore_mirror
+from utils.api_scheduler import ApiScheduler
+from utils.ocr_cache import cache_key, get_ocr_cache
+from utils.text_layer import classify_page
+from utils.rasterizer import RASTER_WORKERS, image_settings, render_page_async
+from utils.page_checkpoint import PageCheckpoint, page_text_path
+from field_extractor import FIELD_EXTRACTION_ENABLED, extract_record
 from google.api_core.retry import Retry
 
 logger = setup_logger()  # Initialize logger early
@@ -50,55 +62,122 @@ else:
 
 MAX_PAGES_TO_PROCESS = None #2 # Process first 2 pages to balance cost and detail
 IMAGE_DPI = 200 # Set resolution for the output image, 200 is good for OCR
+# Pages rendered ahead of the OCR calls, and OCR calls outstanding per document;
+# together they bound how many page images a document holds in memory
+RASTER_PREFETCH = int(os.getenv("RASTER_PREFETCH", "0")) or RASTER_WORKERS * 2
+VISION_PAGES_IN_FLIGHT = int(os.getenv("VISION_PAGES_IN_FLIGHT", "8"))
+# Keep a copy of every rendered page under IMAGE_DIRECTORY (debugging/audit only; OCR doesn't need it)
+SAVE_PAGE_IMAGES = os.getenv("SAVE_PAGE_IMAGES", "True") == "True"
+VISION_MAX_TOKENS = 2048
+# Pages sent together in one request (1 = one page per request). Packing sends the long
+# prompt once per K pages; responses are split on per-page markers
+VISION_PAGES_PER_REQUEST = max(1, int(os.getenv("VISION_PAGES_PER_REQUEST", "1")))
+# Output cap for a packed request (VISION_MAX_TOKENS per page, up to the model's limit)
+VISION_PACKED_MAX_TOKENS = int(os.getenv("VISION_PACKED_MAX_TOKENS", "16384"))
+
+# Page OCR requests from all documents share one scheduler; set the budgets to your account's limits
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "16"))
+VISION_REQUESTS_PER_MINUTE = int(os.getenv("VISION_REQUESTS_PER_MINUTE", "500"))
+VISION_TOKENS_PER_MINUTE = int(os.getenv("VISION_TOKENS_PER_MINUTE", "200000"))
+# 'online' sends pages as they are ready; 'batch' queues them through the Batch API (see vision_batch.py)
+VISION_MODE = os.getenv("VISION_MODE", "online")
+# Documents main() works on at once; their pages interleave in the scheduler
+VISION_DOCUMENT_WORKERS = int(os.getenv("VISION_DOCUMENT_WORKERS", "4"))
+# Payload encoding (VISION_IMAGE_PROFILE=lossless|optimized plus VISION_IMAGE_* overrides)
+IMAGE_SETTINGS = image_settings()
 
 # --- End Configuration ---
 
-# Initialize OpenAI Client
-logger.info('Initializing OpenAI Client.', extra={'context': {'step': 'openai_init'}})
-if not OPENAI_API_KEY:
-    logger.error('OPENAI_API_KEY not found in .env file.', extra={'context': {'error': 'missing_api_key'}})
-    raise ValueError("❌ Error: OPENAI_API_KEY not found in the .env file.")
-client = OpenAI(api_key=OPENAI_API_KEY)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the shared OpenAI client, created on first use so that importing this
+    module (e.g. for vision_batch's mock mode) doesn't require an API key.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            logger.info('Initializing OpenAI Client.', extra={'context': {'step': 'openai_init'}})
+            if not OPENAI_API_KEY:
+                logger.error('OPENAI_API_KEY not found in .env file.', extra={'context': {'error': 'missing_api_key'}})
+                raise ValueError("❌ Error: OPENAI_API_KEY not found in the .env file.")
+            # Retries are left to the scheduler so it can see 429s and adapt concurrency
+            _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return _client
+
 
+scheduler = ApiScheduler(
+    'vision',
+    max_concurrency=VISION_MAX_CONCURRENCY,
+    requests_per_minute=VISION_REQUESTS_PER_MINUTE,
+    tokens_per_minute=VISION_TOKENS_PER_MINUTE,
+    retryable=(APIConnectionError, InternalServerError),
+)
 
-def pdf_to_base64_images(pdf_path: str, max_pages: int) -> list:
-    logger.info('Starting PDF to base64 images conversion.', extra={'context': {'pdf_path': pdf_path, 'max_pages': max_pages}})
-    base64_images = []
+
+def iter_page_inputs(pdf_path: str, max_pages: int, completed: dict = None):
+    """
+    Yields each page prepared for extraction, in order. Pages already in `completed`
+    ({page_num: text}, from the checkpoint) come as {'page_num', 'checkpoint_text'};
+    pages whose own text layer is good enough come as {'page_num', 'native_text'};
+    neither is rendered. The rest are rendered on the rasterizer's process pool and
+    come with the encoded 'image' (base64), its 'mime' type and payload metrics.
+
+    Rendering runs at most RASTER_PREFETCH pages ahead of the consumer, so memory
+    stays flat however long the document is and page 1 is available as soon as it
+    is rendered.
+    """
+    completed = completed or {}
+    logger.info('Preparing PDF pages.', extra={'context': {'pdf_path': pdf_path, 'max_pages': max_pages}})
     instrument_id = os.path.splitext(os.path.basename(pdf_path))[0]
     image_output_dir = os.path.join(IMAGE_DIRECTORY, instrument_id)
-    os.makedirs(image_output_dir, exist_ok=True)  # Create instrument-specific directory for images
-    logger.info('Created output directory for images.', extra={'context': {'image_output_dir': image_output_dir}})
-    try:
-        with fitz.open(pdf_path) as doc:
-            logger.info('PDF opened successfully.', extra={'context': {'pdf_path': pdf_path, 'total_pages': len(doc)}})
-            num_pages_to_process = len(doc) if max_pages is None else min(len(doc), max_pages)
-            logger.info('Determined pages to process.', extra={'context': {'num_pages': num_pages_to_process}})
-            for page_num in range(num_pages_to_process):
-                page = doc.load_page(page_num)
-                
-                # Render page to a pixmap (an image representation) at a specific DPI
-                pix = page.get_pixmap(dpi=IMAGE_DPI)
-
-                # Save the image to a file
-                image_path = os.path.join(image_output_dir, f"{instrument_id}_page_{page_num + 1}.png")
-                pix.save(image_path)
-                logger.info('Saved image to file.', extra={'context': {'image_path': image_path}})
-                print(f"🖼️  Saved page {page_num + 1} to {image_path}")
-                
-                # Get image bytes (PNG is a good lossless format for this)
-                img_bytes = pix.tobytes("png")
-                
-                # Encode bytes to base64
-                base64_image = base64.b64encode(img_bytes).decode('utf-8')
-                base64_images.append(base64_image)
-                
-            logger.info('PDF conversion completed.', extra={'context': {'num_images': len(base64_images)}})
-            print(f"📄 Converted {len(base64_images)} pages from PDF to images using PyMuPDF.")
-    except Exception as e:
-        logger.error('Error converting PDF to images.', extra={'context': {'pdf_path': pdf_path, 'error': str(e)}})
-        print(f"❌ Error converting PDF to images with PyMuPDF: {e}")
-        return []
-    return base64_images
+    extension = 'jpg' if IMAGE_SETTINGS['format'] == 'jpeg' else IMAGE_SETTINGS['format']
+    counts = {'checkpointed_pages': 0, 'native_pages': 0, 'vision_pages': 0}
+    pending = deque()  # (page, render future or None), oldest first
+
+    def resolve(page, future):
+        if future is not None:
+            # Each page is encoded once; the same bytes were saved to disk (when
+            # SAVE_PAGE_IMAGES is on) and are what goes to the model
+            page.update(future.result())
+        return page
+
+    with fitz.open(pdf_path) as doc:
+        logger.info('PDF opened successfully.', extra={'context': {'pdf_path': pdf_path, 'total_pages': len(doc)}})
+        num_pages_to_process = len(doc) if max_pages is None else min(len(doc), max_pages)
+        logger.info('Determined pages to process.', extra={'context': {'num_pages': num_pages_to_process}})
+        for page_num in range(num_pages_to_process):
+            page = {'page_num': page_num + 1}
+            future = None
+            if page_num + 1 in completed:
+                page['checkpoint_text'] = completed[page_num + 1]
+                counts['checkpointed_pages'] += 1
+            else:
+                # Born-digital pages already carry their text; skip rendering and the API call
+                native_text, metrics = classify_page(doc.load_page(page_num))
+                logger.info('Classified page text layer.', extra={'context': {'instrument_id': instrument_id, 'page_num': page_num + 1, **metrics}})
+                if native_text is not None:
+                    page['native_text'] = native_text
+                    counts['native_pages'] += 1
+                else:
+                    image_path = None
+                    if SAVE_PAGE_IMAGES:
+                        os.makedirs(image_output_dir, exist_ok=True)  # Create instrument-specific directory for images
+                        image_path = os.path.join(image_output_dir, f"{instrument_id}_page_{page_num + 1}.{extension}")
+                    future = render_page_async(pdf_path, page_num, IMAGE_DPI, image_path, IMAGE_SETTINGS)
+                    counts['vision_pages'] += 1
+            pending.append((page, future))
+            # Hand pages over in order as soon as nothing before them is still rendering
+            while pending and (pending[0][1] is None or len(pending) > RASTER_PREFETCH):
+                yield resolve(*pending.popleft())
+        while pending:
+            yield resolve(*pending.popleft())
+
+    logger.info('PDF conversion completed.', extra={'context': {'instrument_id': instrument_id, 'num_pages': num_pages_to_process, **counts}})
+    print(f"📄 Prepared {num_pages_to_process} pages ({counts['checkpointed_pages']} already done, {counts['native_pages']} from the text layer, {counts['vision_pages']} rendered for vision).")
 
 
 def get_vision_prompt():
@@ -122,115 +201,422 @@ def get_vision_prompt():
     """
 
 
+def estimate_page_tokens(prompt, image_tokens):
+    """Tokens a page request counts against the TPM limit: prompt text (~4 chars/token), image and max_tokens."""
+    return len(prompt) // 4 + image_tokens + VISION_MAX_TOKENS
+
+
+# Running totals of what was sent, to compare payload profiles and packing
+payload_stats = {'requests': 0, 'pages': 0, 'payload_bytes': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0,
+                 'packed_requests': 0, 'packed_fallbacks': 0}
+payload_stats_lock = threading.Lock()
+
+
+def _record_payload(pages, response, elapsed):
+    usage = response.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+    with payload_stats_lock:
+        payload_stats['requests'] += 1
+        payload_stats['pages'] += len(pages)
+        payload_stats['payload_bytes'] += sum(page['payload_bytes'] for page in pages)
+        payload_stats['prompt_tokens'] += prompt_tokens
+        payload_stats['completion_tokens'] += completion_tokens
+        payload_stats['seconds'] += elapsed
+    logger.info('Page OCR completed.', extra={'context': {
+        'page_nums': [page['page_num'] for page in pages], 'mime': pages[0]['mime'],
+        'sizes': [(page['width'], page['height']) for page in pages],
+        'payload_bytes': sum(page['payload_bytes'] for page in pages),
+        'estimated_image_tokens': sum(page['image_tokens'] for page in pages),
+        'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'seconds': round(elapsed, 2),
+    }})
+
+
+def ocr_page(prompt, page):
+    """Sends a single rendered page to the vision model and returns the extracted text."""
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:{page['mime']};base64,{page['image']}"}}
+            ],
+        }
+    ]
+    started = time.monotonic()
+    response = get_client().chat.completions.create(
+        model=OPENAI_VISION_MODEL,
+        messages=messages,
+        max_tokens=VISION_MAX_TOKENS,
+    )
+    _record_payload([page], response, time.monotonic() - started)
+    return response.choices[0].message.content
+
+
+def ocr_page_cached(cache, key, prompt, page):
+    """ocr_page(), storing the answer as soon as it arrives so a later failure in the document doesn't waste it."""
+    response_text = ocr_page(prompt, page)
+    cache.put(key, OPENAI_VISION_MODEL, response_text)
+    return response_text
+
+
+PAGE_MARKER = "=== PAGE {} ==="
+PAGE_MARKER_PATTERN = re.compile(r"^[ \t]*=== PAGE (\d+) ===[ \t]*$", re.MULTILINE)
+
+
+def get_packed_prompt(prompt, page_nums):
+    """The single-page prompt plus instructions for transcribing several labelled images in one answer."""
+    markers = ', '.join(PAGE_MARKER.format(page_num) for page_num in page_nums)
+    return prompt + f"""
+    **Multiple Pages:** You are given {len(page_nums)} page images, each preceded by its label. Apply the instructions above to every page, in the order given.
+    Start each page's transcription with its marker on a line of its own, exactly: {markers}. Output nothing before the first marker and never merge pages.
+    """
+
+
+def split_packed_response(text, page_nums):
+    """Splits a packed answer on its page markers; None unless every page appears exactly once, in order."""
+    matches = list(PAGE_MARKER_PATTERN.finditer(text or ''))
+    if [int(match.group(1)) for match in matches] != list(page_nums) or (text[:matches[0].start()].strip() if matches else True):
+        return None
+    bounds = [match.end() for match in matches]
+    ends = [match.start() for match in matches[1:]] + [len(text)]
+    return [text[start:end].strip() for start, end in zip(bounds, ends)]
+
+
+def ocr_pages_packed(prompt, pages):
+    """
+    Sends several rendered pages in one request and returns their texts in order,
+    or None when the answer can't be split cleanly (missing, repeated or reordered
+    markers, or cut off at the token limit). submit_page_group() then queues each
+    page as its own scheduler request.
+    """
+    page_nums = [page['page_num'] for page in pages]
+    content = [{"type": "text", "text": get_packed_prompt(prompt, page_nums)}]
+    for page in pages:
+        content.append({"type": "text", "text": f"Page {page['page_num']}:"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:{page['mime']};base64,{page['image']}"}})
+    started = time.monotonic()
+    response = get_client().chat.completions.create(
+        model=OPENAI_VISION_MODEL,
+        messages=[{"role": "user", "content": content}],
+        max_tokens=min(VISION_MAX_TOKENS * len(pages), VISION_PACKED_MAX_TOKENS),
+    )
+    _record_payload(pages, response, time.monotonic() - started)
+    choice = response.choices[0]
+    texts = split_packed_response(choice.message.content, page_nums) if choice.finish_reason != 'length' else None
+    with payload_stats_lock:
+        payload_stats['packed_requests'] += 1
+        if texts is None:
+            payload_stats['packed_fallbacks'] += 1
+    if texts is None:
+        logger.warning('Packed response could not be split; sending pages one at a time.', extra={'context': {'page_nums': page_nums, 'finish_reason': choice.finish_reason}})
+    return texts
+
+
+def ocr_pages_packed_cached(cache, keys, prompt, pages):
+    """ocr_pages_packed(), caching each page under its single-page key so later runs hit it either way."""
+    texts = ocr_pages_packed(prompt, pages)
+    for key, text in zip(keys, texts or []):
+        cache.put(key, OPENAI_VISION_MODEL, text)
+    return texts
+
+
+def _fan_out(cache, prompt, group, page_futures, request):
+    """
+    Done-callback of a packed request: resolves each page's own future from the
+    request's result, or resubmits the pages one per request when it couldn't be split.
+    """
+    if request.cancelled():
+        for page_future in page_futures:
+            page_future.cancel()
+        return
+    error = request.exception()
+    texts = request.result() if error is None else None
+    for index, page_future in enumerate(page_futures):
+        if error is None and texts is None:
+            if not page_future.cancelled():
+                _resubmit_page(cache, prompt, group[index], page_future)
+            continue
+        if not page_future.set_running_or_notify_cancel():
+            continue  # Cancelled after the request started; its text is still cached
+        if error is not None:
+            page_future.set_exception(error)
+        else:
+            page_future.set_result(texts[index])
+
+
+def _resubmit_page(cache, prompt, item, page_future):
+    """Queues one page of an unsplittable packed answer on the scheduler, resolving page_future from it."""
+    retry, _ = submit_page_group(cache, prompt, [item])
+    # Cancelling the page (e.g. because the document failed) drops the retry if it hasn't started
+    page_future.add_done_callback(lambda future: retry.cancel() if future.cancelled() else None)
+    retry.add_done_callback(partial(_copy_outcome, page_future))
+
+
+def _copy_outcome(page_future, retry):
+    if retry.cancelled():
+        page_future.cancel()
+        return
+    if not page_future.set_running_or_notify_cancel():
+        return
+    if retry.exception() is not None:
+        page_future.set_exception(retry.exception())
+    else:
+        page_future.set_result(retry.result())
+
+
+def submit_page_group(cache, prompt, group):
+    """
+    Queues (cache key, page) pairs on the scheduler, as one packed request when
+    there are several. Returns (request future, [one future per page]).
+    """
+    if len(group) == 1:
+        key, page = group[0]
+        future = scheduler.submit(ocr_page_cached, cache, key, prompt, page, estimated_tokens=estimate_page_tokens(prompt, page['image_tokens']))
+        return future, [future]
+    keys = [key for key, _ in group]
+    pages = [page for _, page in group]
+    estimated_tokens = (
+        len(prompt) // 4 + sum(page['image_tokens'] for page in pages)
+        + min(VISION_MAX_TOKENS * len(pages), VISION_PACKED_MAX_TOKENS)
+    )
+    request = scheduler.submit(ocr_pages_packed_cached, cache, keys, prompt, pages, estimated_tokens=estimated_tokens)
+    page_futures = [Future() for _ in group]
+    request.add_done_callback(partial(_fan_out, cache, prompt, group, page_futures))
+    return request, page_futures
+
+
+def page_cache_key(prompt, page):
+    return cache_key(page['image'], OPENAI_VISION_MODEL, prompt, IMAGE_DPI)
+
+
+def pdf_path_for(instrument_id, document_type=None):
+    return os.path.join(f"{PDF_DIRECTORY}/{document_type or DOCUMENT_TYPE}", f"{instrument_id}.pdf")
+
+
+def write_page_text(output_dir, instrument_id, page_num, text, checkpoint=None, source='vision'):
+    """Saves one page's text as {instrument_id}_page_{page_num}.txt and records it in the checkpoint."""
+    txt_filepath = page_text_path(output_dir, instrument_id, page_num)
+    with open(txt_filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    if checkpoint is not None:
+        checkpoint.mark_done(page_num, text, source)
+    logger.info('Saved page response to file.', extra={'context': {'txt_filepath': txt_filepath}})
+    print(f"💾 Saved page {page_num} response to {txt_filepath}")
+    return txt_filepath
+
+
+def write_combined_text(output_dir, instrument_id, page_texts):
+    """Writes the combined {instrument_id}.txt from (page_num, text) pairs, with '--- Page N ---' markers."""
+    txt_filepath = os.path.join(output_dir, f"{instrument_id}.txt")
+    with open(txt_filepath, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f"--- Page {page_num} ---\n{text}\n" for page_num, text in page_texts))
+    logger.info('Saved combined response to file.', extra={'context': {'txt_filepath': txt_filepath}})
+    print(f"💾 Saved combined response to {txt_filepath}")
+    return txt_filepath
+
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _save_page_result(output_dir, instrument_id, page_num, checkpoint, page_failed, future):
+    """Done-callback for a page's OCR future: writes and checkpoints the text, or flags the failure."""
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        page_failed.set()
+        return
+    write_page_text(output_dir, instrument_id, page_num, future.result(), checkpoint)
+
+
 def extract_vision_summary(db, instrument_id: str, document_type: str):
     logger.info('Starting vision extraction.', extra={'context': {'instrument_id': instrument_id, 'document_type': document_type}})
-    pdf_directory = f"{PDF_DIRECTORY}/{document_type}"  # Remove duplicated COUNTY_COLLECTION and COUNTY_NAMESPACE
-    pdf_path = os.path.join(pdf_directory, f"{instrument_id}.pdf")
+    pdf_path = pdf_path_for(instrument_id, document_type)
     if not os.path.exists(pdf_path):
         logger.error('PDF file not found.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path}})
         print(f"❌ Error: PDF file not found for instrument {instrument_id} at {pdf_path}")
         return None
     print(f"👁️‍🗨️ Starting vision extraction for Instrument: {instrument_id}")
     try:
-        logger.info('Converting PDF to images.', extra={'context': {'instrument_id': instrument_id}})
-        base64_images = pdf_to_base64_images(pdf_path, max_pages=MAX_PAGES_TO_PROCESS)
-        if not base64_images:
-            logger.warning('No images generated from PDF.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path}})
-            print(f"⚠️ Warning: No images were generated from {pdf_path}. Aborting vision extraction.")
-            return None
-        logger.info('Prepared vision prompt.', extra={'context': {'instrument_id': instrument_id}})
-        prompt = get_vision_prompt()
         output_dir = os.path.join(EXTRACTED_TEXT_DIRECTORY, instrument_id)
         os.makedirs(output_dir, exist_ok=True)
         logger.info('Created output directory for text files.', extra={'context': {'output_dir': output_dir}})
-        all_responses = []
-        for i, base64_image in enumerate(base64_images):
-            logger.info('Processing page.', extra={'context': {'instrument_id': instrument_id, 'page_num': i + 1}})
-            print(f"Processing page {i + 1} of {len(base64_images)}...")
-            
-            # Prepare message for single image
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
-                    ],
-                }
-            ]
-
-            # Send single image to OpenAI API
-            print(f"Sending page {i + 1} to OpenAI Vision API...")
-            response = client.chat.completions.create(
-                model=OPENAI_VISION_MODEL,
-                messages=messages,
-                max_tokens=2048,
-            )
-            response_text = response.choices[0].message.content
-            
-            # Save response to individual text file
-            txt_filename = f"{instrument_id}_page_{i + 1}.txt"
-            txt_filepath = os.path.join(output_dir, txt_filename)
-            
-            with open(txt_filepath, 'w', encoding='utf-8') as f:
-                f.write(response_text)
-            
-            logger.info('Saved page response to file.', extra={'context': {'txt_filepath': txt_filepath}})
-            print(f"💾 Saved page {i + 1} response to {txt_filepath}")
-            all_responses.append(f"--- Page {i + 1} ---\n{response_text}\n")
-
-        # Write all responses to a single file
-        txt_filename = f"{instrument_id}.txt"
-        txt_filepath = os.path.join(output_dir, txt_filename)
-        with open(txt_filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(all_responses))
-        
-        logger.info('Saved combined response to file.', extra={'context': {'txt_filepath': txt_filepath}})
-        print(f"💾 Saved combined response to {txt_filepath}")
+        # Pages finished by an earlier, interrupted run are reused, not rendered or sent again
+        checkpoint = PageCheckpoint(output_dir, instrument_id, pdf_path)
+        completed = checkpoint.completed_pages()
+        if completed:
+            logger.info('Resuming from page checkpoint.', extra={'context': {'instrument_id': instrument_id, 'completed_pages': sorted(completed)}})
+        logger.info('Prepared vision prompt.', extra={'context': {'instrument_id': instrument_id}})
+        prompt = get_vision_prompt()
+        # Pages seen before (same image, model, prompt and DPI) come from the OCR cache;
+        # the rest go to the scheduler as soon as they are rendered, where they
+        # interleave with other documents' pages
+        cache = get_ocr_cache()
+        results = []  # (page_num, future of its text), in page order
+        outstanding = set()
+        page_failed = threading.Event()
+        cached_pages = 0
+        logger.info('Converting PDF to images.', extra={'context': {'instrument_id': instrument_id}})
+        group = []  # (cache key, page) pairs waiting to fill a packed request
+        requests = []
+        pages_in_flight = max(1, VISION_PAGES_IN_FLIGHT // VISION_PAGES_PER_REQUEST) * VISION_PAGES_PER_REQUEST
+
+        def submit(group):
+            request, page_futures = submit_page_group(cache, prompt, group)
+            for (_, page), future in zip(group, page_futures):
+                # Every page that comes back is written and checkpointed right away, even
+                # after another page failed, so the next run only sends what is missing
+                future.add_done_callback(partial(_save_page_result, output_dir, instrument_id, page['page_num'], checkpoint, page_failed))
+                results.append((page['page_num'], future))
+            # Pages of an unsplittable packed answer outlive their request, so count pages
+            outstanding.update(page_futures)
+            requests.append(request)
+
+        pages = iter_page_inputs(pdf_path, MAX_PAGES_TO_PROCESS, completed)
+        try:
+            for page in pages:
+                page_num = page['page_num']
+                if 'checkpoint_text' in page:
+                    results.append((page_num, _resolved(page['checkpoint_text'])))
+                    continue
+                if 'native_text' in page:
+                    write_page_text(output_dir, instrument_id, page_num, page['native_text'], checkpoint, 'native')
+                    results.append((page_num, _resolved(page['native_text'])))
+                    continue
+                key = page_cache_key(prompt, page)
+                cached_text = cache.get(key)
+                if cached_text is not None:
+                    write_page_text(output_dir, instrument_id, page_num, cached_text, checkpoint)
+                    results.append((page_num, _resolved(cached_text)))
+                    cached_pages += 1
+                    continue
+                group.append((key, page))
+                if len(group) < VISION_PAGES_PER_REQUEST:
+                    continue
+                # Hold at most VISION_PAGES_IN_FLIGHT page images for this document
+                while len(outstanding) >= pages_in_flight:
+                    _, outstanding = wait(outstanding, return_when=FIRST_COMPLETED)
+                if page_failed.is_set():
+                    break  # The document already failed; don't spend quota on the rest
+                submit(group)
+                group = []
+            else:
+                if group and not page_failed.is_set():
+                    submit(group)  # The last, partly filled request
+        finally:
+            pages.close()
+        # Packed pages are queued after any cached page that followed them
+        results.sort(key=lambda result: result[0])
+        if not results:
+            logger.warning('No pages prepared from PDF.', extra={'context': {'instrument_id': instrument_id, 'pdf_path': pdf_path}})
+            print(f"⚠️ Warning: No pages were prepared from {pdf_path}. Aborting vision extraction.")
+            return None
+        logger.info('Submitted pages to vision scheduler.', extra={'context': {'instrument_id': instrument_id, 'pages': len(results), 'cached_pages': cached_pages}})
+
+        page_texts = []
+        failed_pages = []
+        for page_num, future in results:
+            try:
+                page_texts.append((page_num, future.result()))
+            except CancelledError:
+                failed_pages.append(page_num)
+            except Exception as e:
+                failed_pages.append(page_num)
+                logger.error('Page extraction failed.', extra={'context': {'instrument_id': instrument_id, 'page_num': page_num, 'error': str(e)}})
+                # A failed page fails the document; don't spend quota on pages not started yet
+                for pending in requests + [future for _, future in results]:
+                    pending.cancel()
+        if failed_pages or page_failed.is_set():
+            logger.error('Vision extraction incomplete; finished pages are checkpointed.', extra={'context': {'instrument_id': instrument_id, 'failed_pages': failed_pages, 'completed_pages': len(page_texts)}})
+            print(f"❌ Vision extraction failed for {instrument_id} on pages {failed_pages}; the next run resumes from the checkpoint.")
+            return None
+
+        # Write all responses to a single file, only now that every page is present
+        write_combined_text(output_dir, instrument_id, page_texts)
+        if FIELD_EXTRACTION_ENABLED:
+            # Typed record ({instrument_id}.json) for combine_liens
+            extract_record(output_dir, instrument_id, '\n'.join(text for _, text in page_texts), document_type)
         logger.info('Vision extraction completed successfully.', extra={'context': {'instrument_id': instrument_id}})
         print(f"✅ Successfully extracted vision summary for {instrument_id}")
-        logger.info('Updating Firebase with vision status.', extra={'context': {'instrument_id': instrument_id}})
-        print("Updating Firebase with vision_summary...")
-        doc_ref = db.collection(COUNTY_COLLECTION) \
-            .document(COUNTY_NAMESPACE) \
-            .collection(DOCUMENT_TYPE) \
-            .document(instrument_id)
-        
-        doc_ref.update({
+        logger.info('Updating job store with vision status.', extra={'context': {'instrument_id': instrument_id}})
+        # Firestore picks this up asynchronously through the job store mirror
+        get_job_store().update(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id, {
             "status": "vision_extracted"
         })
-        logger.info('Firebase updated successfully.', extra={'context': {'instrument_id': instrument_id}})
-        print(f"💾 Firebase updated successfully for {instrument_id}.")
-        return f"💾 Firebase updated successfully for {instrument_id}."
+        logger.info('Job store updated successfully.', extra={'context': {'instrument_id': instrument_id}})
+        print(f"💾 Status updated successfully for {instrument_id}.")
+        return f"💾 Status updated successfully for {instrument_id}."
     except Exception as e:
         logger.error('Unexpected error during vision extraction.', extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
         print(f"❌ An unexpected error occurred during vision extraction for {instrument_id}: {e}")
         return None
 
 
+def seed_job_store(db, jobs, status):
+    """
+    The first time a stage reads `status` from the local job store, imports the
+    records Firestore already has in it, so work queued before the store existed isn't lost.
+    """
+    if jobs.imported(COUNTY_NAMESPACE, DOCUMENT_TYPE, status):
+        return 0
+    collection_ref = db.collection(COUNTY_COLLECTION) \
+        .document(COUNTY_NAMESPACE) \
+        .collection(DOCUMENT_TYPE)
+    records = collection_ref.where('status', '==', status).get(retry=Retry())
+    return jobs.import_records(COUNTY_NAMESPACE, DOCUMENT_TYPE, records, status)
+
+
 def main():
     logger.info('Starting main function.', extra={'context': {'step': 'main_start'}})
+    if VISION_MODE == 'batch':
+        import vision_batch
+        return vision_batch.main()
+    get_client()  # Fails fast without an API key
     db = init_firebase()
     logger.info('Initialized Firebase.', extra={'context': {'step': 'firebase_init'}})
+    jobs = get_job_store()
+    mirror = start_firestore_mirror(db, COUNTY_COLLECTION)
+    seed_job_store(db, jobs, 'pdf_downloaded')
     
-    # Query Firebase for records with status 'pdf_downloaded' using nested path
-    collection_ref = db.collection(COUNTY_COLLECTION) \
-        .document(COUNTY_NAMESPACE) \
-        .collection(DOCUMENT_TYPE)
-    records = collection_ref.where('status', '==', 'pdf_downloaded').get(retry=Retry())
+    # Claim records with status 'pdf_downloaded' from the local job store and work on
+    # several at once, so pages from different documents share the API budget
+    failed = []
     
-    for record in records:
-        instrument_id = record.id
+    def process(instrument_id):
         logger.info('Processing record.', extra={'context': {'instrument_id': instrument_id}})
         print(f"Processing {instrument_id}...")
         try:
-            extract_vision_summary(db, instrument_id, DOCUMENT_TYPE)
+            if extract_vision_summary(db, instrument_id, DOCUMENT_TYPE) is None:
+                failed.append(instrument_id)
+                return
             logger.info('Processed record successfully.', extra={'context': {'instrument_id': instrument_id}})
             print(f"✅ Processed {instrument_id}")
         except Exception as e:
+            failed.append(instrument_id)
             logger.error('Error processing record.', extra={'context': {'instrument_id': instrument_id, 'error': str(e)}})
             print(f"❌ Error processing {instrument_id}: {e}")
-    logger.info('Main function completed.', extra={'context': {'step': 'main_end'}})
+    
+    # Claims are renewed until every document is done, failed ones included
+    worker_id = new_worker_id()
+    with jobs.holding_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, worker_id), \
+            ThreadPoolExecutor(max_workers=max(1, VISION_DOCUMENT_WORKERS)) as executor:
+        in_flight = set()
+        for instrument_id, _ in jobs.iter_claims(COUNTY_NAMESPACE, DOCUMENT_TYPE, 'pdf_downloaded', worker_id=worker_id):
+            # Keep only a bounded number of documents (and their rendered pages) queued
+            if len(in_flight) >= VISION_DOCUMENT_WORKERS * 2:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.add(executor.submit(process, instrument_id))
+    logger.info('Vision scheduler summary.', extra={'context': {'step': 'vision_scheduler', **scheduler.summary()}})
+    logger.info('Vision payload summary.', extra={'context': {'step': 'vision_payload', 'profile': IMAGE_SETTINGS, **payload_stats}})
+    logger.info('OCR cache summary.', extra={'context': {'step': 'ocr_cache', **get_ocr_cache().stats()}})
+    # Failed records keep their status; release them so the next run retries right away
+    for instrument_id in failed:
+        jobs.release(COUNTY_NAMESPACE, DOCUMENT_TYPE, instrument_id)
+    mirror.stop()
+    logger.info('Main function completed.', extra={'context': {'step': 'main_end', 'failed': len(failed)}})
 
 if __name__ == '__main__':
     main()